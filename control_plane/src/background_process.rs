@@ -26,6 +26,7 @@
 use nix::errno::Errno;
 use nix::fcntl::{FcntlArg, FdFlag};
 use nix::sys::signal::{Signal, kill};
+use nix::sys::wait::{WaitPidFlag, WaitStatus, waitpid};
 use nix::unistd::Pid;
 use utils::pid_file::{self, PidFileRead};
 
@@ -387,6 +388,16 @@ async fn process_started<F, Fut>(
 }
 
 pub(crate) fn process_has_stopped(pid: Pid) -> anyhow::Result<bool> {
+    // A child of ours that has exited stays a zombie, and signalling it still succeeds,
+    // until it is reaped. `neon_local batch` outlives the processes it spawns (compute_ctl
+    // of `endpoint start`), so reap them here.
+    match waitpid(pid, Some(WaitPidFlag::WNOHANG)) {
+        Ok(WaitStatus::StillAlive) => return Ok(false),
+        Ok(_) => return Ok(true),
+        // Not a child of ours, fall back to checking if it exists
+        Err(Errno::ECHILD) => {}
+        Err(err) => anyhow::bail!("Failed to wait for process with pid {pid}: {err}"),
+    }
     match kill(pid, None) {
         // Process exists, keep waiting
         Ok(_) => Ok(false),
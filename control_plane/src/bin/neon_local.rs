@@ -8,11 +8,12 @@
 use std::borrow::Cow;
 use std::collections::{BTreeSet, HashMap};
 use std::fs::File;
+use std::io::Write;
 use std::os::fd::AsRawFd;
 use std::path::PathBuf;
 use std::process::exit;
 use std::str::FromStr;
-use std::time::Duration;
+use std::time::{Duration, Instant};
 
 use anyhow::{Context, Result, anyhow, bail};
 use clap::Parser;
@@ -102,6 +103,7 @@ enum NeonLocalCmd {
 
     Start(StartCmdArgs),
     Stop(StopCmdArgs),
+    Batch(BatchCmdArgs),
 }
 
 #[derive(clap::Args)]
@@ -134,6 +136,19 @@ struct StopCmdArgs {
     mode: StopMode,
 }
 
+#[derive(clap::Args)]
+#[clap(
+    about = "Run commands read from stdin in a single process",
+    long_about = "Run commands read from stdin in a single process, to save the process \
+                  startup and config loading of running them one by one. Each line of \
+                  input is a JSON array with the arguments of one command, e.g. \
+                  [\"timeline\", \"branch\", \"--branch-name\", \"b1\"]. After each command, \
+                  a line starting with the batch result marker and holding a JSON object \
+                  with its exit code, error and duration is printed to stdout. The \
+                  repository is locked until stdin is closed."
+)]
+struct BatchCmdArgs {}
+
 #[derive(Clone, Copy, clap::ValueEnum)]
 enum StopMode {
     Fast,
@@ -753,10 +768,10 @@ struct RepoLock {
 }
 
 impl RepoLock {
-    fn new() -> Result<Self> {
+    fn new(mode: FlockArg) -> Result<Self> {
         let repo_dir = File::open(local_env::base_path())?;
         let repo_dir_fd = repo_dir.as_raw_fd();
-        flock(repo_dir_fd, FlockArg::LockExclusive)?;
+        flock(repo_dir_fd, mode)?;
 
         Ok(Self { _file: repo_dir })
     }
@@ -779,7 +794,13 @@ fn main() -> Result<()> {
         // This tool uses a collection of simple files to store its state, and consequently
         // it is not generally safe to run multiple commands concurrently.  Rather than expect
         // all callers to know this, use a lock file to protect against concurrent execution.
-        let _repo_lock = RepoLock::new().unwrap();
+        // Commands that only read the repository can share it, e.g. so that the endpoints
+        // of many tenants can be reconfigured at once during shard migrations.
+        let lock_mode = match &cli.command {
+            NeonLocalCmd::Endpoint(EndpointCmd::Reconfigure(_)) => FlockArg::LockShared,
+            _ => FlockArg::LockExclusive,
+        };
+        let _repo_lock = RepoLock::new(lock_mode).unwrap();
 
         // all other commands need an existing config
         let env = LocalEnv::load_config(&local_env::base_path()).context("Error loading config")?;
@@ -791,22 +812,8 @@ fn main() -> Result<()> {
             .unwrap();
 
         let subcommand_result = match cli.command {
-            NeonLocalCmd::Init(_) => unreachable!("init was handled earlier already"),
-            NeonLocalCmd::Start(args) => rt.block_on(handle_start_all(&args, env)),
-            NeonLocalCmd::Stop(args) => rt.block_on(handle_stop_all(&args, env)),
-            NeonLocalCmd::Tenant(subcmd) => rt.block_on(handle_tenant(&subcmd, env)),
-            NeonLocalCmd::Timeline(subcmd) => rt.block_on(handle_timeline(&subcmd, env)),
-            NeonLocalCmd::Pageserver(subcmd) => rt.block_on(handle_pageserver(&subcmd, env)),
-            NeonLocalCmd::StorageController(subcmd) => {
-                rt.block_on(handle_storage_controller(&subcmd, env))
-            }
-            NeonLocalCmd::StorageBroker(subcmd) => rt.block_on(handle_storage_broker(&subcmd, env)),
-            NeonLocalCmd::Safekeeper(subcmd) => rt.block_on(handle_safekeeper(&subcmd, env)),
-            NeonLocalCmd::EndpointStorage(subcmd) => {
-                rt.block_on(handle_endpoint_storage(&subcmd, env))
-            }
-            NeonLocalCmd::Endpoint(subcmd) => rt.block_on(handle_endpoint(&subcmd, env)),
-            NeonLocalCmd::Mappings(subcmd) => handle_mappings(&subcmd, env),
+            NeonLocalCmd::Batch(_) => handle_batch(env, &rt),
+            command => run_command(command, env, &rt),
         };
 
         let subcommand_result = if &original_env != env {
@@ -828,6 +835,88 @@ fn main() -> Result<()> {
     Ok(())
 }
 
+/// Run a command other than `init` and `batch`
+fn run_command(
+    command: NeonLocalCmd,
+    env: &mut local_env::LocalEnv,
+    rt: &tokio::runtime::Runtime,
+) -> Result<()> {
+    match command {
+        NeonLocalCmd::Init(_) => bail!("init can only be run on its own"),
+        NeonLocalCmd::Batch(_) => bail!("batches can't be nested"),
+        NeonLocalCmd::Start(args) => {
+            // The services started in the background borrow the config for good
+            let env = Box::leak(Box::new(env.clone()));
+            rt.block_on(handle_start_all(&args, env))
+        }
+        NeonLocalCmd::Stop(args) => rt.block_on(handle_stop_all(&args, env)),
+        NeonLocalCmd::Tenant(subcmd) => rt.block_on(handle_tenant(&subcmd, env)),
+        NeonLocalCmd::Timeline(subcmd) => rt.block_on(handle_timeline(&subcmd, env)),
+        NeonLocalCmd::Pageserver(subcmd) => rt.block_on(handle_pageserver(&subcmd, env)),
+        NeonLocalCmd::StorageController(subcmd) => {
+            rt.block_on(handle_storage_controller(&subcmd, env))
+        }
+        NeonLocalCmd::StorageBroker(subcmd) => rt.block_on(handle_storage_broker(&subcmd, env)),
+        NeonLocalCmd::Safekeeper(subcmd) => rt.block_on(handle_safekeeper(&subcmd, env)),
+        NeonLocalCmd::EndpointStorage(subcmd) => rt.block_on(handle_endpoint_storage(&subcmd, env)),
+        NeonLocalCmd::Endpoint(subcmd) => rt.block_on(handle_endpoint(&subcmd, env)),
+        NeonLocalCmd::Mappings(subcmd) => handle_mappings(&subcmd, env),
+    }
+}
+
+/// Printed at the start of the line that reports the result of each command of a batch
+const BATCH_RESULT_MARKER: &str = "\u{1e}neon_local batch result: ";
+
+/// Run the commands read from stdin one by one, see [`BatchCmdArgs`].
+///
+/// The config is persisted after every command that changes it, and left as it was
+/// if a command fails, the same as when the commands are run separately.
+fn handle_batch(env: &mut local_env::LocalEnv, rt: &tokio::runtime::Runtime) -> Result<()> {
+    let mut persisted = env.clone();
+    for line in std::io::stdin().lines() {
+        let line = line.context("reading batch commands")?;
+        if line.trim().is_empty() {
+            continue;
+        }
+        let started = Instant::now();
+        let result = run_batch_command(&line, env, rt).and_then(|()| {
+            if *env != persisted {
+                env.persist_config()?;
+                persisted = env.clone();
+            }
+            Ok(())
+        });
+        let error = match result {
+            Ok(()) => None,
+            Err(e) => {
+                *env = persisted.clone();
+                eprintln!("command failed: {e:?}");
+                Some(format!("{e:?}"))
+            }
+        };
+        let report = serde_json::json!({
+            "exit_code": if error.is_some() { 1 } else { 0 },
+            "error": error,
+            "elapsed_secs": started.elapsed().as_secs_f64(),
+        });
+        let mut stdout = std::io::stdout().lock();
+        writeln!(stdout, "{BATCH_RESULT_MARKER}{report}")?;
+        stdout.flush()?;
+    }
+    Ok(())
+}
+
+fn run_batch_command(
+    line: &str,
+    env: &mut local_env::LocalEnv,
+    rt: &tokio::runtime::Runtime,
+) -> Result<()> {
+    let args: Vec<String> =
+        serde_json::from_str(line).context("batch commands must be JSON arrays of arguments")?;
+    let cli = Cli::try_parse_from(std::iter::once("neon_local".to_string()).chain(args))?;
+    run_command(cli.command, env, rt)
+}
+
 ///
 /// Prints timelines list as a tree-like structure.
 ///
@@ -1635,8 +1724,7 @@ async fn handle_pageserver(subcmd: &PageserverCmd, env: &local_env::LocalEnv) ->
                 .start(&args.start_timeout)
                 .await
             {
-                eprintln!("pageserver start failed: {e}");
-                exit(1);
+                bail!("pageserver start failed: {e}");
             }
         }
 
@@ -1646,8 +1734,7 @@ async fn handle_pageserver(subcmd: &PageserverCmd, env: &local_env::LocalEnv) ->
                 StopMode::Immediate => true,
             };
             if let Err(e) = get_pageserver(env, args.pageserver_id)?.stop(immediate) {
-                eprintln!("pageserver stop failed: {}", e);
-                exit(1);
+                bail!("pageserver stop failed: {e}");
             }
         }
 
@@ -1655,13 +1742,11 @@ async fn handle_pageserver(subcmd: &PageserverCmd, env: &local_env::LocalEnv) ->
             let pageserver = get_pageserver(env, args.pageserver_id)?;
             //TODO what shutdown strategy should we use here?
             if let Err(e) = pageserver.stop(false) {
-                eprintln!("pageserver stop failed: {}", e);
-                exit(1);
+                bail!("pageserver stop failed: {e}");
             }
 
             if let Err(e) = pageserver.start(&args.start_timeout).await {
-                eprintln!("pageserver start failed: {e}");
-                exit(1);
+                bail!("pageserver start failed: {e}");
             }
         }
 
@@ -1671,10 +1756,7 @@ async fn handle_pageserver(subcmd: &PageserverCmd, env: &local_env::LocalEnv) ->
                 .await
             {
                 Ok(_) => println!("Page server is up and running"),
-                Err(err) => {
-                    eprintln!("Page server is not available: {}", err);
-                    exit(1);
-                }
+                Err(err) => bail!("Page server is not available: {err}"),
             }
         }
     }
@@ -1695,8 +1777,7 @@ async fn handle_storage_controller(
             };
 
             if let Err(e) = svc.start(start_args).await {
-                eprintln!("start failed: {e}");
-                exit(1);
+                bail!("start failed: {e}");
             }
         }
 
@@ -1709,8 +1790,7 @@ async fn handle_storage_controller(
                 },
             };
             if let Err(e) = svc.stop(stop_args).await {
-                eprintln!("stop failed: {}", e);
-                exit(1);
+                bail!("stop failed: {e}");
             }
         }
     }
@@ -1731,8 +1811,7 @@ async fn handle_safekeeper(subcmd: &SafekeeperCmd, env: &local_env::LocalEnv) ->
             let safekeeper = get_safekeeper(env, args.id)?;
 
             if let Err(e) = safekeeper.start(&args.extra_opt, &args.start_timeout).await {
-                eprintln!("safekeeper start failed: {}", e);
-                exit(1);
+                bail!("safekeeper start failed: {e}");
             }
         }
 
@@ -1743,8 +1822,7 @@ async fn handle_safekeeper(subcmd: &SafekeeperCmd, env: &local_env::LocalEnv) ->
                 StopMode::Immediate => true,
             };
             if let Err(e) = safekeeper.stop(immediate) {
-                eprintln!("safekeeper stop failed: {}", e);
-                exit(1);
+                bail!("safekeeper stop failed: {e}");
             }
         }
 
@@ -1756,13 +1834,11 @@ async fn handle_safekeeper(subcmd: &SafekeeperCmd, env: &local_env::LocalEnv) ->
             };
 
             if let Err(e) = safekeeper.stop(immediate) {
-                eprintln!("safekeeper stop failed: {}", e);
-                exit(1);
+                bail!("safekeeper stop failed: {e}");
             }
 
             if let Err(e) = safekeeper.start(&args.extra_opt, &args.start_timeout).await {
-                eprintln!("safekeeper start failed: {}", e);
-                exit(1);
+                bail!("safekeeper start failed: {e}");
             }
         }
     }
@@ -1789,8 +1865,7 @@ async fn handle_endpoint_storage(
     match subcmd {
         Start(EndpointStorageStartCmd { start_timeout }) => {
             if let Err(e) = storage.start(start_timeout).await {
-                eprintln!("endpoint_storage start failed: {e}");
-                exit(1);
+                bail!("endpoint_storage start failed: {e}");
             }
         }
         Stop(EndpointStorageStopCmd { stop_mode }) => {
@@ -1799,8 +1874,7 @@ async fn handle_endpoint_storage(
                 StopMode::Immediate => true,
             };
             if let Err(e) = storage.stop(immediate) {
-                eprintln!("proxy stop failed: {e}");
-                exit(1);
+                bail!("proxy stop failed: {e}");
             }
         }
     };
@@ -1812,8 +1886,7 @@ async fn handle_storage_broker(subcmd: &StorageBrokerCmd, env: &local_env::Local
         StorageBrokerCmd::Start(args) => {
             let storage_broker = StorageBroker::from_env(env);
             if let Err(e) = storage_broker.start(&args.start_timeout).await {
-                eprintln!("broker start failed: {e}");
-                exit(1);
+                bail!("broker start failed: {e}");
             }
         }
 
@@ -1821,8 +1894,7 @@ async fn handle_storage_broker(subcmd: &StorageBrokerCmd, env: &local_env::Local
             // FIXME: stop_mode unused
             let storage_broker = StorageBroker::from_env(env);
             if let Err(e) = storage_broker.stop() {
-                eprintln!("broker stop failed: {e}");
-                exit(1);
+                bail!("broker stop failed: {e}");
             }
         }
     }
@@ -1841,8 +1913,6 @@ async fn handle_start_all(
         return Ok(());
     };
 
-    eprintln!("startup failed because one or more services could not be started");
-
     for e in errors {
         eprintln!("{e}");
         let debug_repr = format!("{e:?}");
@@ -1853,7 +1923,7 @@ async fn handle_start_all(
 
     try_stop_all(env, true).await;
 
-    exit(2);
+    bail!("startup failed because one or more services could not be started");
 }
 
 /// Returns Ok() if and only if all services could be started successfully.
@@ -3,18 +3,27 @@
 from __future__ import annotations
 
 import argparse
+import io
 import json
 import logging
 import os
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
 from contextlib import contextmanager
-from datetime import datetime
+from datetime import UTC, datetime
 from pathlib import Path
+from typing import TYPE_CHECKING
 
 import backoff
 import psycopg2
 import psycopg2.extras
 
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+    from concurrent.futures import Future
+    from typing import Any
+
 CREATE_TABLE = """
 CREATE TABLE IF NOT EXISTS perf_test_results (
     id SERIAL PRIMARY KEY,
@@ -27,9 +36,30 @@ CREATE TABLE IF NOT EXISTS perf_test_results (
     metric_report_type TEXT,
     recorded_at_timestamp TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
     labels JSONB with default '{}'
-)
+);
+CREATE INDEX IF NOT EXISTS perf_test_results_ingest_key
+    ON perf_test_results (recorded_at_timestamp, revision, platform, suit);
 """
 
+COPY_COLUMNS = """(
+    suit,
+    revision,
+    platform,
+    metric_name,
+    metric_value,
+    metric_unit,
+    metric_report_type,
+    recorded_at_timestamp,
+    labels
+)"""
+
+# The results of a suit in a result file are identified by (revision, platform,
+# recorded_at_timestamp, suit): bulk ingest skips those that are already in the table.
+IngestKey = tuple[str, str, int, str]
+
+# Escapes for COPY's text format
+COPY_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
 
 def err(msg):
     print(f"error: {msg}")
@@ -61,55 +91,52 @@ def create_table(cur):
     cur.execute(CREATE_TABLE)
 
 
-def ingest_perf_test_result(cursor, data_file: Path, recorded_at_timestamp: int) -> int:
-    run_data = json.loads(data_file.read_text())
-    revision = run_data["revision"]
-    platform = run_data["platform"]
+def recorded_at(data_file: Path) -> int:
+    return int(data_file.name.split("_")[0])
 
-    run_result = run_data["result"]
-    args_list = []
 
-    for suit_result in run_result:
+def perf_test_result_metrics(run_data: dict[str, Any]) -> Iterator[tuple[str, dict[str, Any]]]:
+    """(suit, metric) for each metric in a result file, including the suits' total durations"""
+    for suit_result in run_data["result"]:
         suit = suit_result["suit"]
-        total_duration = suit_result["total_duration"]
-
-        suit_result["data"].append(
+        for metric in suit_result["data"]:
+            yield suit, metric
+        yield (
+            suit,
             {
                 "name": "total_duration",
-                "value": total_duration,
+                "value": suit_result["total_duration"],
                 "unit": "s",
                 "report": "lower_is_better",
-            }
+            },
         )
 
-        for metric in suit_result["data"]:
-            values = {
-                "suit": suit,
-                "revision": revision,
-                "platform": platform,
-                "metric_name": metric["name"],
-                "metric_value": metric["value"],
-                "metric_unit": metric["unit"],
-                "metric_report_type": metric["report"],
-                "recorded_at_timestamp": datetime.utcfromtimestamp(recorded_at_timestamp),
-                "labels": json.dumps(metric.get("labels")),
-            }
-            args_list.append(values)
+
+def ingest_perf_test_result(cursor, data_file: Path, recorded_at_timestamp: int) -> int:
+    run_data = json.loads(data_file.read_text())
+    revision = run_data["revision"]
+    platform = run_data["platform"]
+
+    args_list = []
+
+    for suit, metric in perf_test_result_metrics(run_data):
+        values = {
+            "suit": suit,
+            "revision": revision,
+            "platform": platform,
+            "metric_name": metric["name"],
+            "metric_value": metric["value"],
+            "metric_unit": metric["unit"],
+            "metric_report_type": metric["report"],
+            "recorded_at_timestamp": datetime.utcfromtimestamp(recorded_at_timestamp),
+            "labels": json.dumps(metric.get("labels")),
+        }
+        args_list.append(values)
 
     psycopg2.extras.execute_values(
         cursor,
-        """
-        INSERT INTO perf_test_results (
-            suit,
-            revision,
-            platform,
-            metric_name,
-            metric_value,
-            metric_unit,
-            metric_report_type,
-            recorded_at_timestamp,
-            labels
-        ) VALUES %s
+        f"""
+        INSERT INTO perf_test_results {COPY_COLUMNS} VALUES %s
         """,
         args_list,
         template="""(
@@ -127,6 +154,139 @@ def ingest_perf_test_result(cursor, data_file: Path, recorded_at_timestamp: int)
     return len(args_list)
 
 
+def copy_field(value: Any) -> str:
+    if value is None:
+        return "\\N"
+    return str(value).translate(COPY_ESCAPES)
+
+
+# Keys of the results that are already in the table, set in each worker process
+_ingested_keys: set[IngestKey] = set()
+
+
+def init_encode_worker(ingested_keys: set[IngestKey]):
+    global _ingested_keys
+    _ingested_keys = ingested_keys
+
+
+def encode_perf_test_result(data_file: Path) -> tuple[bytes, int, int]:
+    """
+    Encode the metrics of a result file as COPY text rows, leaving out the suits
+    that were already ingested. Returns (data, rows, skipped suits).
+    """
+    run_data = json.loads(data_file.read_bytes())
+    revision = run_data["revision"]
+    platform = run_data["platform"]
+    timestamp = recorded_at(data_file)
+    recorded_at_timestamp = datetime.fromtimestamp(timestamp, tz=UTC).isoformat()
+
+    lines = []
+    skipped = set()
+    for suit, metric in perf_test_result_metrics(run_data):
+        if (revision, platform, timestamp, suit) in _ingested_keys:
+            skipped.add(suit)
+            continue
+        fields = (
+            suit,
+            revision,
+            platform,
+            metric["name"],
+            metric["value"],
+            metric["unit"],
+            metric["report"],
+            recorded_at_timestamp,
+            json.dumps(metric.get("labels")),
+        )
+        lines.append("\t".join(copy_field(f) for f in fields))
+
+    data = "".join(f"{line}\n" for line in lines).encode()
+    return data, len(lines), len(skipped)
+
+
+def fetch_ingested_keys(cur, files: list[Path]) -> set[IngestKey]:
+    timestamps = [recorded_at(f) for f in files]
+    cur.execute(
+        """
+        SELECT DISTINCT revision, platform, recorded_at_timestamp, suit
+        FROM perf_test_results
+        WHERE recorded_at_timestamp BETWEEN to_timestamp(%s) AND to_timestamp(%s)
+        """,
+        (min(timestamps), max(timestamps)),
+    )
+    return {
+        (revision.rstrip(), platform, int(ts.timestamp()), suit)
+        for revision, platform, ts, suit in cur.fetchall()
+    }
+
+
+def copy_batch(cur, batch: list[bytes]):
+    """COPY the encoded rows of a batch of files in one transaction"""
+    cur.execute("BEGIN")
+    try:
+        cur.copy_expert(
+            f"COPY perf_test_results {COPY_COLUMNS} FROM STDIN", io.BytesIO(b"".join(batch))
+        )
+    except BaseException:
+        cur.execute("ROLLBACK")
+        raise
+    cur.execute("COMMIT")
+
+
+def bulk_ingest(cur, files: list[Path], jobs: int, batch_files: int, dry_run: bool):
+    """
+    Parse and encode result files in a pool of `jobs` processes, and COPY them
+    `batch_files` files per transaction. With `cur` set to None (dry run), nothing
+    is written, and already ingested results are not skipped.
+    """
+    ingested_keys = fetch_ingested_keys(cur, files) if cur is not None and files else set()
+
+    started_at = time.monotonic()
+    total_files = total_rows = total_bytes = skipped_suits = 0
+    batch: list[bytes] = []
+
+    def flush():
+        if batch and not dry_run:
+            copy_batch(cur, batch)
+        batch.clear()
+
+    with ProcessPoolExecutor(
+        max_workers=jobs, initializer=init_encode_worker, initargs=(ingested_keys,)
+    ) as executor:
+        # Keep a bounded number of files in flight, in order
+        pending: list[tuple[Path, Future[tuple[bytes, int, int]]]] = []
+        remaining = iter(files)
+        while True:
+            for item in remaining:
+                pending.append((item, executor.submit(encode_perf_test_result, item)))
+                if len(pending) >= 2 * jobs:
+                    break
+            if not pending:
+                break
+
+            item, fut = pending.pop(0)
+            data, rows, skipped = fut.result()
+            total_files += 1
+            total_rows += rows
+            total_bytes += len(data)
+            skipped_suits += skipped
+            if rows > 0:
+                batch.append(data)
+            if skipped > 0:
+                print(f"Skipped {skipped} already ingested suits from {item}")
+            if len(batch) >= batch_files:
+                flush()
+        flush()
+
+    elapsed = max(time.monotonic() - started_at, 1e-9)
+    action = "Would ingest" if dry_run else "Ingested"
+    print(
+        f"{action} {total_rows} metric values ({total_bytes / 1e6:.1f} MB) from {total_files} files "
+        f"in {elapsed:.1f}s, skipped {skipped_suits} already ingested suits: "
+        f"{total_files / elapsed:.1f} files/s, {total_rows / elapsed:.0f} rows/s, "
+        f"{total_bytes / elapsed / 1e6:.1f} MB/s"
+    )
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Perf test result uploader. \
@@ -139,25 +299,56 @@ def main():
         help="Path to perf test result file, or directory with perf test result files",
     )
     parser.add_argument("--initdb", action="store_true", help="Initialuze database")
+    parser.add_argument(
+        "--bulk",
+        action="store_true",
+        help="Ingest with COPY, in batches of files, skipping results that were already ingested",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Number of processes parsing result files in bulk mode",
+    )
+    parser.add_argument(
+        "--batch-files",
+        type=int,
+        default=100,
+        help="Number of result files per transaction in bulk mode",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Parse and encode the results in bulk mode and report the throughput, without writing",
+    )
 
     args = parser.parse_args()
+
+    if not args.ingest.exists():
+        err(f"ingest path {args.ingest} does not exist")
+
+    if args.ingest.is_dir():
+        files = sorted(args.ingest.iterdir(), key=recorded_at)
+    else:
+        files = [args.ingest]
+
+    if args.dry_run:
+        if not args.bulk:
+            err("--dry-run is only supported with --bulk")
+        bulk_ingest(None, files, args.jobs, args.batch_files, dry_run=True)
+        return
+
     with get_connection_cursor() as cur:
         if args.initdb:
             create_table(cur)
 
-        if not args.ingest.exists():
-            err(f"ingest path {args.ingest} does not exist")
-
-        if args.ingest:
-            if args.ingest.is_dir():
-                for item in sorted(args.ingest.iterdir(), key=lambda x: int(x.name.split("_")[0])):
-                    recorded_at_timestamp = int(item.name.split("_")[0])
-                    ingested = ingest_perf_test_result(cur, item, recorded_at_timestamp)
-                    print(f"Ingested {ingested} metric values from {item}")
-            else:
-                recorded_at_timestamp = int(args.ingest.name.split("_")[0])
-                ingested = ingest_perf_test_result(cur, args.ingest, recorded_at_timestamp)
-                print(f"Ingested {ingested} metric values from {args.ingest}")
+        if args.bulk:
+            bulk_ingest(cur, files, args.jobs, args.batch_files, dry_run=False)
+            return
+
+        for item in files:
+            ingested = ingest_perf_test_result(cur, item, recorded_at(item))
+            print(f"Ingested {ingested} metric values from {item}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,262 @@
+"""
+Packing of test output directories into Allure attachments.
+
+`allure_attach_from_dir` runs at the teardown of every test, and for failing
+storage tests the output directory can hold gigabytes of logs and, with
+`preserve_database_files`, of layer files. `ArtifactPacker` keeps that fast:
+
+- The directory is walked once, with one stat per entry.
+- Attachments larger than `ATTACHMENT_COMPRESS_THRESHOLD` are zstd-compressed in
+  a thread pool (zstandard releases the GIL while compressing). A compressed
+  copy that is newer than its source is reused rather than made again.
+- Attachments larger than `ATTACHMENT_SIZE_BUDGET` are cut down to their first
+  and last `TRUNCATED_PART_SIZE` bytes.
+- The `preserve_database_files` tarball is compressed with multi-threaded zstd
+  while the attachments are being compressed. Layer files with the same content
+  are stored once, the copies as hard links to the first one. Files hardlinked
+  from a shared snapshot (see `SnapshotMaterializer`) are stored like any other,
+  so the tarball can be restored without the shared snapshot directory.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import stat
+import tarfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import allure
+import zstandard
+
+from fixtures.log_helper import log
+from fixtures.pageserver.common_types import REMOTE_LAYER_FILE_NAME
+
+if TYPE_CHECKING:
+    import re
+    from concurrent.futures import Future
+
+
+# Attachments larger than this are compressed, they're hardly readable in a browser
+ATTACHMENT_COMPRESS_THRESHOLD = 1024**2
+
+# Attachments larger than this are truncated to their head and tail
+ATTACHMENT_SIZE_BUDGET = 256 * 1024**2
+TRUNCATED_PART_SIZE = 32 * 1024**2
+
+PACK_CONCURRENCY = min(8, os.cpu_count() or 1)
+
+# Files are hashed and copied in chunks of this size
+CHUNK_SIZE = 1024**2
+
+
+@dataclass
+class ArtifactPackStats:
+    files_attached: int = 0
+    files_compressed: int = 0
+    files_reused: int = 0
+    files_truncated: int = 0
+    # Size of the attached files, and of what was attached for them
+    bytes_in: int = 0
+    bytes_attached: int = 0
+    # Stored as hard links in the tarball
+    layers_deduplicated: int = 0
+    bytes_deduplicated: int = 0
+    tarball_bytes_in: int = 0
+    tarball_bytes: int = 0
+    duration: float = 0.0
+
+    def log_summary(self):
+        log.info(
+            f"Attached {self.files_attached} files in {self.duration:.2f}s: "
+            f"{self.bytes_in} bytes as {self.bytes_attached} bytes "
+            f"({self.files_compressed} compressed, {self.files_reused} already compressed, "
+            f"{self.files_truncated} truncated)"
+        )
+        if self.tarball_bytes_in:
+            log.info(
+                f"Packed {self.tarball_bytes_in} bytes of database files into {self.tarball_bytes} bytes; "
+                f"left out {self.bytes_deduplicated} bytes in {self.layers_deduplicated} duplicate layers"
+            )
+
+
+def attachment_type(source: str) -> tuple[str, str]:
+    """The Allure attachment type and extension of a file"""
+    if source.endswith(".gz"):
+        return "application/gzip", "gz"
+    elif source.endswith(".zst"):
+        return "application/zstd", "zst"
+    elif source.endswith(".svg"):
+        return "image/svg+xml", "svg"
+    elif source.endswith(".html"):
+        return "text/html", "html"
+    elif source.endswith(".walredo"):
+        return "application/octet-stream", "walredo"
+    else:
+        return "text/plain", Path(source).suffix.removeprefix(".")
+
+
+def walk(dir: Path) -> list[tuple[Path, os.stat_result]]:
+    """All entries under `dir` (not following symlinks), directories before their contents"""
+    entries = []
+    stack = [dir]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                st = entry.stat(follow_symlinks=False)
+                entries.append((Path(entry.path), st))
+                if stat.S_ISDIR(st.st_mode):
+                    stack.append(Path(entry.path))
+    return entries
+
+
+def file_digest(path: Path) -> bytes:
+    h = hashlib.blake2b(digest_size=32)
+    with path.open("rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            h.update(chunk)
+    return h.digest()
+
+
+def _is_layer_file(path: Path) -> bool:
+    return REMOTE_LAYER_FILE_NAME.match(path.name) is not None
+
+
+class ArtifactPacker:
+    def __init__(
+        self, concurrency: int = PACK_CONCURRENCY, size_budget: int = ATTACHMENT_SIZE_BUDGET
+    ):
+        self.concurrency = concurrency
+        self.size_budget = size_budget
+        self.stats = ArtifactPackStats()
+
+    def attach_dir(
+        self, dir: Path, name_regex: re.Pattern[str], preserve_database_files: bool = False
+    ):
+        """Attach the non-empty files in `dir` whose names match `name_regex`, see the module docs"""
+        started = time.monotonic()
+        entries = walk(dir)
+        attachments = [
+            (path, st)
+            for path, st in entries
+            if stat.S_ISREG(st.st_mode) and st.st_size > 0 and name_regex.fullmatch(path.name)
+        ]
+
+        # The tarball gets a thread of its own, its compression is multi-threaded already
+        with (
+            ThreadPoolExecutor(max_workers=self.concurrency) as executor,
+            ThreadPoolExecutor(max_workers=1) as tarball_executor,
+        ):
+            tarball: Future[Path] | None = None
+            if preserve_database_files:
+                tarball = tarball_executor.submit(self.pack_tarball, dir, entries)
+            prepared = [executor.submit(self._prepare, path, st) for path, st in attachments]
+
+            if tarball is not None:
+                allure.attach.file(
+                    tarball.result(), "everything.tar.zst", "application/zstd", "tar.zst"
+                )
+            for (path, st), fut in zip(attachments, prepared, strict=True):
+                source, suffix, how = fut.result()
+                attach_type, extension = attachment_type(str(source))
+                allure.attach.file(
+                    str(source), f"{path.relative_to(dir)}{suffix}", attach_type, extension
+                )
+                if how == "truncated":
+                    self.stats.files_truncated += 1
+                elif how == "compressed":
+                    self.stats.files_compressed += 1
+                elif how == "reused":
+                    self.stats.files_reused += 1
+                self.stats.files_attached += 1
+                self.stats.bytes_in += st.st_size
+                self.stats.bytes_attached += source.stat().st_size
+
+        self.stats.duration += time.monotonic() - started
+        self.stats.log_summary()
+
+    def _prepare(self, path: Path, st: os.stat_result) -> tuple[Path, str, str]:
+        """
+        The file to attach for `path`, the suffix to add to its name, and how it was
+        made: "truncated", "compressed", "reused" or "" for `path` itself.
+        """
+        if st.st_size > self.size_budget:
+            truncated = path.with_name(f"{path.name}.truncated.zst")
+            part_size = min(TRUNCATED_PART_SIZE, self.size_budget // 2)
+            with path.open("rb") as fin, truncated.open("wb") as fout:
+                with zstandard.ZstdCompressor().stream_writer(fout) as compressor:
+                    compressor.write(fin.read(part_size))
+                    skipped = st.st_size - 2 * part_size
+                    compressor.write(f"\n\n[... {skipped} bytes skipped ...]\n\n".encode())
+                    fin.seek(-part_size, os.SEEK_END)
+                    compressor.write(fin.read())
+            return truncated, ".truncated.zst", "truncated"
+
+        if st.st_size <= ATTACHMENT_COMPRESS_THRESHOLD:
+            return path, "", ""
+
+        compressed = path.with_name(f"{path.name}.zst")
+        try:
+            if compressed.stat().st_mtime_ns >= st.st_mtime_ns:
+                return compressed, ".zst", "reused"
+        except FileNotFoundError:
+            pass
+        with path.open("rb") as fin, compressed.open("wb") as fout:
+            zstandard.ZstdCompressor().copy_stream(fin, fout)
+        return compressed, ".zst", "compressed"
+
+    def _duplicate_layers(self, files: list[tuple[Path, os.stat_result]]) -> dict[Path, Path]:
+        """Layer files with the same content as an earlier one, mapped to the earlier one"""
+        by_size: dict[int, list[Path]] = {}
+        seen_inodes: set[tuple[int, int]] = set()
+        for path, st in files:
+            # Hard links of each other are taken care of by tarfile
+            if _is_layer_file(path) and (st.st_dev, st.st_ino) not in seen_inodes:
+                seen_inodes.add((st.st_dev, st.st_ino))
+                by_size.setdefault(st.st_size, []).append(path)
+
+        candidates = [p for paths in by_size.values() if len(paths) > 1 for p in paths]
+        first_by_digest: dict[bytes, Path] = {}
+        duplicates = {}
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            digests = list(executor.map(file_digest, candidates))
+        for path, digest in zip(candidates, digests, strict=True):
+            first = first_by_digest.setdefault(digest, path)
+            if first != path:
+                duplicates[path] = first
+        return duplicates
+
+    def pack_tarball(self, dir: Path, entries: list[tuple[Path, os.stat_result]]) -> Path:
+        """Pack `entries` of `dir` into a `.tar.zst` next to it"""
+        files = sorted((e for e in entries if stat.S_ISREG(e[1].st_mode)), key=lambda e: e[0])
+        duplicates = self._duplicate_layers(files)
+
+        zst_file = dir.with_suffix(".tar.zst")
+        with zst_file.open("wb") as zst:
+            cctx = zstandard.ZstdCompressor(threads=-1)
+            with cctx.stream_writer(zst) as compressor:
+                with tarfile.open(fileobj=compressor, mode="w") as tar:
+                    for path, st in sorted(entries, key=lambda e: e[0]):
+                        arcname = str(path.relative_to(dir))
+                        if not stat.S_ISREG(st.st_mode):
+                            tar.add(path, arcname=arcname, recursive=False)
+                            continue
+                        first = duplicates.get(path)
+                        if first is not None:
+                            info = tar.gettarinfo(path, arcname=arcname)
+                            info.type = tarfile.LNKTYPE
+                            info.linkname = str(first.relative_to(dir))
+                            info.size = 0
+                            tar.addfile(info)
+                            self.stats.layers_deduplicated += 1
+                            self.stats.bytes_deduplicated += st.st_size
+                            continue
+                        tar.add(path, arcname=arcname, recursive=False)
+                        self.stats.tarball_bytes_in += st.st_size
+
+        self.stats.tarball_bytes = zst_file.stat().st_size
+        return zst_file
@@ -4,8 +4,10 @@ import calendar
 import dataclasses
 import enum
 import json
+import math
 import os
 import re
+import threading
 import timeit
 from contextlib import contextmanager
 from datetime import datetime
@@ -28,6 +30,7 @@ if TYPE_CHECKING:
 
     from fixtures.common_types import TenantId, TimelineId
     from fixtures.neon_fixtures import NeonPageserver
+    from fixtures.pgbench_series import PgBenchSeries
 
 
 """
@@ -46,6 +49,11 @@ bencmark, and then record the result by calling `zenbenchmark.record`. For examp
 ...         cur.execute('SELECT test_query(...)')
 ...     # Record another measurement
 ...     zenbenchmark.record('speed_of_light', 300000, 'km/s')
+...     # Record a distribution, reported as percentiles
+...     hist = zenbenchmark.histogram('query_latency', unit='ms')
+...     for _ in range(1000):
+...         with hist.time(scale=1000):
+...             cur.execute('SELECT test_query(...)')
 
 There's no need to import this file to use it. It should be declared as a plugin
 inside `conftest.py`, and that makes it available to all tests.
@@ -70,7 +78,7 @@ class PgBenchRunResult:
     run_end_timestamp: int
     scale: int
 
-    # TODO progress
+    # For what happened during the run, see fixtures.pgbench_series
 
     @classmethod
     def parse_from_stdout(
@@ -239,6 +247,95 @@ class MetricReport(StrEnum):  # str is a hack to make it json serializable
     LOWER_IS_BETTER = "lower_is_better"
 
 
+# Percentiles reported for each histogram, and the suffix of their metric names
+HISTOGRAM_PERCENTILES: list[tuple[float, str]] = [
+    (50, "p50"),
+    (90, "p90"),
+    (99, "p99"),
+    (99.9, "p99_9"),
+]
+
+
+class Histogram:
+    """
+    A log-bucketed histogram, in the spirit of HdrHistogram: every power of two
+    is split into `sub_buckets` equal buckets, so a percentile is reported with
+    a relative error of at most 1/sub_buckets, however wide the range of values.
+    Only the counts of non-empty buckets are kept, not the samples.
+
+    Recording a value is O(1), and safe to do from many threads.
+    """
+
+    def __init__(self, sub_buckets: int = 128):
+        self.sub_buckets = sub_buckets
+        self._lock = threading.Lock()
+        # bucket index -> number of values in it
+        self._counts: dict[int, int] = {}
+        # values <= 0 don't have a logarithm
+        self._nonpositive = 0
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def _bucket(self, value: float) -> int:
+        # value = mantissa * 2**exponent, 0.5 <= mantissa < 1
+        mantissa, exponent = math.frexp(value)
+        return exponent * self.sub_buckets + int((mantissa - 0.5) * 2 * self.sub_buckets)
+
+    def _bucket_value(self, bucket: int) -> float:
+        """The midpoint of a bucket"""
+        exponent, sub = divmod(bucket, self.sub_buckets)
+        return math.ldexp(0.5 + (sub + 0.5) / (2 * self.sub_buckets), exponent)
+
+    def record(self, value: float):
+        bucket = self._bucket(value) if value > 0 else None
+        with self._lock:
+            if bucket is None:
+                self._nonpositive += 1
+            else:
+                self._counts[bucket] = self._counts.get(bucket, 0) + 1
+            self.count += 1
+            self.min = min(self.min, value)
+            self.max = max(self.max, value)
+
+    @contextmanager
+    def time(self, scale: float = 1.0) -> Iterator[None]:
+        """
+        Record how long the body takes, in seconds multiplied by `scale`:
+
+        with hist.time(scale=1e6):  # microseconds
+            ...
+        """
+        start = timeit.default_timer()
+        yield
+        self.record((timeit.default_timer() - start) * scale)
+
+    def percentile(self, q: float) -> float:
+        """The value below which `q` percent of the recorded values fall"""
+        with self._lock:
+            assert self.count > 0, "no values recorded"
+            rank = max(1, math.ceil(q / 100 * self.count))
+            if rank <= self._nonpositive:
+                return self.min
+            seen = self._nonpositive
+            for bucket in sorted(self._counts):
+                seen += self._counts[bucket]
+                if seen >= rank:
+                    return min(max(self._bucket_value(bucket), self.min), self.max)
+            return self.max
+
+
+# Long runs report many intervals; record at most this many points of each series.
+# Each point is the worst value over the intervals it covers.
+PGBENCH_SERIES_MAX_POINTS = 30
+
+
+def _windows(n: int, max_points: int) -> list[tuple[int, int]]:
+    """Split `range(n)` into at most `max_points` consecutive (start, end) ranges"""
+    step = max(1, math.ceil(n / max_points))
+    return [(start, min(start + step, n)) for start in range(0, n, step)]
+
+
 class NeonBenchmarker:
     """
     An object for recording benchmark results. This is created for each test
@@ -251,6 +348,9 @@ class NeonBenchmarker:
         # property recorder here is a pytest fixture provided by junitxml module
         # https://docs.pytest.org/en/6.2.x/reference.html#pytest.junitxml.record_property
         self.property_recorder = property_recorder
+        # metric name -> (histogram, unit, report), see histogram()
+        self._histograms: dict[str, tuple[Histogram, str, MetricReport]] = {}
+        self._at_test_end: list[Callable[[], None]] = []
 
     def record(
         self,
@@ -289,6 +389,56 @@ class NeonBenchmarker:
             },
         )
 
+    def histogram(
+        self,
+        metric_name: str,
+        unit: str,
+        report: MetricReport = MetricReport.LOWER_IS_BETTER,
+    ) -> Histogram:
+        """
+        Get a histogram to record a distribution of values, e.g. latencies, into.
+        Its percentiles are recorded as `{metric_name}.p50`, `.p90`, `.p99`,
+        `.p99_9` and `.max` when the test finishes. Usage:
+
+        hist = zenbenchmark.histogram("getpage_latency", unit="us")
+        for _ in range(n):
+            with hist.time(scale=1e6):
+                getpage()
+        """
+        if metric_name not in self._histograms:
+            self._histograms[metric_name] = (Histogram(), unit, report)
+        histogram, existing_unit, _ = self._histograms[metric_name]
+        assert existing_unit == unit, f"histogram {metric_name} already has unit {existing_unit}"
+        return histogram
+
+    def at_test_end(self, callback: Callable[[], None]):
+        """
+        Call `callback` when the test function returns, e.g. to record results
+        gathered in the background. Results recorded later, while fixtures are
+        torn down, don't make it into the report.
+        """
+        self._at_test_end.append(callback)
+
+    def finish(self):
+        """Run the `at_test_end()` callbacks and record the histograms"""
+        callbacks, self._at_test_end = self._at_test_end, []
+        for callback in callbacks:
+            callback()
+        self.record_histograms()
+
+    def record_histograms(self):
+        """
+        Record the percentiles of all histograms that have values.
+        """
+        histograms, self._histograms = self._histograms, {}
+        for metric_name, (histogram, unit, report) in histograms.items():
+            if histogram.count == 0:
+                log.warning(f"histogram {metric_name} is empty, not recording it")
+                continue
+            for q, suffix in HISTOGRAM_PERCENTILES:
+                self.record(f"{metric_name}.{suffix}", histogram.percentile(q), unit, report)
+            self.record(f"{metric_name}.max", histogram.max, unit, report)
+
     @classmethod
     def records(
         cls, user_properties: list[tuple[str, object]]
@@ -379,6 +529,60 @@ class NeonBenchmarker:
             MetricReport.TEST_PARAM,
         )
 
+    def record_pg_bench_series(
+        self, prefix: str, series: PgBenchSeries, max_points: int = PGBENCH_SERIES_MAX_POINTS
+    ):
+        """
+        Record the time series of a pgbench run: stability metrics, and the
+        series themselves, downsampled to at most `max_points` windows that are
+        told apart by their `window_start` label (seconds since the start).
+        """
+        if (tps_cv := series.tps_cv) is not None:
+            self.record(f"{prefix}.tps_cv", tps_cv, "", MetricReport.LOWER_IS_BETTER)
+        if (worst_tps := series.worst_window_tps) is not None:
+            self.record(f"{prefix}.worst_window_tps", worst_tps, "", MetricReport.HIGHER_IS_BETTER)
+        if (worst_p99 := series.worst_window_latency_p99) is not None:
+            self.record(
+                f"{prefix}.worst_window_latency_p99",
+                worst_p99,
+                unit="ms",
+                report=MetricReport.LOWER_IS_BETTER,
+            )
+
+        for start, end in _windows(len(series.progress_time), max_points):
+            labels = {"window_start": f"{series.progress_time[start]:.0f}"}
+            tps = series.progress_tps[start:end]
+            self.record(
+                f"{prefix}.series.tps",
+                min(tps),
+                "",
+                MetricReport.HIGHER_IS_BETTER,
+                labels=labels,
+            )
+            self.record(
+                f"{prefix}.series.latency_average",
+                max(series.progress_latency[start:end]),
+                unit="ms",
+                report=MetricReport.LOWER_IS_BETTER,
+                labels=labels,
+            )
+        for start, end in _windows(len(series.log_time), max_points):
+            labels = {"window_start": f"{series.log_time[start]:.0f}"}
+            self.record(
+                f"{prefix}.series.latency_p50",
+                max(series.log_latency_p50[start:end]),
+                unit="ms",
+                report=MetricReport.LOWER_IS_BETTER,
+                labels=labels,
+            )
+            self.record(
+                f"{prefix}.series.latency_p99",
+                max(series.log_latency_p99[start:end]),
+                unit="ms",
+                report=MetricReport.LOWER_IS_BETTER,
+                labels=labels,
+            )
+
     def record_pg_bench_init_result(self, prefix: str, result: PgBenchInitResult):
         test_params = [
             "start_timestamp",
@@ -475,6 +679,8 @@ def zenbenchmark(
     """
     benchmarker = NeonBenchmarker(record_property)
     yield benchmarker
+    # Usually a no-op, see pytest_runtest_call
+    benchmarker.finish()
 
     results = {}
     for _, recorded_property in NeonBenchmarker.records(request.node.user_properties):
@@ -493,6 +699,16 @@ def zenbenchmark(
     )
 
 
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_call(item: pytest.Item) -> Iterator[None]:
+    yield
+    # The test report, which the results are read from, takes a copy of the
+    # user properties before fixtures are torn down: record the histograms now.
+    benchmarker = getattr(item, "funcargs", {}).get("zenbenchmark")
+    if isinstance(benchmarker, NeonBenchmarker):
+        benchmarker.finish()
+
+
 def pytest_addoption(parser: Parser):
     parser.addoption(
         "--out-dir",
@@ -24,6 +24,8 @@ class Lsn:
     representation is like "1/0123abcd". See also pg_lsn datatype in Postgres
     """
 
+    __slots__ = ("lsn_int",)
+
     def __init__(self, x: int | str):
         if isinstance(x, int):
             self.lsn_int = x
@@ -98,7 +100,7 @@ class Lsn:
         return f"00000001{high_bits:08X}000000{low_bits:02X}"
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Key:
     key_int: int
 
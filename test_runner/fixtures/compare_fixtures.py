@@ -23,6 +23,7 @@ from fixtures.neon_fixtures import (
     VanillaPostgres,
     wait_for_last_flush_lsn,
 )
+from fixtures.resource_sampler import ResourceSampler
 
 if TYPE_CHECKING:
     from collections.abc import Iterator
@@ -335,8 +336,11 @@ def neon_compare(
     zenbenchmark: NeonBenchmarker,
     pg_bin: PgBin,
     neon_simple_env: NeonEnv,
-) -> NeonCompare:
-    return NeonCompare(zenbenchmark, neon_simple_env, pg_bin)
+) -> Iterator[NeonCompare]:
+    # Report the CPU, memory, I/O and fd usage of all processes of the env
+    with ResourceSampler(neon_simple_env.repo_dir) as sampler:
+        zenbenchmark.at_test_end(lambda: sampler.record(zenbenchmark))
+        yield NeonCompare(zenbenchmark, neon_simple_env, pg_bin)
 
 
 @pytest.fixture(scope="function")
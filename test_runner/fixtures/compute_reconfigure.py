@@ -1,6 +1,5 @@
 from __future__ import annotations
 
-import concurrent.futures
 from typing import TYPE_CHECKING
 
 import pytest
@@ -10,7 +9,7 @@ from fixtures.common_types import TenantId
 from fixtures.log_helper import log
 
 if TYPE_CHECKING:
-    from collections.abc import Callable
+    from collections.abc import Callable, Iterator
     from typing import Any
 
     from pytest_httpserver import HTTPServer
@@ -36,7 +35,7 @@ class ComputeReconfigure:
 
 
 @pytest.fixture(scope="function")
-def compute_reconfigure_listener(make_httpserver: HTTPServer):
+def compute_reconfigure_listener(make_httpserver: HTTPServer) -> Iterator[ComputeReconfigure]:
     """
     This fixture exposes an HTTP listener for the storage controller to submit
     compute notifications to us, instead of updating neon_local endpoints itself.
@@ -44,16 +43,20 @@ def compute_reconfigure_listener(make_httpserver: HTTPServer):
     Although storage controller can use neon_local directly, this causes problems when
     the test is also concurrently modifying endpoints.  Instead, configure storage controller
     to send notifications up to this test code, which will route all endpoint updates
-    through Workload, which has a mutex to make concurrent updates safe.
+    through Workload, which has a per-endpoint mutex to make concurrent updates safe.
     """
+    # The server is restarted to handle each request on a thread of its own, so that
+    # different tenants' endpoints are reconfigured in parallel, e.g. during shard
+    # migrations across many tenants.
+    # Notifications for the same tenant serialize on the Workload's endpoint lock, and
+    # `neon_local endpoint reconfigure` only takes a shared lock on the repo dir.
     server = make_httpserver
+    server.stop()
+    server.threaded = True
+    server.start()
 
     self = ComputeReconfigure(server)
 
-    # Do neon_local endpoint reconfiguration in the background so that we can
-    # accept a healthy rate of calls into notify-attach.
-    reconfigure_threads = concurrent.futures.ThreadPoolExecutor(max_workers=1)
-
     def handler(request: Request) -> Response:
         assert request.json is not None
         body: dict[str, Any] = request.json
@@ -69,16 +72,12 @@ def compute_reconfigure_listener(make_httpserver: HTTPServer):
         else:
             # This causes the endpoint to query storage controller for its location, which
             # is redundant since we already have it here, but this avoids extending the
-            # neon_local CLI to take full lists of locations
-            fut = reconfigure_threads.submit(lambda workload=workload: workload.reconfigure())  # type: ignore[misc]
-
-            # To satisfy semantics of notify-attach API, we must wait for the change to be applied before returning 200
-            fut.result()
+            # neon_local CLI to take full lists of locations.
+            # To satisfy semantics of notify-attach API, the change is applied before returning 200
+            workload.reconfigure()
 
         return Response(status=200)
 
     self.server.expect_request("/notify-attach", method="PUT").respond_with_handler(handler)
 
     yield self
-    reconfigure_threads.shutdown()
-    server.clear()
@@ -9,6 +9,7 @@ from requests.adapters import HTTPAdapter
 from requests.auth import AuthBase
 from typing_extensions import override
 
+from fixtures.http_client_cache import HTTP_POOL_MAXSIZE
 from fixtures.log_helper import log
 from fixtures.utils import wait_until
 
@@ -56,7 +57,7 @@ class EndpointHttpClient(requests.Session):
         self.internal_port: int = internal_port
         self.auth = BearerAuth(jwt)
 
-        self.mount("http://", HTTPAdapter())
+        self.mount("http://", HTTPAdapter(pool_maxsize=HTTP_POOL_MAXSIZE))
 
     def dbs_and_roles(self):
         res = self.get(f"http://localhost:{self.external_port}/dbs_and_roles", auth=self.auth)
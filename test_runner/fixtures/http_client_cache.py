@@ -0,0 +1,127 @@
+"""
+Caching of HTTP clients for the services started by neon_local.
+
+Our HTTP clients are `requests.Session` subclasses, and creating a new one for
+every request means a new TCP connection for every request. Polling helpers
+call `http_client()` in tight loops, so services keep a cache of clients keyed
+by the client parameters (auth token, retry policy) and drop it whenever the
+service process is started or stopped.
+"""
+
+from __future__ import annotations
+
+import threading
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Generic, TypeVar
+
+import requests
+
+from fixtures.log_helper import log
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Hashable
+
+    from urllib3.util.retry import Retry
+
+
+# Keep-alive pool size per host. Tests often poll the same service from many
+# threads, so allow more than the `requests` default of 10 idle connections.
+HTTP_POOL_MAXSIZE = 32
+
+C = TypeVar("C", bound=requests.Session)
+
+
+def retry_policy_key(retries: Retry | None) -> Hashable:
+    """A hashable key that is equal for `Retry` objects with the same configuration"""
+    if retries is None:
+        return None
+    return repr(sorted((k, repr(v)) for k, v in vars(retries).items() if k != "history"))
+
+
+@dataclass
+class HttpClientCacheStats:
+    # How many times a cached client was handed out instead of creating a new one.
+    client_hits: int = 0
+    # How many clients were created.
+    client_misses: int = 0
+    # How many HTTP requests the cached clients issued.
+    requests: int = 0
+    # How many TCP connections the cached clients opened for them.
+    connections: int = 0
+
+    @property
+    def connections_saved(self) -> int:
+        return self.requests - self.connections
+
+
+def _session_connection_counts(session: requests.Session) -> tuple[int, int]:
+    """Sum up (requests, connections) over the urllib3 pools of a session"""
+    num_requests = 0
+    num_connections = 0
+    for adapter in session.adapters.values():
+        poolmanager = getattr(adapter, "poolmanager", None)
+        if poolmanager is None:
+            continue
+        for key in list(poolmanager.pools.keys()):
+            pool = poolmanager.pools.get(key)
+            if pool is None:
+                continue
+            num_requests += pool.num_requests
+            num_connections += pool.num_connections
+    return num_requests, num_connections
+
+
+class HttpClientCache(Generic[C]):
+    """
+    A thread-safe cache of HTTP clients of one service.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._clients: dict[Hashable, C] = {}
+        self._stats = HttpClientCacheStats()
+
+    def get(self, key: Hashable, create: Callable[[], C]) -> C:
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self._stats.client_hits += 1
+                return client
+
+            client = create()
+            self._clients[key] = client
+            self._stats.client_misses += 1
+            return client
+
+    def invalidate(self):
+        """
+        Forget all cached clients and close their connections. Called when the
+        service is started or stopped: the pooled connections would be stale.
+
+        Clients that callers still hold remain usable, they just reconnect.
+        """
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+            for client in clients:
+                num_requests, num_connections = _session_connection_counts(client)
+                self._stats.requests += num_requests
+                self._stats.connections += num_connections
+                client.close()
+
+        if clients:
+            stats = self.stats()
+            log.info(
+                f"{self.name} http clients: {stats.client_hits} reused, {stats.client_misses} created, "
+                f"{stats.connections_saved} connections saved over {stats.requests} requests"
+            )
+
+    def stats(self) -> HttpClientCacheStats:
+        with self._lock:
+            stats = HttpClientCacheStats(**vars(self._stats))
+            for client in self._clients.values():
+                num_requests, num_connections = _session_connection_counts(client)
+                stats.requests += num_requests
+                stats.connections += num_connections
+            return stats
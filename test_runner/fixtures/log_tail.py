@@ -0,0 +1,179 @@
+"""
+Incremental reading of service log files.
+
+Tests frequently poll a service log for a pattern inside `wait_until()`. The
+logs of a long-running pageserver can grow to hundreds of megabytes, so
+re-reading them from the start on every poll is expensive. `LogTailer`
+remembers how far it has read into a log file and the byte offset of every
+complete line it has seen, so that each poll only has to look at the bytes
+that were appended since the previous one.
+"""
+
+from __future__ import annotations
+
+import re
+import threading
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import os
+    from collections.abc import Iterator, Sequence
+    from pathlib import Path
+
+
+# How many bytes to read from the log file at once.
+READ_CHUNK_SIZE = 4 * 1024 * 1024
+
+# How many (patterns, start line) scan positions to remember per log file.
+MAX_REMEMBERED_SCANS = 256
+
+
+@dataclass
+class LogCursor:
+    """
+    A position in a log file, pointing just past the last matched line.
+
+    `_generation` identifies the incarnation of the log file the cursor was
+    taken from: if the file is truncated or replaced in the meantime, the
+    cursor is no longer meaningful and scanning restarts from the beginning.
+    """
+
+    _line_no: int
+    _generation: int = 0
+
+
+class LogTailer:
+    """
+    Follows a single log file, keeping a persistent byte offset and an index of
+    line start offsets. Safe to use from multiple threads.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._reset(generation=0)
+
+    def _reset(self, generation: int) -> None:
+        self.generation = generation
+        self._inode: int | None = None
+        # `_line_starts[i]` is the byte offset of line `i`; the last element is
+        # the offset just past the last complete line, i.e. how far we have read.
+        self._line_starts = array("q", [0])
+        # (patterns, first line) -> index of the first line not yet scanned
+        self._scans: OrderedDict[tuple[tuple[str, ...], int], int] = OrderedDict()
+
+    @property
+    def line_count(self) -> int:
+        """Number of complete lines indexed so far."""
+        return len(self._line_starts) - 1
+
+    @property
+    def byte_offset(self) -> int:
+        """Offset just past the last complete line indexed so far."""
+        return self._line_starts[-1]
+
+    def _refresh(self) -> os.stat_result | None:
+        """
+        Index the lines that were appended since the last call. Detects log
+        rotation (a different inode) and truncation (a shorter file), in which
+        case the index is rebuilt from scratch under a new generation.
+        """
+        try:
+            st = self.path.stat()
+        except FileNotFoundError:
+            return None
+
+        if self._inode is not None and (st.st_ino != self._inode or st.st_size < self.byte_offset):
+            self._reset(self.generation + 1)
+        self._inode = st.st_ino
+
+        offset = self.byte_offset
+        if st.st_size == offset:
+            return st
+
+        # A trailing line without a newline is not indexed: it is re-read on
+        # the next refresh, once it has presumably been completed.
+        with self.path.open("rb") as f:
+            f.seek(offset)
+            while chunk := f.read(READ_CHUNK_SIZE):
+                pos = chunk.find(b"\n")
+                while pos != -1:
+                    self._line_starts.append(offset + pos + 1)
+                    pos = chunk.find(b"\n", pos + 1)
+                offset += len(chunk)
+        return st
+
+    def _first_line(self, offset: LogCursor | None) -> int:
+        # Not clamped to `line_count`: a cursor past a torn line is one line beyond it
+        if offset is None or offset._generation != self.generation:
+            return 0
+        return offset._line_no
+
+    def _iter_lines(self, first: int, last: int) -> Iterator[tuple[int, str]]:
+        """Yield `(line_no, line)` for the indexed lines `first..last`."""
+        starts = self._line_starts
+        with self.path.open("rb") as f:
+            while first < last:
+                # Read as many whole lines as fit into one chunk (but at least one).
+                end = bisect_right(starts, starts[first] + READ_CHUNK_SIZE, first + 1, last + 1) - 1
+                end = max(end, first + 1)
+                f.seek(starts[first])
+                buf = f.read(starts[end] - starts[first])
+                base = starts[first]
+                for line_no in range(first, end):
+                    line = buf[starts[line_no] - base : starts[line_no + 1] - base]
+                    yield line_no, line.decode("utf-8", errors="replace")
+                first = end
+
+    def _read_torn_line(self, st: os.stat_result) -> str | None:
+        if st.st_size <= self.byte_offset:
+            return None
+        with self.path.open("rb") as f:
+            f.seek(self.byte_offset)
+            return f.read(st.st_size - self.byte_offset).decode("utf-8", errors="replace")
+
+    def search(
+        self, patterns: Sequence[str], offset: LogCursor | None = None
+    ) -> tuple[int, str, LogCursor] | None:
+        """
+        Find the first line at or after `offset` that matches any of `patterns`.
+
+        Returns the index of the matching pattern, the line and a cursor
+        pointing past it. Repeated searches for the same patterns from the same
+        offset only scan the lines appended since the previous search.
+        """
+        compiled = [re.compile(p) for p in patterns]
+        key_patterns = tuple(patterns)
+
+        with self._lock:
+            st = self._refresh()
+            if st is None:
+                return None
+
+            first = self._first_line(offset)
+            key = (key_patterns, first)
+            start = self._scans.pop(key, first)
+
+            for line_no, line in self._iter_lines(start, self.line_count):
+                for i, r in enumerate(compiled):
+                    if r.search(line):
+                        return i, line, LogCursor(line_no + 1, self.generation)
+
+            self._scans[key] = max(start, self.line_count)
+            if len(self._scans) > MAX_REMEMBERED_SCANS:
+                self._scans.popitem(last=False)
+
+            # Our rust logging machinery writes whole lines, but we may observe
+            # a line that is only partially written. Check it, without remembering
+            # it as scanned, unless `offset` points past it: then it matched before.
+            torn = self._read_torn_line(st) if first <= self.line_count else None
+            if torn is not None:
+                for i, r in enumerate(compiled):
+                    if r.search(torn):
+                        return i, torn, LogCursor(self.line_count + 1, self.generation)
+
+        return None
@@ -1,14 +1,31 @@
 from __future__ import annotations
 
+import re
 from collections import defaultdict
 from typing import TYPE_CHECKING, Literal
 
 from prometheus_client.parser import text_string_to_metric_families
+from prometheus_client.samples import Sample
 
 from fixtures.log_helper import log
 
 if TYPE_CHECKING:
-    from prometheus_client.samples import Sample
+    from collections.abc import Iterator, Sequence
+
+
+class _NameIndex:
+    """Inverted label indexes over the samples of one metric name"""
+
+    def __init__(self, samples: list[Sample]):
+        self.size = len(samples)
+        # label -> label value -> ids (positions in `samples`) of the samples that have it
+        self.by_label: dict[str, dict[str, list[int]]] = defaultdict(lambda: defaultdict(list))
+        # full label set -> id of the sample with exactly these labels
+        self.by_labelset: dict[frozenset[tuple[str, str]], int] = {}
+        for i, sample in enumerate(samples):
+            for k, v in sample.labels.items():
+                self.by_label[k][v].append(i)
+            self.by_labelset[frozenset(sample.labels.items())] = i
 
 
 class Metrics:
@@ -18,24 +35,62 @@ class Metrics:
     def __init__(self, name: str = ""):
         self.metrics = defaultdict(list)
         self.name = name
+        self._indexes: dict[str, _NameIndex] = {}
+
+    def _index(self, name: str) -> _NameIndex:
+        # `metrics` is filled in by the parser (and sometimes by tests) after
+        # construction, so indexes are built lazily, and rebuilt if samples were added.
+        samples = self.metrics.get(name, [])
+        index = self._indexes.get(name)
+        if index is None or index.size != len(samples):
+            index = self._indexes[name] = _NameIndex(samples)
+        return index
 
     def query_all(self, name: str, filter: dict[str, str] | None = None) -> list[Sample]:
-        filter = filter or {}
-        res: list[Sample] = []
-
-        for sample in self.metrics[name]:
-            try:
-                if all(sample.labels[k] == v for k, v in filter.items()):
-                    res.append(sample)
-            except KeyError:
-                pass
-        return res
+        samples = self.metrics.get(name, [])
+        if not filter:
+            return list(samples)
+
+        index = self._index(name)
+        candidates = []
+        for k, v in filter.items():
+            ids = index.by_label.get(k, {}).get(v)
+            if not ids:
+                return []
+            candidates.append(ids)
+        candidates.sort(key=len)
+        matching = set(candidates[0])
+        for ids in candidates[1:]:
+            matching.intersection_update(ids)
+        return [samples[i] for i in sorted(matching)]
 
     def query_one(self, name: str, filter: dict[str, str] | None = None) -> Sample:
         res = self.query_all(name, filter or {})
         assert len(res) == 1, f"expected single sample for {name} {filter}, found {res}"
         return res[0]
 
+    def query_labelset(self, name: str, labels: dict[str, str]) -> Sample | None:
+        """Find the sample with exactly the given labels, no more and no less"""
+        i = self._index(name).by_labelset.get(frozenset(labels.items()))
+        return None if i is None else self.metrics[name][i]
+
+    def diff(self, prev: Metrics) -> Metrics:
+        """
+        Per-sample deltas between this scrape and an earlier one, e.g. to see how
+        much counters advanced during a test step. Samples missing from `prev`
+        count from zero, and so do counters that went backwards (i.e. were reset
+        by a process restart in between).
+        """
+        res = Metrics(self.name)
+        for name, samples in self.metrics.items():
+            for sample in samples:
+                before = prev.query_labelset(name, sample.labels)
+                delta = sample.value
+                if before is not None and sample.value >= before.value:
+                    delta = sample.value - before.value
+                res.metrics[name].append(sample._replace(value=delta))
+        return res
+
 
 class MetricsGetter:
     """
@@ -43,7 +98,11 @@ class MetricsGetter:
     helpers for querying the metrics
     """
 
-    def get_metrics(self) -> Metrics:
+    def get_metrics(self, prefixes: Sequence[str] | None = None) -> Metrics:
+        """
+        If `prefixes` is given, implementations may only parse the metrics whose
+        names start with one of them.
+        """
         raise NotImplementedError()
 
     def get_metric_value(
@@ -52,7 +111,7 @@ class MetricsGetter:
         filter: dict[str, str] | None = None,
         aggregate: Literal["sum"] | None = None,
     ) -> float | None:
-        metrics = self.get_metrics()
+        metrics = self.get_metrics(prefixes=[name])
         results = metrics.query_all(name, filter=filter)
         if not results:
             log.info(f'could not find metric "{name}"')
@@ -82,7 +141,7 @@ class MetricsGetter:
         specify `absence_ok=True`. The returned dict will then not contain values
         for these metrics.
         """
-        metrics = self.get_metrics()
+        metrics = self.get_metrics(prefixes=names)
         samples = []
         for name in names:
             samples.extend(metrics.query_all(name, filter=filter))
@@ -101,8 +160,53 @@ class MetricsGetter:
         return result
 
 
-def parse_metrics(text: str, name: str = "") -> Metrics:
+_SAMPLE_LINE_RE = re.compile(
+    r"([a-zA-Z_:][a-zA-Z0-9_:]*)\s*(?:\{(.*)\})?\s+(\S+)(?:\s+(-?[0-9]+))?\s*"
+)
+_LABEL_RE = re.compile(r'\s*([a-zA-Z_][a-zA-Z0-9_]*)\s*=\s*"((?:[^"\\]|\\.)*)"\s*,?')
+_LABEL_ESCAPE_RE = re.compile(r"\\(.)")
+
+
+def _unescape_label_value(value: str) -> str:
+    if "\\" not in value:
+        return value
+    return _LABEL_ESCAPE_RE.sub(lambda m: "\n" if m[1] == "n" else m[1], value)
+
+
+def _parse_samples(text: str, prefixes: tuple[str, ...]) -> Iterator[Sample]:
+    """
+    A minimal parser for the Prometheus text exposition format, which skips
+    lines that don't start with one of `prefixes` before doing any work on them.
+    """
+    for line in text.splitlines():
+        if not line.startswith(prefixes):
+            continue
+        m = _SAMPLE_LINE_RE.fullmatch(line)
+        if m is None:
+            raise ValueError(f"Invalid metrics line: {line!r}")
+        name, raw_labels, value, timestamp = m.groups()
+        labels = {}
+        if raw_labels:
+            for lm in _LABEL_RE.finditer(raw_labels):
+                labels[lm[1]] = _unescape_label_value(lm[2])
+        # Like prometheus_client, represent millisecond timestamps as float seconds
+        yield Sample(
+            name, labels, float(value), int(timestamp) / 1000 if timestamp is not None else None
+        )
+
+
+def parse_metrics(text: str, name: str = "", prefixes: Sequence[str] | None = None) -> Metrics:
+    """
+    Parse metrics in the Prometheus text format. If `prefixes` is given, only the
+    metrics whose names start with one of the prefixes are parsed: that's a lot
+    faster than parsing everything on services that expose many per-tenant metrics.
+    """
     metrics = Metrics(name)
+    if prefixes is not None:
+        for sample in _parse_samples(text, tuple(prefixes)):
+            metrics.metrics[sample.name].append(sample)
+        return metrics
+
     gen = text_string_to_metric_families(text)
     for family in gen:
         for sample in family.samples:
@@ -2,10 +2,15 @@ from __future__ import annotations
 
 import json
 import os
+import queue
 import re
 import subprocess
 import tempfile
 import textwrap
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
 from itertools import chain, product
 from typing import TYPE_CHECKING, cast
 
@@ -16,6 +21,7 @@ from fixtures.log_helper import log
 from fixtures.pageserver.common_types import IndexPartDump
 
 if TYPE_CHECKING:
+    from collections.abc import Iterator
     from pathlib import Path
     from typing import (
         Any,
@@ -68,19 +74,7 @@ class AbstractNeonCli:
         args = [command_path] + arguments
         log.info('Running command "{}"'.format(" ".join(args)))
 
-        env_vars = os.environ.copy()
-
-        # extra env
-        for extra_env_key, extra_env_value in (self.extra_env or {}).items():
-            env_vars[extra_env_key] = extra_env_value
-        for extra_env_key, extra_env_value in (extra_env_vars or {}).items():
-            env_vars[extra_env_key] = extra_env_value
-
-        # Pass through coverage settings
-        var = "LLVM_PROFILE_FILE"
-        val = os.environ.get(var)
-        if val:
-            env_vars[var] = val
+        env_vars = self._env_vars(extra_env_vars)
 
         # Intercept CalledProcessError and print more info
         try:
@@ -106,6 +100,30 @@ class AbstractNeonCli:
             log.warn(f"CLI timeout: stderr={stderr}, stdout={stdout}")
             raise
 
+        return self._check_result(res, check_return_code)
+
+    def _env_vars(self, extra_env_vars: dict[str, str] | None = None) -> dict[str, str]:
+        env_vars = os.environ.copy()
+
+        # extra env
+        for extra_env_key, extra_env_value in (self.extra_env or {}).items():
+            env_vars[extra_env_key] = extra_env_value
+        for extra_env_key, extra_env_value in (extra_env_vars or {}).items():
+            env_vars[extra_env_key] = extra_env_value
+
+        # Pass through coverage settings
+        var = "LLVM_PROFILE_FILE"
+        val = os.environ.get(var)
+        if val:
+            env_vars[var] = val
+
+        return env_vars
+
+    @staticmethod
+    def _check_result(
+        res: subprocess.CompletedProcess[str], check_return_code: bool
+    ) -> subprocess.CompletedProcess[str]:
+        """Log the output of a command, and raise if it failed and `check_return_code`"""
         indent = "  "
         if not res.returncode:
             stripped = res.stdout.strip()
@@ -138,6 +156,124 @@ class AbstractNeonCli:
         return res
 
 
+# Starts the line with the result of each command run by `neon_local batch`
+NEON_LOCAL_BATCH_RESULT_MARKER = "\x1eneon_local batch result: "
+
+
+@dataclass
+class CliCallTiming:
+    arguments: list[str]
+    # From sending the command to receiving its result
+    duration: float
+    # As measured by neon_local, excluding the round trip
+    command_duration: float
+
+
+class NeonLocalBatch:
+    """
+    A `neon_local batch` process, which runs the commands sent to it one by one without
+    starting a process and loading the repository config for each. Use it through
+    `NeonLocalCli.batch()`.
+
+    The stdout of each command is returned as usual. Its stderr is whatever arrived on the
+    shared pipe by the time the command completed, so it may be incomplete.
+    """
+
+    def __init__(self, args: list[str], env_vars: dict[str, str]):
+        self.args = args
+        self.timings: list[CliCallTiming] = []
+        self._lock = threading.Lock()
+        self._stdout: queue.Queue[str | None] = queue.Queue()
+        self._stderr: list[str] = []
+        self._proc = subprocess.Popen(
+            args,
+            env=env_vars,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            bufsize=1,
+        )
+        threading.Thread(target=self._read_stdout, daemon=True).start()
+        threading.Thread(target=self._read_stderr, daemon=True).start()
+
+    def _read_stdout(self):
+        assert self._proc.stdout is not None
+        for line in self._proc.stdout:
+            self._stdout.put(line)
+        self._stdout.put(None)
+
+    def _read_stderr(self):
+        assert self._proc.stderr is not None
+        for line in self._proc.stderr:
+            self._stderr.append(line)
+
+    def raw_cli(
+        self, arguments: list[str], check_return_code=True, timeout=None
+    ) -> subprocess.CompletedProcess[str]:
+        """Like `AbstractNeonCli.raw_cli`, but run by the batch process"""
+        assert isinstance(arguments, list)
+        args = self.args + arguments
+        with self._lock:
+            assert self._proc.stdin is not None
+            log.info('Running batched command "{}"'.format(" ".join(args)))
+            self._stderr.clear()
+            started = time.monotonic()
+            try:
+                self._proc.stdin.write(json.dumps(arguments) + "\n")
+                self._proc.stdin.flush()
+            except BrokenPipeError:
+                pass  # reported below, once stdout reaches EOF
+
+            stdout: list[str] = []
+            while True:
+                remaining = None if timeout is None else timeout - (time.monotonic() - started)
+                try:
+                    line = self._stdout.get(timeout=remaining)
+                except queue.Empty:
+                    log.warn(
+                        f"CLI timeout: stderr={''.join(self._stderr)}, stdout={''.join(stdout)}"
+                    )
+                    self._proc.kill()
+                    raise subprocess.TimeoutExpired(args, timeout, "".join(stdout)) from None
+                if line is None:
+                    # neon_local exits on some failures, e.g. when `start` fails
+                    returncode, command_duration = self._proc.wait() or 1, 0.0
+                    self._stdout.put(None)
+                    break
+                if line.startswith(NEON_LOCAL_BATCH_RESULT_MARKER):
+                    result = json.loads(line[len(NEON_LOCAL_BATCH_RESULT_MARKER) :])
+                    returncode, command_duration = result["exit_code"], result["elapsed_secs"]
+                    break
+                stdout.append(line)
+            duration = time.monotonic() - started
+            res = subprocess.CompletedProcess(
+                args, returncode, "".join(stdout), "".join(self._stderr)
+            )
+            self.timings.append(CliCallTiming(arguments, duration, command_duration))
+
+        log.debug(f"Batched command took {duration:.3f}s, {command_duration:.3f}s in neon_local")
+        return AbstractNeonCli._check_result(res, check_return_code)
+
+    def close(self):
+        """Wait for the batch process to exit after its last command"""
+        with self._lock:
+            if self._proc.stdin is not None and not self._proc.stdin.closed:
+                try:
+                    self._proc.stdin.close()
+                except BrokenPipeError:
+                    pass
+            # Not waiting for the readers: processes started by the batch may hold on to its pipes
+            self._proc.wait()
+        if self.timings:
+            total = sum(t.duration for t in self.timings)
+            in_commands = sum(t.command_duration for t in self.timings)
+            log.info(
+                f"Ran {len(self.timings)} commands in one neon_local process in {total:.3f}s, "
+                f"{in_commands:.3f}s of it in the commands"
+            )
+
+
 class NeonLocalCli(AbstractNeonCli):
     """A typed wrapper around the `neon_local` CLI tool.
     Supports main commands via typed methods and a way to run arbitrary command directly via CLI.
@@ -183,9 +319,42 @@ class NeonLocalCli(AbstractNeonCli):
         env_vars["POSTGRES_DISTRIB_DIR"] = str(pg_distrib_dir)
 
         super().__init__(env_vars, binpath)
+        self._batch: NeonLocalBatch | None = None
 
-    def raw_cli(self, *args, **kwargs) -> subprocess.CompletedProcess[str]:
-        return super().raw_cli(*args, **kwargs)
+    def raw_cli(
+        self,
+        arguments: list[str],
+        extra_env_vars: dict[str, str] | None = None,
+        check_return_code=True,
+        timeout=None,
+    ) -> subprocess.CompletedProcess[str]:
+        if self._batch is not None:
+            assert not extra_env_vars, "commands with their own environment can't be batched"
+            return self._batch.raw_cli(arguments, check_return_code, timeout)
+        return super().raw_cli(arguments, extra_env_vars, check_return_code, timeout)
+
+    @contextmanager
+    def batch(self) -> Iterator[NeonLocalBatch]:
+        """
+        Run the commands issued in the block, through this object, in a single neon_local
+        process:
+
+        >>> with env.neon_cli.batch():
+        ...     for i in range(1024):
+        ...         env.create_branch(f"b{i}")
+
+        The repository stays locked until the block exits, so nothing else may run
+        neon_local meanwhile, and its config is loaded once, so it must not be edited
+        other than through the batched commands either.
+        """
+        assert self._batch is None, "batches can't be nested"
+        batch = NeonLocalBatch([str(self.binpath / self.COMMAND), "batch"], self._env_vars())
+        self._batch = batch
+        try:
+            yield batch
+        finally:
+            self._batch = None
+            batch.close()
 
     def tenant_create(
         self,
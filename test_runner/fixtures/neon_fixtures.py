@@ -4,7 +4,6 @@ import abc
 import asyncio
 import concurrent.futures
 import dataclasses
-import filecmp
 import json
 import os
 import re
@@ -19,7 +18,7 @@ from contextlib import closing, contextmanager
 from dataclasses import dataclass
 from datetime import datetime
 from enum import StrEnum
-from functools import cached_property
+from functools import cached_property, partial
 from pathlib import Path
 from typing import TYPE_CHECKING, cast
 from urllib.parse import quote, urlparse
@@ -52,7 +51,9 @@ from fixtures.common_types import (
 )
 from fixtures.compute_migrations import NUM_COMPUTE_MIGRATIONS
 from fixtures.endpoint.http import ComputeClaimsScope, EndpointHttpClient
+from fixtures.http_client_cache import HttpClientCache, retry_policy_key
 from fixtures.log_helper import log
+from fixtures.log_tail import LogCursor, LogTailer
 from fixtures.metrics import Metrics, MetricsGetter, parse_metrics
 from fixtures.neon_cli import NeonLocalCli, Pagectl
 from fixtures.pageserver.allowed_errors import (
@@ -67,8 +68,10 @@ from fixtures.pageserver.http import (
 )
 from fixtures.pageserver.utils import (
     wait_for_last_record_lsn,
+    wait_for_last_record_lsn_shards,
 )
 from fixtures.paths import get_test_repo_dir, shared_snapshot_dir
+from fixtures.pg_datadir import StreamingDatadirComparator
 from fixtures.port_distributor import PortDistributor
 from fixtures.remote_storage import (
     LocalFsStorage,
@@ -87,6 +90,8 @@ from fixtures.safekeeper.http import (
     TimelineCreateRequest,
 )
 from fixtures.safekeeper.utils import wait_walreceivers_absent
+from fixtures.snapshot_restore import SnapshotMaterializer
+from fixtures.storage_controller_placement import ShardPlacement, TenantPlacementIndex
 from fixtures.utils import (
     ATTACHMENT_NAME_REGEX,
     COMPONENT_BINARIES,
@@ -98,12 +103,13 @@ from fixtures.utils import (
     size_to_bytes,
     subprocess_capture,
     wait_until,
+    write_json_atomic,
 )
 
 from .neon_api import NeonAPI, NeonApiEndpoint
 
 if TYPE_CHECKING:
-    from collections.abc import Callable, Iterable, Iterator
+    from collections.abc import Callable, Iterable, Iterator, Sequence
     from types import TracebackType
     from typing import Any, Self, TypeVar
 
@@ -118,6 +124,7 @@ if TYPE_CHECKING:
     from fixtures.h2server import H2Server
     from fixtures.paths import SnapshotDirLocked
     from fixtures.pg_version import PgVersion
+    from fixtures.snapshot_restore import SnapshotRestoreStats
 
     T = TypeVar("T")
 
@@ -487,6 +494,8 @@ class NeonEnvBuilder:
         self.test_output_dir = test_output_dir
         self.test_overlay_dir = test_overlay_dir
         self.overlay_mounts_created_by_us: list[tuple[str, Path]] = []
+        # Set by from_repo_dir: what it took to restore the snapshot
+        self.snapshot_restore_stats: SnapshotRestoreStats | None = None
         self.config_init_force: str | None = None
         self.top_output_dir = top_output_dir
         self.control_plane_hooks_api: str | None = None
@@ -674,15 +683,18 @@ class NeonEnvBuilder:
         )
         self.env = self.init_configs()
 
+        # Reflinks or hardlinks where possible, see fixtures.snapshot_restore
+        materializer = SnapshotMaterializer()
+
         for ps_dir in repo_dir.glob("pageserver_*"):
             tenants_from_dir = ps_dir / "tenants"
             tenants_to_dir = self.repo_dir / ps_dir.name / "tenants"
 
             if self.test_overlay_dir is None:
                 log.info(
-                    f"Copying pageserver tenants directory {tenants_from_dir} to {tenants_to_dir}"
+                    f"Restoring pageserver tenants directory {tenants_from_dir} to {tenants_to_dir}"
                 )
-                shutil.copytree(tenants_from_dir, tenants_to_dir)
+                materializer.copytree(tenants_from_dir, tenants_to_dir)
             else:
                 log.info(
                     f"Creating overlayfs mount of pageserver tenants directory {tenants_from_dir} to {tenants_to_dir}"
@@ -693,12 +705,18 @@ class NeonEnvBuilder:
             sk_to_dir = self.repo_dir / "safekeepers" / sk_from_dir.name
             log.info(f"Copying safekeeper directory {sk_from_dir} to {sk_to_dir}")
             sk_to_dir.rmdir()
-            shutil.copytree(sk_from_dir, sk_to_dir, ignore=shutil.ignore_patterns("*.log", "*.pid"))
+            # WAL segments are written in place, never hardlink them
+            materializer.copytree(
+                sk_from_dir,
+                sk_to_dir,
+                ignore=shutil.ignore_patterns("*.log", "*.pid"),
+                allow_hardlinks=False,
+            )
 
         shutil.rmtree(self.repo_dir / "local_fs_remote_storage", ignore_errors=True)
         if self.test_overlay_dir is None:
-            log.info("Copying local_fs_remote_storage directory from snapshot")
-            shutil.copytree(
+            log.info("Restoring local_fs_remote_storage directory from snapshot")
+            materializer.copytree(
                 repo_dir / "local_fs_remote_storage", self.repo_dir / "local_fs_remote_storage"
             )
         else:
@@ -721,8 +739,15 @@ class NeonEnvBuilder:
                 return {"postgres.log"}
             return set()
 
-        shutil.copytree(storcon_db_from_dir, storcon_db_to_dir, ignore=ignore_postgres_log)
+        materializer.copytree(
+            storcon_db_from_dir,
+            storcon_db_to_dir,
+            ignore=ignore_postgres_log,
+            allow_hardlinks=False,
+        )
         assert not (storcon_db_to_dir / "postgres.log").exists()
+        materializer.log_summary()
+        self.snapshot_restore_stats = materializer.stats
         # NB: neon_local rewrites postgresql.conf on each start based on neon_local config. No need to patch it.
         # However, in this new NeonEnv, the pageservers listen on different ports, and the storage controller
         # will currently reject re-attach requests from them because the NodeMetadata isn't identical.
@@ -1022,17 +1047,19 @@ class NeonEnvBuilder:
             if cleanup_error is not None:
                 raise cleanup_error
 
-            for pageserver in self.env.pageservers:
-                pageserver.assert_no_errors()
-
-            for safekeeper in self.env.safekeepers:
-                safekeeper.assert_no_errors()
-
-            self.env.storage_controller.assert_no_errors()
-
-            self.env.broker.assert_no_errors()
-
-            self.env.endpoint_storage.assert_no_errors()
+            # Scan the logs of all services concurrently, but report the failures
+            # in this order.
+            checks: list[Callable[[], None]] = [
+                *(pageserver.assert_no_errors for pageserver in self.env.pageservers),
+                *(safekeeper.assert_no_errors for safekeeper in self.env.safekeepers),
+                self.env.storage_controller.assert_no_errors,
+                self.env.broker.assert_no_errors,
+                self.env.endpoint_storage.assert_no_errors,
+            ]
+            with concurrent.futures.ThreadPoolExecutor(max_workers=len(checks)) as executor:
+                futs = [executor.submit(check) for check in checks]
+                for fut in futs:
+                    fut.result()
 
         try:
             self.overlay_cleanup_teardown()
@@ -1088,6 +1115,8 @@ class NeonEnv:
         self.endpoints = EndpointFactory(self)
         self.safekeepers: list[Safekeeper] = []
         self.pageservers: list[NeonPageserver] = []
+        # Component name -> how long the last stop() took to stop it, in seconds
+        self.stop_durations: dict[str, float] = {}
         self.num_azs = config.num_azs
         self.broker = NeonBroker(self, config.use_https_storage_broker_api)
         self.pageserver_remote_storage = config.pageserver_remote_storage
@@ -1406,40 +1435,66 @@ class NeonEnv:
 
         self.endpoint_storage.start(timeout_in_seconds=timeout_in_seconds)
 
+    def _stop_concurrently(self, steps: dict[str, Callable[[], object]]) -> list[Exception]:
+        """
+        Run the named teardown steps in parallel, recording how long each took
+        in `self.stop_durations`. Returns the errors, in the order of `steps`.
+        """
+
+        def timed(name: str, step: Callable[[], object]):
+            started_at = time.monotonic()
+            try:
+                step()
+            finally:
+                self.stop_durations[name] = time.monotonic() - started_at
+
+        if not steps:
+            return []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(steps)) as executor:
+            futs = [executor.submit(timed, name, step) for name, step in steps.items()]
+        errors = []
+        for fut in futs:
+            e = fut.exception()
+            if e is not None:
+                assert isinstance(e, Exception)
+                errors.append(e)
+        return errors
+
     def stop(self, immediate=False, ps_assert_metric_no_errors=False, fail_on_endpoint_errors=True):
         """
         After this method returns, there should be no child processes running.
 
-        Unless of course, some stopping failed, in that case, all remaining child processes are leaked.
+        Components are stopped in dependency order: endpoints, then endpoint
+        storage and the storage controller (we don't want it to spuriously
+        detect a pageserver "failure" during test teardown), then pageservers
+        and safekeepers in parallel, and the broker last. A failure in one component doesn't stop us from trying
+        to stop the others; the errors are raised at the end, in an
+        ExceptionGroup if there is more than one.
         """
+        self.stop_durations = {}
+        errors: list[Exception] = []
 
-        # the commonly failing components have special try-except behavior,
-        # trying to get us to actually shutdown all processes over easier error
-        # reporting.
-
-        raise_later = None
-        try:
-            self.endpoints.stop_all(fail_on_endpoint_errors)
-        except Exception as e:
-            raise_later = e
-
-        self.endpoint_storage.stop(immediate=immediate)
+        errors += self._stop_concurrently(
+            {"endpoints": lambda: self.endpoints.stop_all(fail_on_endpoint_errors)}
+        )
 
-        # Stop storage controller before pageservers: we don't want it to spuriously
-        # detect a pageserver "failure" during test teardown
-        self.storage_controller.stop(immediate=immediate)
+        # Endpoints may talk to endpoint storage while they shut down
+        errors += self._stop_concurrently(
+            {
+                "endpoint_storage": lambda: self.endpoint_storage.stop(immediate=immediate),
+                "storage_controller": lambda: self.storage_controller.stop(immediate=immediate),
+            }
+        )
 
-        stop_later = []
-        metric_errors = []
+        stop_failed: list[NeonPageserver] = []
 
-        for sk in self.safekeepers:
-            sk.stop(immediate=immediate)
-        for pageserver in self.pageservers:
+        def stop_pageserver(pageserver: NeonPageserver):
+            metric_error = None
             if ps_assert_metric_no_errors:
                 try:
                     pageserver.assert_no_metric_errors()
                 except Exception as e:
-                    metric_errors.append(e)
+                    metric_error = e
                     log.error(f"metric validation failed on {pageserver.id}: {e}")
 
             try:
@@ -1450,24 +1505,38 @@ class NeonEnv:
             try:
                 pageserver.stop(immediate=immediate)
             except RuntimeError:
-                stop_later.append(pageserver)
-        self.broker.stop()
-
-        # TODO: for nice logging we need python 3.11 ExceptionGroup
-        for ps in stop_later:
-            ps.stop(immediate=True)
+                stop_failed.append(pageserver)
+                pageserver.stop(immediate=True)
 
-        if raise_later is not None:
-            raise raise_later
+            if metric_error is not None:
+                raise metric_error
 
-        for error in metric_errors:
-            raise error
+        steps: dict[str, Callable[[], object]] = {}
+        for sk in self.safekeepers:
+            steps[f"safekeeper_{sk.id}"] = partial(sk.stop, immediate=immediate)
+        for pageserver in self.pageservers:
+            steps[f"pageserver_{pageserver.id}"] = partial(stop_pageserver, pageserver)
+        errors += self._stop_concurrently(steps)
 
-        if len(stop_later) > 0:
-            raise RuntimeError(
-                f"{len(stop_later)} out of {len(self.pageservers)} pageservers failed to stop gracefully"
+        if len(stop_failed) > 0:
+            errors.append(
+                RuntimeError(
+                    f"{len(stop_failed)} out of {len(self.pageservers)} pageservers failed to stop gracefully"
+                )
             )
 
+        errors += self._stop_concurrently({"broker": lambda: self.broker.stop()})
+
+        log.info(
+            "stop durations: "
+            + ", ".join(f"{name}={duration:.3f}s" for name, duration in self.stop_durations.items())
+        )
+
+        if len(errors) == 1:
+            raise errors[0]
+        if len(errors) > 1:
+            raise ExceptionGroup("errors while stopping the environment", errors)
+
     @property
     def pageserver(self) -> NeonPageserver:
         """
@@ -1762,11 +1831,27 @@ class PageserverPort:
 class LogUtils:
     """
     A mixin class which provides utilities for inspecting the logs of a service.
+
+    Logs are read incrementally: every log file gets a `LogTailer`, which
+    remembers how far into the file it has already looked, so polling for a
+    pattern in `wait_until()` only scans the newly appended lines.
     """
 
     def __init__(self, logfile: Path) -> None:
         self.logfile = logfile
 
+    def log_tailer(self, logfile: Path | None = None) -> LogTailer:
+        """Get the tailer for `logfile`, defaulting to this service's log file"""
+        logfile = self.logfile if logfile is None else logfile
+        # Subclasses set `self.logfile` without calling our __init__, and some of
+        # them (e.g. Endpoint) change it over their lifetime, so tailers are
+        # created lazily and kept per path.
+        tailers: dict[Path, LogTailer] = self.__dict__.setdefault("_log_tailers", {})
+        tailer = tailers.get(logfile)
+        if tailer is None:
+            tailer = tailers.setdefault(logfile, LogTailer(logfile))
+        return tailer
+
     def assert_log_contains(
         self, pattern: str, offset: None | LogCursor = None
     ) -> tuple[str, LogCursor]:
@@ -1780,34 +1865,43 @@ class LogUtils:
         self, pattern: str, offset: None | LogCursor = None
     ) -> tuple[str, LogCursor] | None:
         """Check that the log contains a line that matches the given regex"""
+        res = self.log_contains_any([pattern], offset=offset)
+        if res is None:
+            return None
+        _, line, cursor = res
+        return (line, cursor)
+
+    def assert_log_contains_any(
+        self, patterns: Sequence[str], offset: None | LogCursor = None
+    ) -> tuple[int, str, LogCursor]:
+        """Like assert_log_contains(), but waits for whichever of `patterns` shows up first"""
+
+        res = self.log_contains_any(patterns, offset=offset)
+        assert res is not None, f"none of {list(patterns)} found in {self.logfile}"
+        return res
+
+    def log_contains_any(
+        self, patterns: Sequence[str], offset: None | LogCursor = None
+    ) -> tuple[int, str, LogCursor] | None:
+        """
+        Check that the log contains a line that matches any of the given regexes.
+
+        Returns the index of the pattern that matched, the line and a cursor
+        pointing after that line.
+        """
         logfile = self.logfile
         if not logfile.exists():
             log.warning(f"Skipping log check: {logfile} does not exist")
             return None
 
-        log.info(f"Checking log {logfile} for pattern '{pattern}'")
-
-        contains_re = re.compile(pattern)
+        log.info(f"Checking log {logfile} for pattern(s) {', '.join(repr(p) for p in patterns)}")
 
         # XXX: Our rust logging machinery buffers the messages, so if you
         # call this function immediately after it's been logged, there is
         # no guarantee it is already present in the log file. This hasn't
         # been a problem in practice, our python tests are not fast enough
         # to hit that race condition.
-        skip_until_line_no = 0 if offset is None else offset._line_no
-        cur_line_no = 0
-        with logfile.open("r") as f:
-            for line in f:
-                if cur_line_no < skip_until_line_no:
-                    cur_line_no += 1
-                    continue
-                elif contains_re.search(line):
-                    # found it!
-                    cur_line_no += 1
-                    return (line, LogCursor(cur_line_no))
-                else:
-                    cur_line_no += 1
-        return None
+        return self.log_tailer(logfile).search(patterns, offset)
 
 
 class StorageControllerApiException(Exception):
@@ -1860,6 +1954,7 @@ class NeonStorageController(MetricsGetter, LogUtils):
         self.allowed_errors: list[str] = DEFAULT_STORAGE_CONTROLLER_ALLOWED_ERRORS
         self.logfile = self.env.repo_dir / "storage_controller_1" / "storage_controller.log"
         self.ssl_ca_file = env.ssl_ca_file
+        self._placement_index = TenantPlacementIndex(self)
 
     def start(
         self,
@@ -1944,9 +2039,9 @@ class NeonStorageController(MetricsGetter, LogUtils):
 
         return headers
 
-    def get_metrics(self) -> Metrics:
+    def get_metrics(self, prefixes: Sequence[str] | None = None) -> Metrics:
         res = self.request("GET", f"{self.api}/metrics")
-        return parse_metrics(res.text)
+        return parse_metrics(res.text, prefixes=prefixes)
 
     def ready(self) -> bool:
         status = None
@@ -2107,12 +2202,18 @@ class NeonStorageController(MetricsGetter, LogUtils):
         """
         Debug listing API: dumps the internal map of tenant shards
         """
+        return json.loads(self.tenant_shard_dump_raw())
+
+    def tenant_shard_dump_raw(self) -> bytes:
+        """
+        Like `tenant_shard_dump`, but returns the unparsed response body
+        """
         response = self.request(
             "GET",
             f"{self.api}/debug/v1/tenant",
             headers=self.headers(TokenScope.ADMIN),
         )
-        return response.json()
+        return response.content
 
     def tenant_list(self, **kwargs):
         """
@@ -2484,68 +2585,55 @@ class NeonStorageController(MetricsGetter, LogUtils):
         log.info(f"Got failpoints request response code {res.status_code}")
         res.raise_for_status()
 
+    def placement_index(self) -> TenantPlacementIndex:
+        """
+        The indexed placements of all tenant shards known to the storage controller,
+        refreshed from the storage controller.
+        """
+        self._placement_index.refresh()
+        return self._placement_index
+
     def get_tenants_placement(self) -> defaultdict[str, dict[str, Any]]:
         """
         Get the intent and observed placements of all tenants known to the storage controller.
         """
-        tenants = self.tenant_shard_dump()
-
         tenant_placement: defaultdict[str, dict[str, Any]] = defaultdict(
             lambda: {
                 "observed": {"attached": None, "secondary": []},
                 "intent": {"attached": None, "secondary": []},
             }
         )
-
-        for t in tenants:
-            for node_id, loc_state in t["observed"]["locations"].items():
-                if (
-                    loc_state is not None
-                    and "conf" in loc_state
-                    and loc_state["conf"] is not None
-                    and loc_state["conf"]["mode"]
-                    in set(["AttachedSingle", "AttachedMulti", "AttachedStale"])
-                ):
-                    tenant_placement[t["tenant_shard_id"]]["observed"]["attached"] = int(node_id)
-
-                if (
-                    loc_state is not None
-                    and "conf" in loc_state
-                    and loc_state["conf"] is not None
-                    and loc_state["conf"]["mode"] == "Secondary"
-                ):
-                    tenant_placement[t["tenant_shard_id"]]["observed"]["secondary"].append(
-                        int(node_id)
-                    )
-
-            if "attached" in t["intent"]:
-                tenant_placement[t["tenant_shard_id"]]["intent"]["attached"] = t["intent"][
-                    "attached"
-                ]
-
-            if "secondary" in t["intent"]:
-                tenant_placement[t["tenant_shard_id"]]["intent"]["secondary"] += t["intent"][
-                    "secondary"
-                ]
+        for tid, placement in self.placement_index().shards.items():
+            tenant_placement[tid] = placement.as_dict()
 
         return tenant_placement
 
-    def warm_up_all_secondaries(self):
+    def warm_up_all_secondaries(self, concurrency: int = 32):
+        """
+        Upload a heatmap from each shard's attached location, and have its secondary
+        location download it. Shards are processed concurrently, at most `concurrency`
+        at a time.
+        """
         log.info("Warming up all secondary locations")
 
-        tenant_placement = self.get_tenants_placement()
-        for tid, placement in tenant_placement.items():
-            assert placement["observed"]["attached"] is not None
-            primary_id = placement["observed"]["attached"]
+        def warm_up(placement: ShardPlacement):
+            assert placement.observed_attached is not None
+            assert len(placement.observed_secondary) == 1
 
-            assert len(placement["observed"]["secondary"]) == 1
-            secondary_id = placement["observed"]["secondary"][0]
+            parsed_tid = TenantShardId.parse(placement.tenant_shard_id)
+            primary = self.env.get_pageserver(placement.observed_attached)
+            secondary = self.env.get_pageserver(placement.observed_secondary[0])
+            primary.http_client().tenant_heatmap_upload(parsed_tid)
+            secondary.http_client().tenant_secondary_download(parsed_tid, wait_ms=250)
 
-            parsed_tid = TenantShardId.parse(tid)
-            self.env.get_pageserver(primary_id).http_client().tenant_heatmap_upload(parsed_tid)
-            self.env.get_pageserver(secondary_id).http_client().tenant_secondary_download(
-                parsed_tid, wait_ms=250
-            )
+        placements = list(self.placement_index().shards.values())
+        if len(placements) == 0:
+            return
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(len(placements), concurrency)
+        ) as executor:
+            for fut in [executor.submit(warm_up, p) for p in placements]:
+                fut.result()
 
     def get_leadership_status(self) -> StorageControllerLeadershipStatus:
         metric_values = {}
@@ -2719,19 +2807,16 @@ class NeonProxiedStorageController(NeonStorageController):
     ) -> tuple[str, LogCursor] | None:
         for instance_id in self.instances.keys():
             log_path = self.instance_log_path(instance_id)
-            checker = LogUtils(log_path)
-            found = checker.log_contains(pattern, offset)
-            if found is not None:
-                return found
+            if not log_path.exists():
+                continue
+            res = self.log_tailer(log_path).search([pattern], offset)
+            if res is not None:
+                _, line, cursor = res
+                return (line, cursor)
 
         return None
 
 
-@dataclass
-class LogCursor:
-    _line_no: int
-
-
 class NeonPageserver(PgProtocol, LogUtils):
     """
     An object representing a running pageserver.
@@ -2758,6 +2843,9 @@ class NeonPageserver(PgProtocol, LogUtils):
         self.allowed_errors: list[str] = list(DEFAULT_PAGESERVER_ALLOWED_ERRORS)
         # Store persistent failpoints that should be reapplied on each start
         self._persistent_failpoints: dict[str, str] = {}
+        self._http_clients: HttpClientCache[PageserverHttpClient] = HttpClientCache(
+            f"pageserver_{id}"
+        )
 
     def add_persistent_failpoint(self, name: str, action: str):
         """
@@ -2848,6 +2936,7 @@ class NeonPageserver(PgProtocol, LogUtils):
         if isinstance(storage, S3Storage):
             s3_env_vars = storage.access_env_vars()
             extra_env_vars = (extra_env_vars or {}) | s3_env_vars
+        self._http_clients.invalidate()
         self.env.neon_cli.pageserver_start(
             self.id, extra_env_vars=extra_env_vars, timeout_in_seconds=timeout_in_seconds
         )
@@ -2872,6 +2961,7 @@ class NeonPageserver(PgProtocol, LogUtils):
         if self.running:
             self.env.neon_cli.pageserver_stop(self.id, immediate)
             self.running = False
+        self._http_clients.invalidate()
         return self
 
     def restart(
@@ -2931,11 +3021,18 @@ class NeonPageserver(PgProtocol, LogUtils):
     def http_client(
         self, auth_token: str | None = None, retries: Retry | None = None
     ) -> PageserverHttpClient:
-        return PageserverHttpClient(
-            port=self.service_port.http,
-            auth_token=auth_token,
-            is_testing_enabled_or_skip=self.is_testing_enabled_or_skip,
-            retries=retries,
+        """
+        Clients are cached per (auth_token, retries) until the pageserver is
+        started or stopped, so calling this in a polling loop reuses connections.
+        """
+        return self._http_clients.get(
+            (auth_token, retry_policy_key(retries)),
+            lambda: PageserverHttpClient(
+                port=self.service_port.http,
+                auth_token=auth_token,
+                is_testing_enabled_or_skip=self.is_testing_enabled_or_skip,
+                retries=retries,
+            ),
         )
 
     @property
@@ -3220,13 +3317,15 @@ class PgBin:
         env: Env | None = None,
         cwd: str | None = None,
         with_command_header=True,
+        stderr_line_handler: Callable[[str], None] | None = None,
         **popen_kwargs: Any,
     ) -> str:
         """
         Run one of the postgres binaries, with stderr and stdout redirected to a file.
 
         This is just like `run`, but for chatty programs. Returns basepath for files
-        with captured output.
+        with captured output. `stderr_line_handler`, if given, is called with each
+        line of stderr while the program runs.
         """
 
         self._fixpath(command)
@@ -3240,6 +3339,7 @@ class PgBin:
             cwd=cwd,
             check=True,
             with_command_header=with_command_header,
+            stderr_line_handler=stderr_line_handler,
             **popen_kwargs,
         )
         return base_path
@@ -3632,6 +3732,8 @@ class NeonProxy(PgProtocol):
         self.metric_collection_interval = metric_collection_interval
         self.http_timeout_seconds = 15
         self._popen: subprocess.Popen[bytes] | None = None
+        # Keeps the connection to the SQL-over-HTTP endpoint alive between http_query() calls
+        self._http_session: requests.Session | None = None
 
     def start(self) -> Self:
         assert self._popen is None
@@ -3708,7 +3810,9 @@ class NeonProxy(PgProtocol):
         log.info(f"Executing http query: {query}")
 
         connstr = f"postgresql://{user}:{password}@{self.domain}:{self.proxy_port}/postgres"
-        response = requests.post(
+        if self._http_session is None:
+            self._http_session = requests.Session()
+        response = self._http_session.post(
             f"https://{self.domain}:{self.external_http_port}/sql",
             data=json.dumps({"query": query, "params": args}),
             headers={
@@ -3783,6 +3887,8 @@ class NeonProxy(PgProtocol):
         exc: BaseException | None,
         tb: TracebackType | None,
     ):
+        if self._http_session is not None:
+            self._http_session.close()
         if self._popen is not None:
             self._popen.terminate()
             try:
@@ -4126,13 +4232,23 @@ class Endpoint(PgProtocol, LogUtils):
         # potentially by some __del__ chains in other threads.
         self._running = threading.Semaphore(0)
         self.__jwt: str | None = None
+        self._http_clients: HttpClientCache[EndpointHttpClient] = HttpClientCache(
+            f"endpoint on port {pg_port}"
+        )
 
     def http_client(self, retries: Retry | None = None) -> EndpointHttpClient:
-        assert self.__jwt is not None
-        return EndpointHttpClient(
-            external_port=self.external_http_port,
-            internal_port=self.internal_http_port,
-            jwt=self.__jwt,
+        """
+        Clients are cached per JWT until the endpoint is started or stopped.
+        """
+        jwt = self.__jwt
+        assert jwt is not None
+        return self._http_clients.get(
+            jwt,
+            lambda: EndpointHttpClient(
+                external_port=self.external_http_port,
+                internal_port=self.internal_http_port,
+                jwt=jwt,
+            ),
         )
 
     def create(
@@ -4244,6 +4360,7 @@ class Endpoint(PgProtocol, LogUtils):
         if safekeepers is not None:
             self.active_safekeepers = safekeepers
 
+        self._http_clients.invalidate()
         self.env.neon_cli.endpoint_start(
             self.endpoint_id,
             safekeepers_generation=safekeeper_generation,
@@ -4343,9 +4460,8 @@ class Endpoint(PgProtocol, LogUtils):
             data_dict: dict[str, Any] = json.load(f)
 
         # Write it back updated
-        with open(config_path, "w") as file:
-            log.debug(json.dumps(dict(data_dict, **kwargs)))
-            json.dump(dict(data_dict, **kwargs), file, indent=4)
+        log.debug(json.dumps(dict(data_dict, **kwargs)))
+        write_json_atomic(config_path, dict(data_dict, **kwargs))
 
     def respec_deep(self, **kwargs: Any) -> None:
         """
@@ -4373,9 +4489,8 @@ class Endpoint(PgProtocol, LogUtils):
 
         update(config, kwargs)
 
-        with open(config_path, "w") as file:
-            log.debug("Updating compute config to: %s", json.dumps(config, indent=4))
-            json.dump(config, file, indent=4)
+        log.debug("Updating compute config to: %s", json.dumps(config, indent=4))
+        write_json_atomic(config_path, config)
 
     def wait_for_migrations(self, wait_for: int = NUM_COMPUTE_MIGRATIONS) -> None:
         """
@@ -4432,6 +4547,7 @@ class Endpoint(PgProtocol, LogUtils):
             self.env.neon_cli.endpoint_stop(
                 self.endpoint_id, check_return_code=self.check_stop_result, mode=mode
             )
+            self._http_clients.invalidate()
 
         if sks_wait_walreceiver_gone is not None:
             for sk in sks_wait_walreceiver_gone[0]:
@@ -4453,6 +4569,7 @@ class Endpoint(PgProtocol, LogUtils):
                 self.endpoint_id, True, check_return_code=self.check_stop_result, mode=mode
             )
             self.endpoint_id = None
+            self._http_clients.invalidate()
 
         return self
 
@@ -4627,13 +4744,22 @@ class EndpointFactory:
 
     def stop_all(self, fail_on_error=True) -> Self:
         exception = None
-        for ep in self.endpoints:
+
+        def stop(ep: Endpoint):
+            nonlocal exception
             try:
                 ep.stop()
             except Exception as e:
                 log.error(f"Failed to stop endpoint {ep.endpoint_id}: {e}")
                 exception = e
 
+        # Endpoint.stop() is thread safe
+        if len(self.endpoints) > 0:
+            with concurrent.futures.ThreadPoolExecutor(
+                max_workers=min(len(self.endpoints), 16)
+            ) as executor:
+                list(executor.map(stop, self.endpoints))
+
         if fail_on_error and exception is not None:
             raise exception
 
@@ -4708,6 +4834,9 @@ class Safekeeper(LogUtils):
         self.id = id
         self.running = running
         self.logfile = Path(self.data_dir) / f"safekeeper-{id}.log"
+        self._http_clients: HttpClientCache[SafekeeperHttpClient] = HttpClientCache(
+            f"safekeeper_{id}"
+        )
 
         if extra_opts is None:
             # Testing defaults: enable everything, and set short timeouts so that background
@@ -4740,6 +4869,7 @@ class Safekeeper(LogUtils):
         if isinstance(self.env.safekeepers_remote_storage, S3Storage):
             s3_env_vars = self.env.safekeepers_remote_storage.access_env_vars()
 
+        self._http_clients.invalidate()
         self.env.neon_cli.safekeeper_start(
             self.id,
             extra_opts=extra_opts,
@@ -4751,8 +4881,7 @@ class Safekeeper(LogUtils):
         started_at = time.time()
         while True:
             try:
-                with self.http_client() as http_cli:
-                    http_cli.check_status()
+                self.http_client().check_status()
             except Exception as e:
                 elapsed = time.time() - started_at
                 if elapsed > 3:
@@ -4767,6 +4896,7 @@ class Safekeeper(LogUtils):
     def stop(self, immediate: bool = False) -> Self:
         self.env.neon_cli.safekeeper_stop(self.id, immediate)
         self.running = False
+        self._http_clients.invalidate()
         return self
 
     def assert_no_errors(self):
@@ -4789,10 +4919,15 @@ class Safekeeper(LogUtils):
         """
         if auth_token is None and gen_sk_wide_token:
             auth_token = self.env.auth_keys.generate_safekeeper_token()
-        is_testing_enabled = '"testing"' in self.env.get_binary_version("safekeeper")
-        return SafekeeperHttpClient(
-            port=self.port.http, auth_token=auth_token, is_testing_enabled=is_testing_enabled
-        )
+
+        def create() -> SafekeeperHttpClient:
+            is_testing_enabled = '"testing"' in self.env.get_binary_version("safekeeper")
+            return SafekeeperHttpClient(
+                port=self.port.http, auth_token=auth_token, is_testing_enabled=is_testing_enabled
+            )
+
+        # Clients are cached per token until the safekeeper is started or stopped
+        return self._http_clients.get(auth_token, create)
 
     def get_timeline_start_lsn(self, tenant_id: TenantId, timeline_id: TimelineId) -> Lsn:
         timeline_status = self.http_client().timeline_status(tenant_id, timeline_id)
@@ -5273,38 +5408,24 @@ def check_restored_datadir_content(
     # Read the shutdown checkpoint's LSN
     checkpoint_lsn = pg_bin.get_pg_controldata_checkpoint_lsn(endpoint.pg_data_dir_path())
 
-    # Take a basebackup from pageserver
-    restored_dir_path = env.repo_dir / f"{endpoint.endpoint_id}_restored_datadir"
-    restored_dir_path.mkdir(exist_ok=True)
-
-    psql_path = os.path.join(pg_bin.pg_bin_path, "psql")
-
+    # Stream a basebackup from the pageserver and compare it with the endpoint's
+    # data directory as it arrives, without extracting it.
+    assert endpoint.pgdata_dir
+    comparator = StreamingDatadirComparator(
+        Path(endpoint.pgdata_dir),
+        want=lambda rel_dir, filename: not (should_skip_dir(rel_dir) or should_skip_file(filename)),
+    )
     pageserver_id = env.storage_controller.locate(endpoint.tenant_id)[0]["node_id"]
-    cmd = rf"""
-        {psql_path}                                    \
-            --no-psqlrc                                \
-            postgres://localhost:{env.get_pageserver(pageserver_id).service_port.pg}  \
-            -c 'basebackup {endpoint.tenant_id} {timeline_id} {checkpoint_lsn}'  \
-         | tar -x -C {restored_dir_path}
-    """
-
-    # Set LD_LIBRARY_PATH in the env properly, otherwise we may use the wrong libpq.
-    # PgBin sets it automatically, but here we need to pipe psql output to the tar command.
-    psql_env = {"LD_LIBRARY_PATH": pg_bin.pg_lib_dir}
-    result = subprocess.run(cmd, env=psql_env, capture_output=True, text=True, shell=True)
-
-    # Print captured stdout/stderr if basebackup cmd failed.
-    if result.returncode != 0:
-        log.error("Basebackup shell command failed with:")
-        log.error(result.stdout)
-        log.error(result.stderr)
-    assert result.returncode == 0
+    pageserver = env.get_pageserver(pageserver_id)
+    with closing(pageserver.connect()) as conn, conn.cursor() as cur:
+        comparator.compare_copy_out(
+            cur, f"basebackup {endpoint.tenant_id} {timeline_id} {checkpoint_lsn}"
+        )
 
     # list files we're going to compare
-    assert endpoint.pgdata_dir
     pgdata_files = list_files_to_compare(Path(endpoint.pgdata_dir))
 
-    restored_files = list_files_to_compare(restored_dir_path)
+    restored_files = comparator.files
 
     # pg_notify files are always ignored
     pgdata_files = [f for f in pgdata_files if not f.startswith("pg_notify")]
@@ -5327,27 +5448,18 @@ def check_restored_datadir_content(
     assert pgdata_files == restored_files
 
     # compare content of the files
-    # filecmp returns (match, mismatch, error) lists
     # We've already filtered all mismatching files in list_files_to_compare(),
     # so here expect that the content is identical
-    (match, mismatch, error) = filecmp.cmpfiles(
-        endpoint.pgdata_dir, restored_dir_path, pgdata_files, shallow=False
-    )
-    log.info(f"filecmp result mismatch and error lists:\n\t mismatch={mismatch}\n\t error={error}")
-
-    for f in mismatch:
-        f1 = os.path.join(endpoint.pgdata_dir, f)
-        f2 = os.path.join(restored_dir_path, f)
-        stdout_filename = f"{f2}.filediff"
-
-        with open(stdout_filename, "w") as stdout_f:
-            subprocess.run(f"xxd -b {f1} > {f1}.hex ", shell=True)
-            subprocess.run(f"xxd -b {f2} > {f2}.hex ", shell=True)
+    mismatch = [comparator.diffs[f] for f in pgdata_files if f in comparator.diffs]
+    log.info(f"basebackup comparison mismatch list:\n\t mismatch={[d.name for d in mismatch]}")
 
-            cmd = f"diff {f1}.hex {f2}.hex"
-            subprocess.run([cmd], stdout=stdout_f, shell=True)
+    if mismatch:
+        diff_filename = test_output_dir / f"{endpoint.endpoint_id}_basebackup.filediff"
+        with open(diff_filename, "w") as diff_f:
+            for d in mismatch:
+                diff_f.write(f"{d}\n")
 
-    assert (mismatch, error) == ([], [])
+    assert [d.name for d in mismatch] == []
 
 
 # wait for subscriber to catch up with publisher
@@ -5472,10 +5584,16 @@ def wait_for_last_flush_lsn(
     pageserver_id: int | None = None,
     auth_token: str | None = None,
     last_flush_lsn: Lsn | None = None,
+    shards: list[tuple[TenantShardId, NeonPageserver]] | None = None,
 ) -> Lsn:
-    """Wait for pageserver to catch up the latest flush LSN, returns the last observed lsn."""
+    """
+    Wait for pageserver to catch up the latest flush LSN, returns the last observed lsn.
 
-    shards = tenant_get_shards(env, tenant, pageserver_id)
+    Callers that already have the result of `tenant_get_shards` can pass it as `shards`.
+    """
+
+    if shards is None:
+        shards = tenant_get_shards(env, tenant, pageserver_id)
 
     if last_flush_lsn is None:
         last_flush_lsn = Lsn(endpoint.safe_psql("SELECT pg_current_wal_flush_lsn()")[0][0])
@@ -5487,20 +5605,17 @@ def wait_for_last_flush_lsn(
         # we forcibly flush the WAL by using CHECKPOINT.
         endpoint.safe_psql("CHECKPOINT")
 
-    results = []
-    for tenant_shard_id, pageserver in shards:
-        log.info(
-            f"wait_for_last_flush_lsn: waiting for {last_flush_lsn} on shard {tenant_shard_id} on pageserver {pageserver.id})"
-        )
-        waited = wait_for_last_record_lsn(
-            pageserver.http_client(auth_token=auth_token), tenant_shard_id, timeline, last_flush_lsn
-        )
-
-        assert waited >= last_flush_lsn
-        results.append(waited)
+    log.info(
+        f"wait_for_last_flush_lsn: waiting for {last_flush_lsn} on shards {', '.join(f'{s} on pageserver {p.id}' for s, p in shards)}"
+    )
+    results = wait_for_last_record_lsn_shards(
+        shards, timeline, last_flush_lsn, auth_token=auth_token
+    )
 
     # Return the lowest LSN that has been ingested by all shards
-    return min(results)
+    waited = min(r.lsn for r in results.values())
+    assert waited >= last_flush_lsn
+    return waited
 
 
 def wait_for_commit_lsn(
@@ -5560,15 +5675,11 @@ def flush_ep_to_pageserver(
     # won't be able to reach commit_lsn (unless gaps are also ack'ed), so this
     # is broken in sharded case.
     shards = tenant_get_shards(env, tenant, pageserver_id)
-    for tenant_shard_id, pageserver in shards:
-        log.info(
-            f"flush_ep_to_pageserver: waiting for {commit_lsn} on shard {tenant_shard_id} on pageserver {pageserver.id})"
-        )
-        waited = wait_for_last_record_lsn(
-            pageserver.http_client(), tenant_shard_id, timeline, commit_lsn
-        )
-
-        assert waited >= commit_lsn
+    log.info(
+        f"flush_ep_to_pageserver: waiting for {commit_lsn} on shards {', '.join(f'{s} on pageserver {p.id}' for s, p in shards)}"
+    )
+    results = wait_for_last_record_lsn_shards(shards, timeline, commit_lsn)
+    assert all(r.lsn >= commit_lsn for r in results.values())
 
     return commit_lsn
 
@@ -5582,16 +5693,11 @@ def wait_for_wal_insert_lsn(
 ) -> Lsn:
     """Wait for pageserver to catch up the latest flush LSN, returns the last observed lsn."""
     last_flush_lsn = Lsn(endpoint.safe_psql("SELECT pg_current_wal_insert_lsn()")[0][0])
-    result = None
-    for tenant_shard_id, pageserver in tenant_get_shards(env, tenant, pageserver_id):
-        shard_r = wait_for_last_record_lsn(
-            pageserver.http_client(), tenant_shard_id, timeline, last_flush_lsn
-        )
-        if result is None:
-            result = shard_r
+    shards = tenant_get_shards(env, tenant, pageserver_id)
+    results = wait_for_last_record_lsn_shards(shards, timeline, last_flush_lsn)
 
-    assert result is not None
-    return result
+    # Return the LSN observed on the first shard
+    return results[shards[0][0]].lsn
 
 
 def fork_at_current_lsn(
@@ -5681,16 +5787,60 @@ def last_flush_lsn_upload(
     checkpoint pageserver, and wait for it to be uploaded (remote_consistent_lsn
     reaching flush LSN).
     """
-    last_flush_lsn = wait_for_last_flush_lsn(
-        env, endpoint, tenant_id, timeline_id, pageserver_id=pageserver_id, auth_token=auth_token
+    return wait_for_ingest_and_upload(
+        env,
+        endpoint,
+        tenant_id,
+        timeline_id,
+        pageserver_id=pageserver_id,
+        auth_token=auth_token,
+        wait_until_uploaded=wait_until_uploaded,
     )
+
+
+def wait_for_ingest_and_upload(
+    env: NeonEnv,
+    endpoint: Endpoint,
+    tenant_id: TenantId,
+    timeline_id: TimelineId,
+    pageserver_id: int | None = None,
+    auth_token: str | None = None,
+    checkpoint: bool = True,
+    wait_until_uploaded: bool = True,
+) -> Lsn:
+    """
+    Ingest/upload barrier for all shards of a timeline: takes the endpoint's flush
+    LSN once, waits for every shard to ingest up to it, and then (if `checkpoint`)
+    checkpoints every shard, optionally waiting for the uploads. The shards are
+    located once, and waited for and checkpointed concurrently, so the cost is
+    that of the slowest shard rather than the sum over all of them.
+
+    Returns the lowest LSN ingested by all shards.
+    """
     shards = tenant_get_shards(env, tenant_id, pageserver_id)
-    for tenant_shard_id, pageserver in shards:
-        ps_http = pageserver.http_client(auth_token=auth_token)
-        wait_for_last_record_lsn(ps_http, tenant_shard_id, timeline_id, last_flush_lsn)
-        ps_http.timeline_checkpoint(
+    last_flush_lsn = wait_for_last_flush_lsn(
+        env,
+        endpoint,
+        tenant_id,
+        timeline_id,
+        auth_token=auth_token,
+        shards=shards,
+    )
+    if not checkpoint:
+        return last_flush_lsn
+
+    def checkpoint_shard(shard: tuple[TenantShardId, NeonPageserver]):
+        tenant_shard_id, pageserver = shard
+        pageserver.http_client(auth_token=auth_token).timeline_checkpoint(
             tenant_shard_id, timeline_id, wait_until_uploaded=wait_until_uploaded
         )
+
+    if len(shards) == 1:
+        checkpoint_shard(shards[0])
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(shards), 32)) as executor:
+            for fut in [executor.submit(checkpoint_shard, shard) for shard in shards]:
+                fut.result()
     return last_flush_lsn
 
 
@@ -3,44 +3,150 @@
 from __future__ import annotations
 
 import argparse
+import functools
 import re
 import sys
 from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:
     from collections.abc import Iterable
+    from pathlib import Path
 
 
-def scan_pageserver_log_for_errors(
-    input: Iterable[str], allowed_errors: list[str]
-) -> list[tuple[int, str]]:
-    error_or_warn = re.compile(r"\s(ERROR|WARN)")
+# This module is also run as a standalone script (scripts/check_allowed_errors.sh),
+# so the log scanner below must only depend on the standard library. The
+# fixtures use it for all services, see `fixtures.utils.assert_no_errors`.
+
+ERROR_OR_WARN = re.compile(r"\s(ERROR|WARN)")
+
+# The same, for whole chunks of a log file: `\s` would also match the newline
+# ending the previous line.
+_ERROR_OR_WARN_IN_CHUNK = re.compile(rb"[ \t\r\f\v](?:ERROR|WARN)")
+
+# Is this a torn log line?  This happens when force-killing a process and restarting
+# Example: "2023-10-25T09:38:31.752314Z  WARN deletion executo2023-10-25T09:38:31.875947Z  INFO version: git-env:0f9452f76e8ccdfc88291bccb3f53e3016f40192"
+TORN_LOG_LINE = re.compile("\\d{4}-\\d{2}-\\d{2}T.+\\d{4}-\\d{2}-\\d{2}T.+INFO version.+")
+
+# Patterns that can't be merged into an alternation with other patterns without
+# changing their meaning: backreferences and inline flags.
+_NOT_COMBINABLE = re.compile(r"\\[1-9]|\(\?P=|\(\?[aiLmsux]+\)")
+
+SCAN_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+class AllowedErrors:
+    """
+    An allow-list of regexes, compiled once. A line is allowed if any of the
+    patterns matches at its start, like `re.match`.
+    """
+
+    def __init__(self, patterns: tuple[str, ...]):
+        self.patterns = patterns
+        combinable = []
+        self._separate: list[re.Pattern[str]] = []
+        for a in patterns:
+            try:
+                compiled = re.compile(a)
+            # We can switch `re.error` with `re.PatternError` after 3.13
+            # https://docs.python.org/3/library/re.html#re.PatternError
+            except re.error:
+                print(f"Invalid regex: '{a}'", file=sys.stderr)
+                raise
+            if _NOT_COMBINABLE.search(a):
+                self._separate.append(compiled)
+            else:
+                combinable.append(a)
+        self._combined: re.Pattern[str] | None = None
+        if combinable:
+            try:
+                self._combined = re.compile("|".join(f"(?:{a})" for a in combinable))
+            except re.error:
+                # e.g. the same group name used in two patterns
+                self._separate.extend(re.compile(a) for a in combinable)
+
+    def match(self, line: str) -> bool:
+        if self._combined is not None and self._combined.match(line):
+            return True
+        return any(r.match(line) for r in self._separate)
+
+
+@functools.lru_cache(maxsize=128)
+def compile_allowed_errors(allowed_errors: tuple[str, ...]) -> AllowedErrors:
+    return AllowedErrors(allowed_errors)
+
+
+def _is_error(line: str, allowed: AllowedErrors) -> bool:
+    return TORN_LOG_LINE.match(line) is None and not allowed.match(line)
+
+
+def scan_log_for_errors(input: Iterable[str], allowed_errors: list[str]) -> list[tuple[int, str]]:
+    """
+    Find the ERROR and WARN lines that aren't in the allow-list.
+    Returns (line number, line) tuples.
+    """
+    allowed = compile_allowed_errors(tuple(allowed_errors))
     errors = []
     for lineno, line in enumerate(input, start=1):
         if len(line) == 0:
             continue
 
-        if error_or_warn.search(line):
-            # Is this a torn log line?  This happens when force-killing a process and restarting
-            # Example: "2023-10-25T09:38:31.752314Z  WARN deletion executo2023-10-25T09:38:31.875947Z  INFO version: git-env:0f9452f76e8ccdfc88291bccb3f53e3016f40192"
-            if re.match("\\d{4}-\\d{2}-\\d{2}T.+\\d{4}-\\d{2}-\\d{2}T.+INFO version.+", line):
-                continue
-
-            # It's an ERROR or WARN. Is it in the allow-list?
-            for a in allowed_errors:
-                try:
-                    if re.match(a, line):
-                        break
-                # We can switch `re.error` with `re.PatternError` after 3.13
-                # https://docs.python.org/3/library/re.html#re.PatternError
-                except re.error:
-                    print(f"Invalid regex: '{a}'", file=sys.stderr)
-                    raise
+        if ERROR_OR_WARN.search(line) and _is_error(line, allowed):
+            errors.append((lineno, line))
+    return errors
+
+
+def scan_log_file_for_errors(path: Path, allowed_errors: list[str]) -> list[tuple[int, str]]:
+    """
+    Like `scan_log_for_errors()`, for a log file. Reads the file in large
+    binary chunks and only decodes the lines that mention ERROR or WARN.
+    """
+    allowed = compile_allowed_errors(tuple(allowed_errors))
+    errors = []
+    # Number of the first line in `buf`
+    lineno = 1
+    with path.open("rb") as f:
+        tail = b""
+        while True:
+            chunk = f.read(SCAN_CHUNK_SIZE)
+            buf = tail + chunk
+            if not buf:
+                break
+            if chunk:
+                # Only scan complete lines, the rest is carried over
+                end = buf.rfind(b"\n") + 1
+                if end == 0:
+                    tail = buf
+                    continue
+                buf, tail = buf[:end], buf[end:]
             else:
-                errors.append((lineno, line))
+                tail = b""
+
+            pos = 0
+            for m in _ERROR_OR_WARN_IN_CHUNK.finditer(buf):
+                if m.start() < pos:
+                    # Another match on a line we already looked at
+                    continue
+                line_start = buf.rfind(b"\n", 0, m.start()) + 1
+                line_end = buf.find(b"\n", m.end())
+                line_end = len(buf) if line_end == -1 else line_end + 1
+                lineno += buf.count(b"\n", pos, line_start)
+                line = buf[line_start:line_end].decode("utf-8", errors="replace")
+                if _is_error(line, allowed):
+                    errors.append((lineno, line))
+                lineno += 1
+                pos = line_end
+            lineno += buf.count(b"\n", pos)
+            if not chunk:
+                break
     return errors
 
 
+def scan_pageserver_log_for_errors(
+    input: Iterable[str], allowed_errors: list[str]
+) -> list[tuple[int, str]]:
+    return scan_log_for_errors(input, allowed_errors)
+
+
 DEFAULT_PAGESERVER_ALLOWED_ERRORS = (
     # All tests print these, when starting up or shutting down
     ".*wal receiver task finished with an error: walreceiver connection handling failure.*",
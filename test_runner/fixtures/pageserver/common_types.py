@@ -1,14 +1,20 @@
 from __future__ import annotations
 
+import bisect
 import re
+from array import array
 from dataclasses import dataclass
+from functools import cached_property, lru_cache
 from typing import TYPE_CHECKING
 
 from fixtures.common_types import KEY_MAX, KEY_MIN, Key, Lsn
 
 if TYPE_CHECKING:
+    from collections.abc import Iterable, Iterator
     from typing import Any
 
+LSN_MAX = 0xFFFFFFFF_FFFFFFFF
+
 
 @dataclass
 class IndexLayerMetadata:
@@ -16,21 +22,19 @@ class IndexLayerMetadata:
     generation: int
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class ImageLayerName:
     lsn: Lsn
     key_start: Key
     key_end: Key
 
-    def to_str(self):
-        ret = (
+    def to_str(self) -> str:
+        return (
             f"{self.key_start.as_int():036X}-{self.key_end.as_int():036X}__{self.lsn.as_int():016X}"
         )
-        assert self == parse_layer_file_name(ret)
-        return ret
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class DeltaLayerName:
     lsn_start: Lsn
     lsn_end: Lsn
@@ -41,9 +45,7 @@ class DeltaLayerName:
         return self.key_start == KEY_MIN and self.key_end == KEY_MAX
 
     def to_str(self) -> str:
-        ret = f"{self.key_start.as_int():036X}-{self.key_end.as_int():036X}__{self.lsn_start.as_int():016X}-{self.lsn_end.as_int():016X}"
-        assert self == parse_layer_file_name(ret)
-        return ret
+        return f"{self.key_start.as_int():036X}-{self.key_end.as_int():036X}__{self.lsn_start.as_int():016X}-{self.lsn_end.as_int():016X}"
 
 
 LayerName = ImageLayerName | DeltaLayerName
@@ -87,25 +89,153 @@ def parse_delta_layer(f_name: str) -> tuple[int, int, int, int]:
     )
 
 
+# Image and delta layer file names, the latter with a second LSN. The `name` group
+# is the name without the "-v1-..." suffix, i.e. what `to_str()` returns. Remote
+# layer file names additionally have a "-{generation:08x}" suffix.
+LAYER_FILE_NAME = re.compile(
+    "^(?P<name>(?P<key_start>[A-F0-9]{36})-(?P<key_end>[A-F0-9]{36})"
+    "__(?P<lsn_start>[A-F0-9]{16})(?:-(?P<lsn_end>[A-F0-9]{16}))?)(?:-v1-[a-f0-9]{8})?$"
+)
+REMOTE_LAYER_FILE_NAME = re.compile(
+    "^(?P<name>[A-F0-9]{36}-[A-F0-9]{36}__[A-F0-9]{16}(?:-[A-F0-9]{16})?)"
+    "(?:-v1-[a-f0-9]{8})?(?:-(?P<generation>[a-f0-9]{8}))?$"
+)
+
+# Layer names are immutable, so parsed ones can be shared
+LAYER_NAME_CACHE_SIZE = 1 << 16
+
+
+@lru_cache(maxsize=LAYER_NAME_CACHE_SIZE)
 def parse_layer_file_name(file_name: str) -> LayerName:
-    try:
-        key_start, key_end, lsn = parse_image_layer(file_name)
-        return ImageLayerName(lsn=Lsn(lsn), key_start=Key(key_start), key_end=Key(key_end))
-    except InvalidFileName:
-        pass
-
-    try:
-        key_start, key_end, lsn_start, lsn_end = parse_delta_layer(file_name)
-        return DeltaLayerName(
-            lsn_start=Lsn(lsn_start),
-            lsn_end=Lsn(lsn_end),
-            key_start=Key(key_start),
-            key_end=Key(key_end),
-        )
-    except InvalidFileName:
-        pass
+    match = LAYER_FILE_NAME.match(file_name)
+    if match is None:
+        raise InvalidFileName(f"neither image nor delta layer: {file_name}")
+
+    key_start = Key(int(match.group("key_start"), 16))
+    key_end = Key(int(match.group("key_end"), 16))
+    lsn_start = Lsn(int(match.group("lsn_start"), 16))
+    lsn_end = match.group("lsn_end")
+    if lsn_end is None:
+        return ImageLayerName(lsn=lsn_start, key_start=key_start, key_end=key_end)
+    return DeltaLayerName(
+        lsn_start=lsn_start, lsn_end=Lsn(int(lsn_end, 16)), key_start=key_start, key_end=key_end
+    )
+
+
+def is_layer_file_name(file_name: str) -> bool:
+    return LAYER_FILE_NAME.match(file_name) is not None
+
 
-    raise InvalidFileName(f"neither image nor delta layer: {file_name}")
+def local_layer_file_name(remote_name: str) -> str:
+    """
+    The local file name of a layer in remote storage, i.e. without the generation suffix,
+    in the `to_str()` form.
+    """
+    match = REMOTE_LAYER_FILE_NAME.match(remote_name)
+    if match is None:
+        raise InvalidFileName(f"not a remote layer file name: {remote_name}")
+    return match.group("name")
+
+
+class LayerCollection:
+    """
+    A set of layers in columnar form, for queries over many layers, e.g. in layer map
+    assertions. The LSN ranges are kept in arrays sorted by start LSN, so that queries
+    bounded by an LSN only look at a prefix of the layers. An image layer at LSN X
+    covers the LSN range X..X+1, like in the pageserver.
+    """
+
+    def __init__(self, layers: Iterable[LayerName | str]):
+        parsed = [parse_layer_file_name(x) if isinstance(x, str) else x for x in layers]
+        rows: list[tuple[int, int, LayerName]] = []
+        for layer in parsed:
+            if isinstance(layer, ImageLayerName):
+                lsn_start = layer.lsn.as_int()
+                rows.append((lsn_start, lsn_start + 1, layer))
+            else:
+                rows.append((layer.lsn_start.as_int(), layer.lsn_end.as_int(), layer))
+        rows.sort(key=lambda r: r[0])
+
+        self.layers: list[LayerName] = [r[2] for r in rows]
+        # Keys are 144 bits wide, too wide for an array
+        self.key_start: list[int] = [r[2].key_start.as_int() for r in rows]
+        self.key_end: list[int] = [r[2].key_end.as_int() for r in rows]
+        # lsn_end of an image at the maximum LSN doesn't fit 64 bits; such an image
+        # is never above any query's LSN anyway.
+        self.lsn_start = array("Q", (r[0] for r in rows))
+        self.lsn_end = array("Q", (min(r[1], LSN_MAX) for r in rows))
+        self.is_image = array("B", (isinstance(r[2], ImageLayerName) for r in rows))
+
+    def __len__(self) -> int:
+        return len(self.layers)
+
+    def __iter__(self) -> Iterator[LayerName]:
+        return iter(self.layers)
+
+    def _below(self, lsn: int) -> range:
+        """Indexes of the layers starting below `lsn`"""
+        return range(bisect.bisect_left(self.lsn_start, lsn))
+
+    def images(self) -> list[ImageLayerName]:
+        return [x for x in self.layers if isinstance(x, ImageLayerName)]
+
+    def deltas(self) -> list[DeltaLayerName]:
+        return [x for x in self.layers if isinstance(x, DeltaLayerName)]
+
+    def l0(self) -> list[DeltaLayerName]:
+        """Delta layers covering the whole key space, ordered by start LSN"""
+        key_min, key_max = KEY_MIN.as_int(), KEY_MAX.as_int()
+        return [
+            layer
+            for layer, key_start, key_end in zip(
+                self.layers, self.key_start, self.key_end, strict=True
+            )
+            if key_start == key_min and key_end == key_max and isinstance(layer, DeltaLayerName)
+        ]
+
+    def overlapping(
+        self, key_start: Key, key_end: Key, lsn_start: Lsn, lsn_end: Lsn
+    ) -> list[LayerName]:
+        """Layers overlapping the key range key_start..key_end and LSN range lsn_start..lsn_end"""
+        ks, ke = key_start.as_int(), key_end.as_int()
+        ls = lsn_start.as_int()
+        return [
+            self.layers[i]
+            for i in self._below(lsn_end.as_int())
+            if self.lsn_end[i] > ls and self.key_start[i] < ke and self.key_end[i] > ks
+        ]
+
+    def at_lsn(self, lsn: Lsn) -> list[LayerName]:
+        """Layers whose LSN range contains `lsn`"""
+        n = lsn.as_int()
+        return [self.layers[i] for i in self._below(n + 1) if self.lsn_end[i] > n]
+
+    def covered_key_ranges(self, lsn: Lsn, images_only: bool = False) -> list[tuple[Key, Key]]:
+        """
+        The key ranges covered by the layers whose LSN range contains `lsn`, merged and
+        sorted. E.g. with `images_only`, whether image layers were created at `lsn` for
+        the whole key space.
+        """
+        n = lsn.as_int()
+        ranges = sorted(
+            (self.key_start[i], self.key_end[i])
+            for i in self._below(n + 1)
+            if self.lsn_end[i] > n and (self.is_image[i] or not images_only)
+        )
+        merged: list[list[int]] = []
+        for start, end in ranges:
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        return [(Key(start), Key(end)) for start, end in merged]
+
+    def covers(self, key_start: Key, key_end: Key, lsn: Lsn, images_only: bool = False) -> bool:
+        """Whether the key range key_start..key_end is fully covered at `lsn`"""
+        return any(
+            start.as_int() <= key_start.as_int() and key_end.as_int() <= end.as_int()
+            for start, end in self.covered_key_ranges(lsn, images_only)
+        )
 
 
 def is_future_layer(layer_file_name: LayerName, disk_consistent_lsn: Lsn):
@@ -126,15 +256,30 @@ def is_future_layer(layer_file_name: LayerName, disk_consistent_lsn: Lsn):
 
 @dataclass
 class IndexPartDump:
-    layer_metadata: dict[LayerName, IndexLayerMetadata]
+    # The "layer_metadata" object of index_part.json, by layer file name
+    raw_layer_metadata: dict[str, Any]
     disk_consistent_lsn: Lsn
 
+    @property
+    def layer_file_names(self) -> list[str]:
+        """The layer file names, without parsing them"""
+        return list(self.raw_layer_metadata)
+
+    @cached_property
+    def layer_metadata(self) -> dict[LayerName, IndexLayerMetadata]:
+        # Parsed on first use: many callers only need disk_consistent_lsn
+        return {
+            parse_layer_file_name(n): IndexLayerMetadata(v["file_size"], v["generation"])
+            for n, v in self.raw_layer_metadata.items()
+        }
+
+    @cached_property
+    def layers(self) -> LayerCollection:
+        return LayerCollection(self.raw_layer_metadata)
+
     @classmethod
     def from_json(cls, d: dict[str, Any]) -> IndexPartDump:
         return IndexPartDump(
-            layer_metadata={
-                parse_layer_file_name(n): IndexLayerMetadata(v["file_size"], v["generation"])
-                for n, v in d["layer_metadata"].items()
-            },
+            raw_layer_metadata=d["layer_metadata"],
             disk_consistent_lsn=Lsn(d["disk_consistent_lsn"]),
         )
@@ -20,12 +20,15 @@ from fixtures.common_types import (
     TimelineArchivalState,
     TimelineId,
 )
+from fixtures.http_client_cache import HTTP_POOL_MAXSIZE
 from fixtures.log_helper import log
 from fixtures.metrics import Metrics, MetricsGetter, parse_metrics
+from fixtures.pageserver.common_types import LayerCollection
 from fixtures.pg_version import PgVersion
 from fixtures.utils import EnhancedJSONEncoder, Fn
 
 if TYPE_CHECKING:
+    from collections.abc import Sequence
     from datetime import datetime
 
 
@@ -192,6 +195,9 @@ class LayerMapInfo:
     def historic_by_name(self) -> set[str]:
         return set(x.layer_file_name for x in self.historic_layers)
 
+    def historic_layer_collection(self) -> LayerCollection:
+        return LayerCollection(x.layer_file_name for x in self.historic_layers)
+
 
 @dataclass
 class ScanDisposableKeysResponse:
@@ -272,7 +278,7 @@ class PageserverHttpClient(requests.Session, MetricsGetter):
                 remove_headers_on_redirect=[],
             )
 
-        self.mount("http://", HTTPAdapter(max_retries=retries))
+        self.mount("http://", HTTPAdapter(max_retries=retries, pool_maxsize=HTTP_POOL_MAXSIZE))
 
         if auth_token is not None:
             self.headers["Authorization"] = f"Bearer {auth_token}"
@@ -1004,9 +1010,9 @@ class PageserverHttpClient(requests.Session, MetricsGetter):
         self.verbose_error(res)
         return res.text
 
-    def get_metrics(self) -> Metrics:
+    def get_metrics(self, prefixes: Sequence[str] | None = None) -> Metrics:
         res = self.get_metrics_str()
-        return parse_metrics(res)
+        return parse_metrics(res, prefixes=prefixes)
 
     def get_timeline_metric(
         self, tenant_id: TenantId, timeline_id: TimelineId, metric_name: str
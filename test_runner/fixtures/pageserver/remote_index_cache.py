@@ -0,0 +1,142 @@
+"""
+Caching of the index_part.json and heatmap objects that tests read from remote
+storage, often in `wait_until` loops over the same timelines.
+
+Objects are cached by their location (a path or an S3 key) together with a
+version: (inode, mtime, size) for local files, the ETag for S3 objects. A
+lookup with a version that differs from the cached one replaces the entry, so
+nothing needs to be invalidated explicitly.
+
+The cached JSON objects and `IndexPartDump`s are shared between callers and
+must not be modified.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+from fixtures.pageserver.common_types import IndexPartDump
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Hashable
+    from pathlib import Path
+    from typing import Any
+
+
+# Files and directories modified more recently than this are not cached: another
+# modification within the same timestamp tick would not change their mtime.
+RACY_MTIME_WINDOW = 1.0
+
+# Number of objects kept per cache
+INDEX_CACHE_SIZE = 4096
+
+
+@dataclass
+class CacheEntry:
+    version: Hashable
+    content: Any
+    index_part: IndexPartDump | None = None
+
+
+def local_file_version(path: Path) -> Hashable | None:
+    """The version of a local file, or None if it was modified too recently to be cached"""
+    st = os.stat(path)
+    if time.time() - st.st_mtime < RACY_MTIME_WINDOW:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+class RemoteIndexCache:
+    """
+    An LRU cache of parsed JSON objects (and the `IndexPartDump`s made from them),
+    plus the latest index_part generation of local timeline directories.
+    Thread safe.
+    """
+
+    def __init__(self, max_entries: int = INDEX_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, CacheEntry] = OrderedDict()
+        # timeline directory -> (directory mtime_ns, latest generation)
+        self._generations: dict[str, tuple[int, int | None]] = {}
+
+    def lookup(self, location: str, version: Hashable | None) -> CacheEntry | None:
+        if version is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(location)
+            if entry is None or entry.version != version:
+                return None
+            self._entries.move_to_end(location)
+            self.hits += 1
+            return entry
+
+    def cached_version(self, location: str) -> Hashable | None:
+        """The version of `location` in the cache, e.g. for a conditional GET"""
+        with self._lock:
+            entry = self._entries.get(location)
+            return entry.version if entry is not None else None
+
+    def store(self, location: str, version: Hashable | None, content: Any) -> CacheEntry:
+        entry = CacheEntry(version, content)
+        with self._lock:
+            self.misses += 1
+            if version is not None:
+                self._entries[location] = entry
+                self._entries.move_to_end(location)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return entry
+
+    def get_json(self, location: str, version: Hashable | None, load: Callable[[], bytes]) -> Any:
+        """
+        The parsed JSON at `location`, from the cache if it has `version`, otherwise
+        from `load()`. A `version` of None bypasses the cache.
+        """
+        entry = self.lookup(location, version)
+        if entry is None:
+            entry = self.store(location, version, json.loads(load()))
+        return entry.content
+
+    def index_part(
+        self, location: str, version: Hashable | None, load: Callable[[], bytes]
+    ) -> IndexPartDump:
+        """Like `get_json`, for index_part.json, returning the parsed `IndexPartDump`"""
+        entry = self.lookup(location, version)
+        if entry is None:
+            entry = self.store(location, version, json.loads(load()))
+        return self.index_part_of(entry)
+
+    @staticmethod
+    def index_part_of(entry: CacheEntry) -> IndexPartDump:
+        # Racing threads may both build it, which is harmless
+        if entry.index_part is None:
+            entry.index_part = IndexPartDump.from_json(entry.content)
+        return entry.index_part
+
+    def latest_generation(
+        self, timeline_dir: Path, compute: Callable[[], int | None]
+    ) -> int | None:
+        """
+        The latest index_part generation in a local timeline directory, recomputed
+        with `compute()` only when the directory changed.
+        """
+        st = os.stat(timeline_dir)
+        key = str(timeline_dir)
+        with self._lock:
+            cached = self._generations.get(key)
+        if cached is not None and cached[0] == st.st_mtime_ns:
+            return cached[1]
+        generation = compute()
+        if time.time() - st.st_mtime >= RACY_MTIME_WINDOW:
+            with self._lock:
+                self._generations[key] = (st.st_mtime_ns, generation)
+        return generation
@@ -4,15 +4,17 @@ import concurrent.futures
 import os
 import queue
 import shutil
+import struct
 import threading
+import time
+from dataclasses import dataclass
 from typing import TYPE_CHECKING
 
 from fixtures.common_types import TenantId, TimelineId
-from fixtures.pageserver.common_types import (
-    InvalidFileName,
-    parse_layer_file_name,
-)
+from fixtures.log_helper import log
+from fixtures.pageserver.common_types import local_layer_file_name
 from fixtures.remote_storage import LocalFsStorage
+from fixtures.snapshot_restore import clone_file
 
 if TYPE_CHECKING:
     from pathlib import Path
@@ -21,69 +23,125 @@ if TYPE_CHECKING:
     from fixtures.neon_fixtures import NeonEnv
 
 
-def duplicate_one_tenant(env: NeonEnv, template_tenant: TenantId, new_tenant: TenantId):
+# From pageserver/src/lib.rs
+IMAGE_FILE_MAGIC = 0x5A60
+DELTA_FILE_MAGIC = 0x5A61
+
+# The start of the summary block of image and delta layers: magic, format version,
+# tenant id and timeline id, serialized with `BeSer` (big endian, fixed-size ints).
+LAYER_SUMMARY_PREFIX = struct.Struct(">HH16s16s")
+LAYER_SUMMARY_TENANT_ID_OFFSET = 4
+
+# How many layer files to duplicate concurrently
+DUPLICATE_IO_CONCURRENCY = min(32, 2 * (os.cpu_count() or 1))
+
+
+def rewrite_layer_summary_tenant_id(path: Path, new_tenant: TenantId):
+    """
+    Patch the tenant id in the summary of an image or delta layer file in place.
+    The same as `pagectl layer rewrite-summary --new-tenant-id`, without spawning
+    a process for every layer.
+    """
+    with open(path, "r+b") as f:
+        prefix = f.read(LAYER_SUMMARY_PREFIX.size)
+        assert len(prefix) == LAYER_SUMMARY_PREFIX.size, f"{path} is too short for a layer file"
+        magic, _format_version, _tenant_id, _timeline_id = LAYER_SUMMARY_PREFIX.unpack(prefix)
+        assert magic in (IMAGE_FILE_MAGIC, DELTA_FILE_MAGIC), (
+            f"not an image or delta layer: {path} (magic {magic:#x})"
+        )
+        f.seek(LAYER_SUMMARY_TENANT_ID_OFFSET)
+        f.write(bytes.fromhex(str(new_tenant)))
+
+
+@dataclass
+class DuplicationStats:
+    layers: int = 0
+    layer_bytes: int = 0
+    # How many of the layers were reflinked, rather than copied
+    layers_reflinked: int = 0
+    other_files: int = 0
+    duration: float = 0.0
+
+    def __str__(self) -> str:
+        duration = max(self.duration, 1e-9)
+        return (
+            f"{self.layers} layers ({self.layers_reflinked} reflinked) and {self.other_files} other files "
+            f"in {self.duration:.3f}s: {self.layers / duration:.1f} layers/s, "
+            f"{self.layer_bytes / duration / 1e6:.1f} MB/s"
+        )
+
+
+def _duplicate_file(src: Path, dst: Path, new_tenant: TenantId) -> tuple[bool, bool, int]:
+    """Returns (is_layer, reflinked, size)"""
+    if "__" not in src.name:
+        # index_part etc need no patching
+        shutil.copy2(src, dst)
+        return False, False, 0
+
+    reflinked = clone_file(str(src), str(dst))
+    shutil.copystat(src, dst)
+    # With a reflink, this only unshares the first block of the file
+    rewrite_layer_summary_tenant_id(dst, new_tenant)
+    return True, reflinked, dst.stat().st_size
+
+
+def duplicate_tenants(
+    env: NeonEnv, template_tenant: TenantId, new_tenants: list[TenantId]
+) -> DuplicationStats:
+    """
+    Duplicate the remote storage contents of `template_tenant` as each of
+    `new_tenants`. The files of all tenants and timelines are duplicated by a
+    shared pool of `DUPLICATE_IO_CONCURRENCY` threads.
+    """
     remote_storage = env.pageserver_remote_storage
     assert isinstance(remote_storage, LocalFsStorage)
 
     src_timelines_dir: Path = remote_storage.tenant_path(template_tenant) / "timelines"
     assert src_timelines_dir.is_dir(), f"{src_timelines_dir} is not a directory"
 
-    assert isinstance(remote_storage, LocalFsStorage)
-    dst_timelines_dir: Path = remote_storage.tenant_path(new_tenant) / "timelines"
-    dst_timelines_dir.parent.mkdir(parents=False, exist_ok=False)
-    dst_timelines_dir.mkdir(parents=False, exist_ok=False)
-
+    src_files: list[tuple[str, Path]] = []
     for tl in src_timelines_dir.iterdir():
-        src_tl_dir = src_timelines_dir / tl.name
-        assert src_tl_dir.is_dir(), f"{src_tl_dir} is not a directory"
-        dst_tl_dir = dst_timelines_dir / tl.name
-        dst_tl_dir.mkdir(parents=False, exist_ok=False)
-        for file in tl.iterdir():
-            shutil.copy2(file, dst_tl_dir)
-            if "__" in file.name:
-                env.pagectl.raw_cli(
-                    [
-                        "layer",
-                        "rewrite-summary",
-                        str(dst_tl_dir / file.name),
-                        "--new-tenant-id",
-                        str(new_tenant),
-                    ]
-                )
+        assert tl.is_dir(), f"{tl} is not a directory"
+        src_files.extend((tl.name, file) for file in tl.iterdir())
+
+    work: list[tuple[Path, Path, TenantId]] = []
+    for new_tenant in new_tenants:
+        dst_timelines_dir: Path = remote_storage.tenant_path(new_tenant) / "timelines"
+        dst_timelines_dir.parent.mkdir(parents=False, exist_ok=False)
+        dst_timelines_dir.mkdir(parents=False, exist_ok=False)
+        for tl in src_timelines_dir.iterdir():
+            (dst_timelines_dir / tl.name).mkdir(parents=False, exist_ok=False)
+        work.extend(
+            (file, dst_timelines_dir / tl_name / file.name, new_tenant)
+            for tl_name, file in src_files
+        )
+
+    stats = DuplicationStats()
+    started_at = time.monotonic()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=DUPLICATE_IO_CONCURRENCY) as executor:
+        for is_layer, reflinked, size in executor.map(lambda args: _duplicate_file(*args), work):
+            if is_layer:
+                stats.layers += 1
+                stats.layers_reflinked += reflinked
+                stats.layer_bytes += size
             else:
-                # index_part etc need no patching
-                pass
-    return None
+                stats.other_files += 1
+    stats.duration = time.monotonic() - started_at
 
+    log.info(f"duplicated tenant {template_tenant} {len(new_tenants)} times: {stats}")
+    return stats
 
-def duplicate_tenant(env: NeonEnv, template_tenant: TenantId, ncopies: int) -> list[TenantId]:
-    assert isinstance(env.pageserver_remote_storage, LocalFsStorage)
 
-    def work(tenant_id):
-        duplicate_one_tenant(env, template_tenant, tenant_id)
+def duplicate_one_tenant(env: NeonEnv, template_tenant: TenantId, new_tenant: TenantId):
+    duplicate_tenants(env, template_tenant, [new_tenant])
 
+
+def duplicate_tenant(env: NeonEnv, template_tenant: TenantId, ncopies: int) -> list[TenantId]:
     new_tenants: list[TenantId] = [TenantId.generate() for _ in range(0, ncopies)]
-    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
-        executor.map(work, new_tenants)
+    duplicate_tenants(env, template_tenant, new_tenants)
     return new_tenants
 
 
-def local_layer_name_from_remote_name(remote_name: str) -> str:
-    try:
-        return parse_layer_file_name(remote_name).to_str()
-    except InvalidFileName as e:
-        comps = remote_name.rsplit("-", 1)
-        if len(comps) == 1:
-            raise InvalidFileName("no generation suffix found") from e
-        else:
-            assert len(comps) == 2
-            layer_file_name, _generation = comps
-            try:
-                return parse_layer_file_name(layer_file_name).to_str()
-            except InvalidFileName:
-                raise
-
-
 def copy_all_remote_layer_files_to_local_tenant_dir(
     env: NeonEnv, tenant_timelines: list[tuple[TenantId, TimelineId]]
 ):
@@ -96,7 +154,7 @@ def copy_all_remote_layer_files_to_local_tenant_dir(
         local_timeline_path.mkdir(parents=True, exist_ok=True)
         downloads = {}
         for remote_layer in remote_timeline_path.glob("*__*"):
-            local_name = local_layer_name_from_remote_name(remote_layer.name)
+            local_name = local_layer_file_name(remote_layer.name)
             assert local_name not in downloads, "remote storage must have had split brain"
             downloads[local_name] = remote_layer
         for local_name, remote_path in downloads.items():
@@ -108,8 +166,8 @@ def copy_all_remote_layer_files_to_local_tenant_dir(
             if item is None:
                 return
             remote_path, local_path = item
-            # not copy2, so it looks like a recent download, in case that's relevant to e.g. eviction
-            shutil.copy(remote_path, local_path, follow_symlinks=False)
+            # no copystat, so it looks like a recent download, in case that's relevant to e.g. eviction
+            clone_file(str(remote_path), str(local_path))
 
     workers = []
     n_threads = os.cpu_count() or 1
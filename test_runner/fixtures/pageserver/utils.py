@@ -1,15 +1,18 @@
 from __future__ import annotations
 
+import concurrent.futures
 import time
+from dataclasses import dataclass
 from typing import TYPE_CHECKING
 
 from fixtures.common_types import Lsn, TenantId, TenantShardId, TimelineId
 from fixtures.log_helper import log
 from fixtures.pageserver.http import PageserverApiException, PageserverHttpClient
-from fixtures.remote_storage import RemoteStorage, S3Storage
+from fixtures.remote_storage import RemoteStorage, S3ListingSnapshot, S3Storage
 from fixtures.utils import wait_until
 
 if TYPE_CHECKING:
+    from collections.abc import Iterable
     from typing import Any
 
     from mypy_boto3_s3.type_defs import (
@@ -19,6 +22,8 @@ if TYPE_CHECKING:
         ObjectTypeDef,
     )
 
+    from fixtures.neon_fixtures import NeonPageserver
+
 
 def assert_tenant_state(
     pageserver_http: PageserverHttpClient,
@@ -190,6 +195,73 @@ def last_record_lsn(
     return Lsn(lsn_str)
 
 
+# Adaptive polling for LSN waits: start polling quickly, and back off towards
+# the time we expect the pageserver to need to close the remaining gap.
+LSN_WAIT_MIN_INTERVAL = 0.005
+LSN_WAIT_MAX_INTERVAL = 0.5
+LSN_WAIT_TIMEOUT = 200.0
+
+
+@dataclass
+class LsnCatchUp:
+    """Result of waiting for one shard to reach an LSN"""
+
+    tenant_shard_id: TenantId | TenantShardId
+    # The last observed last_record_lsn, >= the LSN waited for
+    lsn: Lsn
+    # Seconds from the start of the wait until the LSN was observed
+    elapsed: float
+    polls: int
+
+
+def _next_lsn_poll_interval(
+    interval: float, lsn: Lsn, prev_lsn: Lsn, target: Lsn, dt: float
+) -> float:
+    """
+    Grow the poll interval geometrically, but not beyond the time it would take
+    to close the remaining gap at the ingest rate observed since the last poll.
+    """
+    interval = interval * 2
+    progress = lsn - prev_lsn
+    if progress > 0 and dt > 0:
+        eta = (target - lsn) * dt / progress
+        interval = min(interval, eta)
+    return min(max(interval, LSN_WAIT_MIN_INTERVAL), LSN_WAIT_MAX_INTERVAL)
+
+
+def _wait_for_last_record_lsn_adaptive(
+    pageserver_http: PageserverHttpClient,
+    tenant: TenantId | TenantShardId,
+    timeline: TimelineId,
+    lsn: Lsn,
+    timeout: float = LSN_WAIT_TIMEOUT,
+) -> LsnCatchUp:
+    started_at = time.monotonic()
+    next_status = started_at
+    interval = LSN_WAIT_MIN_INTERVAL
+    prev_lsn, prev_at = None, started_at
+    polls = 0
+    while True:
+        current_lsn = last_record_lsn(pageserver_http, tenant, timeline)
+        polls += 1
+        now = time.monotonic()
+        if current_lsn >= lsn:
+            return LsnCatchUp(tenant, current_lsn, now - started_at, polls)
+        if now - started_at > timeout:
+            raise Exception(
+                f"timed out while waiting for last_record_lsn to reach {lsn}, was {current_lsn}"
+            )
+        if now >= next_status:
+            log.info(
+                f"{tenant}/{timeline} waiting for last_record_lsn to reach {lsn}, now {current_lsn}, poll {polls}"
+            )
+            next_status = now + 1.0
+        if prev_lsn is not None:
+            interval = _next_lsn_poll_interval(interval, current_lsn, prev_lsn, lsn, now - prev_at)
+        prev_lsn, prev_at = current_lsn, now
+        time.sleep(interval)
+
+
 def wait_for_last_record_lsn(
     pageserver_http: PageserverHttpClient,
     tenant: TenantId | TenantShardId,
@@ -198,19 +270,50 @@ def wait_for_last_record_lsn(
 ) -> Lsn:
     """waits for pageserver to catch up to a certain lsn, returns the last observed lsn."""
 
-    current_lsn = Lsn(0)
-    for i in range(2000):
-        current_lsn = last_record_lsn(pageserver_http, tenant, timeline)
-        if current_lsn >= lsn:
-            return current_lsn
-        if i % 10 == 0:
-            log.info(
-                f"{tenant}/{timeline} waiting for last_record_lsn to reach {lsn}, now {current_lsn}, iteration {i + 1}"
+    return _wait_for_last_record_lsn_adaptive(pageserver_http, tenant, timeline, lsn).lsn
+
+
+def wait_for_last_record_lsn_shards(
+    shards: Iterable[tuple[TenantShardId, NeonPageserver]],
+    timeline: TimelineId,
+    lsn: Lsn,
+    auth_token: str | None = None,
+    timeout: float = LSN_WAIT_TIMEOUT,
+) -> dict[TenantShardId, LsnCatchUp]:
+    """
+    Like wait_for_last_record_lsn, but waits for all the given shards (as returned
+    by `tenant_get_shards`) concurrently, so that the total wait is that of the
+    slowest shard rather than the sum of all of them.
+
+    Returns the per-shard results, including how long each shard took to catch up.
+    """
+    shards = list(shards)
+    if len(shards) == 1:
+        # Don't bother with a thread pool for the common unsharded case
+        tenant_shard_id, pageserver = shards[0]
+        return {
+            tenant_shard_id: _wait_for_last_record_lsn_adaptive(
+                pageserver.http_client(auth_token=auth_token),
+                tenant_shard_id,
+                timeline,
+                lsn,
+                timeout,
             )
-        time.sleep(0.1)
-    raise Exception(
-        f"timed out while waiting for last_record_lsn to reach {lsn}, was {current_lsn}"
-    )
+        }
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(shards), 32)) as executor:
+        futs = {
+            tenant_shard_id: executor.submit(
+                _wait_for_last_record_lsn_adaptive,
+                pageserver.http_client(auth_token=auth_token),
+                tenant_shard_id,
+                timeline,
+                lsn,
+                timeout,
+            )
+            for tenant_shard_id, pageserver in shards
+        }
+        return {tenant_shard_id: fut.result() for tenant_shard_id, fut in futs.items()}
 
 
 def wait_for_upload_queue_empty(
@@ -218,7 +321,9 @@ def wait_for_upload_queue_empty(
 ):
     wait_period_secs = 0.2
     while True:
-        all_metrics = pageserver_http.get_metrics()
+        all_metrics = pageserver_http.get_metrics(
+            prefixes=["pageserver_remote_timeline_client_calls_"]
+        )
         started = all_metrics.query_all(
             "pageserver_remote_timeline_client_calls_started_total",
             {
@@ -289,7 +394,7 @@ def timeline_delete_wait_completed(
 
 # remote_storage must not be None, but that's easier for callers to make mypy happy
 def assert_prefix_empty(
-    remote_storage: RemoteStorage | None,
+    remote_storage: RemoteStorage | S3ListingSnapshot | None,
     prefix: str | None = None,
     allowed_postfix: str | None = None,
     delimiter: str = "/",
@@ -300,7 +405,10 @@ def assert_prefix_empty(
     objects: list[ObjectTypeDef] = response.get("Contents", [])
     common_prefixes = response.get("CommonPrefixes", [])
 
-    is_mock_s3 = isinstance(remote_storage, S3Storage) and not remote_storage.cleanup
+    storage = (
+        remote_storage.storage if isinstance(remote_storage, S3ListingSnapshot) else remote_storage
+    )
+    is_mock_s3 = isinstance(storage, S3Storage) and not storage.cleanup
 
     if is_mock_s3:
         if keys == 1 and len(objects) == 0 and len(common_prefixes) == 1:
@@ -333,7 +441,7 @@ def assert_prefix_empty(
 
 # remote_storage must not be None, but that's easier for callers to make mypy happy
 def assert_prefix_not_empty(
-    remote_storage: RemoteStorage | None,
+    remote_storage: RemoteStorage | S3ListingSnapshot | None,
     prefix: str | None = None,
     delimiter: str = "/",
 ):
@@ -343,15 +451,19 @@ def assert_prefix_not_empty(
 
 
 def list_prefix(
-    remote: RemoteStorage, prefix: str | None = None, delimiter: str = "/"
+    remote: RemoteStorage | S3ListingSnapshot, prefix: str | None = None, delimiter: str = "/"
 ) -> ListObjectsV2OutputTypeDef:
     """
     Note that this function takes into account prefix_in_bucket.
+
+    The listing is exhaustive: all pages are merged into the response. Pass an
+    `S3ListingSnapshot` to list from the snapshot instead of from S3.
     """
+    storage = remote.storage if isinstance(remote, S3ListingSnapshot) else remote
     # For local_fs we need to properly handle empty directories, which we currently dont, so for simplicity stick to s3 api.
-    assert isinstance(remote, S3Storage), "localfs is currently not supported"
+    assert isinstance(storage, S3Storage), "localfs is currently not supported"
 
-    prefix_in_bucket = remote.prefix_in_bucket or ""
+    prefix_in_bucket = storage.prefix_in_bucket or ""
     if not prefix:
         prefix = prefix_in_bucket
     else:
@@ -359,12 +471,8 @@ def list_prefix(
         # mock_s3 tests use special pageserver prefix for pageserver stuff
         prefix = "/".join((prefix_in_bucket, prefix))
 
-    # Note that this doesnt use pagination, so list is not guaranteed to be exhaustive.
-    response = remote.client.list_objects_v2(
-        Delimiter=delimiter,
-        Bucket=remote.bucket_name,
-        Prefix=prefix,
-    )
+    source = remote if isinstance(remote, S3ListingSnapshot) else storage
+    response: ListObjectsV2OutputTypeDef = source.list_objects(prefix, delimiter)
     return response
 
 
@@ -0,0 +1,257 @@
+"""
+Streaming comparison of a basebackup against a Postgres data directory.
+
+The basebackup tar is read straight from the pageserver's COPY OUT stream, and
+each member is compared chunk by chunk against the file of the same name in the
+data directory while the rest of the archive is still arriving. Nothing is
+extracted to disk, and differences are reported per 8 KiB page rather than as
+a diff of hex dumps of whole files.
+"""
+
+from __future__ import annotations
+
+import os
+import struct
+import tarfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
+
+from fixtures.common_types import Lsn
+from fixtures.log_helper import log
+from fixtures.utils import PropagatingThread
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+    from pathlib import Path
+    from typing import IO
+
+    from psycopg2.extensions import cursor
+
+
+BLCKSZ = 8192
+
+# Tar members are compared in chunks of this size, in a thread pool.
+COMPARE_CHUNK_SIZE = 128 * BLCKSZ
+
+# Upper bound on the amount of basebackup data waiting to be compared.
+MAX_INFLIGHT_CHUNKS = 64
+
+# Don't bother describing more than this many mismatching pages per file.
+MAX_REPORTED_BLOCKS = 16
+
+
+@dataclass
+class PageHeader:
+    """The PageHeaderData fields at the start of every Postgres page"""
+
+    lsn: Lsn
+    checksum: int
+    flags: int
+    lower: int
+    upper: int
+    special: int
+    pagesize_version: int
+    prune_xid: int
+
+    FORMAT = struct.Struct("<IIHHHHHHI")
+
+    @classmethod
+    def parse(cls, page: bytes) -> PageHeader | None:
+        if len(page) < cls.FORMAT.size:
+            return None
+        xlogid, xrecoff, *rest = cls.FORMAT.unpack_from(page)
+        return cls(Lsn((xlogid << 32) | xrecoff), *rest)
+
+
+@dataclass
+class BlockDiff:
+    blkno: int
+    # Offsets of the first and last differing byte within the page
+    first_offset: int
+    last_offset: int
+    expected: PageHeader | None
+    actual: PageHeader | None
+
+    def __str__(self) -> str:
+        return (
+            f"block {self.blkno}: bytes {self.first_offset}..{self.last_offset} differ\n"
+            f"  expected: {self.expected}\n"
+            f"  actual:   {self.actual}"
+        )
+
+
+@dataclass
+class FileDiff:
+    name: str
+    expected_size: int | None = None
+    actual_size: int | None = None
+    blocks: list[BlockDiff] = field(default_factory=list)
+    # Total number of differing blocks, including those not described in `blocks`
+    nblocks: int = 0
+
+    def __str__(self) -> str:
+        lines = [f"{self.name}:"]
+        if self.expected_size != self.actual_size:
+            lines.append(f"  size differs: expected {self.expected_size}, got {self.actual_size}")
+        if self.nblocks > 0:
+            lines.append(f"  {self.nblocks} block(s) differ")
+        lines.extend(str(b) for b in sorted(self.blocks, key=lambda b: b.blkno))
+        if self.nblocks > len(self.blocks):
+            lines.append(f"  ... and {self.nblocks - len(self.blocks)} more")
+        return "\n".join(lines)
+
+
+def diff_blocks(base_blkno: int, expected: bytes, actual: bytes) -> list[BlockDiff]:
+    """Compare two buffers page by page and describe the pages that differ"""
+    diffs = []
+    for off in range(0, max(len(expected), len(actual)), BLCKSZ):
+        e = expected[off : off + BLCKSZ]
+        a = actual[off : off + BLCKSZ]
+        if e == a:
+            continue
+        differing = [i for i in range(max(len(e), len(a))) if e[i : i + 1] != a[i : i + 1]]
+        diffs.append(
+            BlockDiff(
+                blkno=base_blkno + off // BLCKSZ,
+                first_offset=differing[0],
+                last_offset=differing[-1],
+                expected=PageHeader.parse(e),
+                actual=PageHeader.parse(a),
+            )
+        )
+    return diffs
+
+
+def tar_member_relpath(name: str) -> tuple[str, str]:
+    """Split a tar member name into (dir relative to the archive root, file name)"""
+    name = os.path.normpath(name)
+    rel_dir, filename = os.path.split(name)
+    return (rel_dir or "."), filename
+
+
+class StreamingDatadirComparator:
+    """
+    Compares the regular files of a tar stream against the files under
+    `expected_dir`. `want(rel_dir, filename)` selects which members to look at.
+
+    After `compare_tar()` returns, `files` holds the relative names of all the
+    wanted members, and `diffs` the files whose content differs.
+    """
+
+    def __init__(
+        self,
+        expected_dir: Path,
+        want: Callable[[str, str], bool],
+        max_workers: int = 8,
+    ):
+        self.expected_dir = expected_dir
+        self.want = want
+        self.max_workers = max_workers
+        self.files: list[str] = []
+        self.diffs: dict[str, FileDiff] = {}
+        self.bytes_compared = 0
+        self._lock = threading.Lock()
+        self._inflight = threading.BoundedSemaphore(MAX_INFLIGHT_CHUNKS)
+
+    def _file_diff(self, rel: str) -> FileDiff:
+        # Caller must hold self._lock
+        diff = self.diffs.get(rel)
+        if diff is None:
+            diff = self.diffs[rel] = FileDiff(rel)
+        return diff
+
+    def _compare_chunk(self, rel: str, offset: int, chunk: bytes):
+        try:
+            with (self.expected_dir / rel).open("rb") as f:
+                f.seek(offset)
+                expected = f.read(len(chunk))
+            if expected == chunk:
+                return
+            blocks = diff_blocks(offset // BLCKSZ, expected, chunk)
+            with self._lock:
+                diff = self._file_diff(rel)
+                diff.nblocks += len(blocks)
+                room = MAX_REPORTED_BLOCKS - len(diff.blocks)
+                diff.blocks.extend(blocks[: max(room, 0)])
+        finally:
+            self._inflight.release()
+
+    def compare_tar(self, stream: IO[bytes]):
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = []
+            with tarfile.open(fileobj=stream, mode="r|*") as tar:
+                for member in tar:
+                    if not member.isreg():
+                        continue
+                    rel_dir, filename = tar_member_relpath(member.name)
+                    if not self.want(rel_dir, filename):
+                        continue
+                    rel = os.path.join(rel_dir, filename)
+                    self.files.append(rel)
+
+                    expected_path = self.expected_dir / rel
+                    if not expected_path.exists():
+                        # The file sets are compared by the caller
+                        continue
+                    expected_size = expected_path.stat().st_size
+                    if expected_size != member.size:
+                        with self._lock:
+                            diff = self._file_diff(rel)
+                            diff.expected_size = expected_size
+                            diff.actual_size = member.size
+
+                    reader = tar.extractfile(member)
+                    assert reader is not None
+                    offset = 0
+                    while chunk := reader.read(COMPARE_CHUNK_SIZE):
+                        self._inflight.acquire()
+                        futures.append(executor.submit(self._compare_chunk, rel, offset, chunk))
+                        offset += len(chunk)
+                    self.bytes_compared += offset
+
+            for fut in futures:
+                fut.result()
+
+        self.files.sort()
+
+    def compare_copy_out(self, cur: cursor, query: str):
+        """
+        Run `query`, which must respond with a COPY OUT stream of a tar archive
+        (e.g. the pageserver's `basebackup` command), and compare the archive.
+        """
+        read_fd, write_fd = os.pipe()
+        with os.fdopen(read_fd, "rb") as reader:
+
+            def produce():
+                with os.fdopen(write_fd, "wb") as writer:
+                    cur.copy_expert(query, writer)
+
+            producer = PropagatingThread(target=produce, daemon=True)
+            producer.start()
+            try:
+                self.compare_tar(reader)
+                # Drain whatever follows the end-of-archive marker
+                while reader.read(COMPARE_CHUNK_SIZE):
+                    pass
+            except BaseException:
+                # Closing the reader unblocks the producer, if it is still running.
+                # If the query failed, that is more interesting than the
+                # truncated archive it left us with.
+                reader.close()
+                producer_error = None
+                try:
+                    producer.join()
+                except BrokenPipeError:
+                    pass
+                except Exception as e:
+                    producer_error = e
+                if producer_error is not None:
+                    raise producer_error  # noqa: B904
+                raise
+            producer.join()
+
+        log.info(
+            f"compared {len(self.files)} files, {self.bytes_compared} bytes, {len(self.diffs)} differ"
+        )
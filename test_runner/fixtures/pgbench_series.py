@@ -0,0 +1,204 @@
+"""
+Time series of a pgbench run.
+
+`PgBenchRunResult` only has the summary pgbench prints at the end, which hides
+throughput collapses and latency spikes in the middle of a long run.
+`PgBenchSeriesCollector` follows a running pgbench instead:
+
+- `--progress` lines on stderr give TPS and mean latency per progress interval.
+  Pass `collector.feed_progress_line` as the `stderr_line_handler` of
+  `PgBin.run_capture`.
+- Per-transaction logs (`--log --log-prefix=...`, usually with `--sampling-rate`)
+  give latency percentiles per interval. The log files are tailed while
+  pgbench runs, and only a histogram per interval is kept.
+"""
+
+from __future__ import annotations
+
+import re
+import statistics
+import threading
+from array import array
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
+
+from fixtures.benchmark_fixture import Histogram
+from fixtures.log_helper import log
+
+if TYPE_CHECKING:
+    from pathlib import Path
+    from types import TracebackType
+
+
+# pgbench v15+ appends ", N failed"; with --rate, there's also a lag part
+PROGRESS_LINE = re.compile(
+    r"progress: (?P<time>[0-9.]+) s, (?P<tps>[0-9.]+) tps, "
+    r"lat (?P<latency>[0-9.]+|NaN) ms stddev (?P<stddev>[0-9.]+|NaN)"
+)
+
+# Timestamps larger than this are Unix timestamps (--progress-timestamp), not
+# seconds since the start of the run.
+_EPOCH_THRESHOLD = 1e9
+
+# How often to look for new lines in the per-transaction logs, in seconds.
+LOG_POLL_INTERVAL = 0.5
+
+
+@dataclass
+class PgBenchSeries:
+    """
+    Per-interval measurements of a pgbench run. Times are in seconds since the
+    start of the run, latencies in milliseconds.
+    """
+
+    # From --progress
+    progress_time: array[float] = field(default_factory=lambda: array("d"))
+    progress_tps: array[float] = field(default_factory=lambda: array("d"))
+    progress_latency: array[float] = field(default_factory=lambda: array("d"))
+
+    # From the per-transaction logs, one entry per `log_interval`
+    log_interval: float = 1.0
+    log_time: array[float] = field(default_factory=lambda: array("d"))
+    # Number of logged transactions, i.e. TPS times the --sampling-rate
+    log_transactions: array[float] = field(default_factory=lambda: array("d"))
+    log_latency_p50: array[float] = field(default_factory=lambda: array("d"))
+    log_latency_p99: array[float] = field(default_factory=lambda: array("d"))
+
+    @property
+    def tps_cv(self) -> float | None:
+        """Coefficient of variation of the progress TPS: stddev / mean"""
+        if len(self.progress_tps) < 2:
+            return None
+        mean = statistics.fmean(self.progress_tps)
+        if mean == 0:
+            return None
+        return statistics.pstdev(self.progress_tps, mean) / mean
+
+    @property
+    def worst_window_tps(self) -> float | None:
+        return min(self.progress_tps) if self.progress_tps else None
+
+    @property
+    def worst_window_latency_p99(self) -> float | None:
+        return max(self.log_latency_p99) if self.log_latency_p99 else None
+
+
+class PgBenchSeriesCollector:
+    """
+    Builds a `PgBenchSeries` from the output of a running pgbench. Use as a
+    context manager around the pgbench invocation:
+
+    with PgBenchSeriesCollector(start_time, log_dir, "pgbench_log") as collector:
+        pg_bin.run_capture(
+            ["pgbench", "-P1", "--progress-timestamp", "--log",
+             f"--log-prefix={log_dir / 'pgbench_log'}", "--sampling-rate=0.01", ...],
+            stderr_line_handler=collector.feed_progress_line,
+        )
+    series = collector.series
+    """
+
+    def __init__(
+        self,
+        start_time: float,
+        log_dir: Path | None = None,
+        log_prefix: str | None = None,
+        log_interval: float = 1.0,
+    ):
+        # Unix time at which pgbench was started, to make the timestamps relative
+        self.start_time = start_time
+        self.log_dir = log_dir
+        self.log_prefix = log_prefix
+        self.series = PgBenchSeries(log_interval=log_interval)
+        self._lock = threading.Lock()
+        # interval number -> latencies of the transactions that ended in it
+        self._intervals: dict[int, Histogram] = {}
+        # log file name -> offset up to which it has been read
+        self._log_offsets: dict[str, int] = {}
+        self._stop = threading.Event()
+        self._tailer: threading.Thread | None = None
+
+    def _relative(self, t: float) -> float:
+        return t - self.start_time if t > _EPOCH_THRESHOLD else t
+
+    def feed_progress_line(self, line: str):
+        m = PROGRESS_LINE.search(line)
+        if m is None:
+            return
+        latency = float(m.group("latency"))
+        with self._lock:
+            self.series.progress_time.append(self._relative(float(m.group("time"))))
+            self.series.progress_tps.append(float(m.group("tps")))
+            self.series.progress_latency.append(latency)
+
+    def feed_log_line(self, line: str):
+        """
+        A line of a per-transaction log:
+        client_id transaction_no time script_no time_epoch time_us [schedule_lag]
+        where `time` is the latency in microseconds, or e.g. "failed".
+        """
+        fields = line.split()
+        if len(fields) < 6 or not fields[2].isdigit():
+            return
+        latency_ms = int(fields[2]) / 1000
+        end = int(fields[4]) + int(fields[5]) / 1e6
+        interval = int(self._relative(end) // self.series.log_interval)
+        with self._lock:
+            hist = self._intervals.get(interval)
+            if hist is None:
+                hist = self._intervals[interval] = Histogram()
+        hist.record(latency_ms)
+
+    def _log_files(self) -> list[Path]:
+        if self.log_dir is None or self.log_prefix is None:
+            return []
+        return sorted(self.log_dir.glob(f"{self.log_prefix}.*"))
+
+    def poll_logs(self):
+        """Feed the lines that were appended to the per-transaction logs"""
+        for path in self._log_files():
+            offset = self._log_offsets.get(path.name, 0)
+            with path.open("rb") as f:
+                f.seek(offset)
+                data = f.read()
+            # pgbench writes through stdio buffers, leave incomplete lines for later
+            end = data.rfind(b"\n") + 1
+            for line in data[:end].decode("utf-8", errors="replace").splitlines():
+                self.feed_log_line(line)
+            self._log_offsets[path.name] = offset + end
+
+    def _tail_logs(self):
+        while not self._stop.wait(LOG_POLL_INTERVAL):
+            self.poll_logs()
+
+    def __enter__(self) -> PgBenchSeriesCollector:
+        if self.log_prefix is not None:
+            self._tailer = threading.Thread(target=self._tail_logs, daemon=True)
+            self._tailer.start()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        tb: TracebackType | None,
+    ):
+        if self._tailer is not None:
+            self._stop.set()
+            self._tailer.join()
+            self.poll_logs()
+        self._finish()
+
+    def _finish(self):
+        series = self.series
+        for interval in sorted(self._intervals):
+            hist = self._intervals[interval]
+            series.log_time.append(interval * series.log_interval)
+            series.log_transactions.append(hist.count)
+            series.log_latency_p50.append(hist.percentile(50))
+            series.log_latency_p99.append(hist.percentile(99))
+        self._intervals.clear()
+        log.info(
+            f"pgbench series: {len(series.progress_tps)} progress reports, "
+            f"{len(series.log_time)} log intervals, tps cv {series.tps_cv}, "
+            f"worst window tps {series.worst_window_tps}"
+        )
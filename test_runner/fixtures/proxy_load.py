@@ -0,0 +1,364 @@
+"""
+Load generation against the proxy's SQL-over-HTTP and websocket endpoints.
+
+`NeonProxy.http_query()` and friends open a new connection for every query,
+which is what a functional test wants, but it measures TLS handshakes rather
+than the proxy. `ProxyLoadGenerator` keeps its connections open instead:
+
+- HTTP/1.1: a keep-alive pool with one connection per concurrent request.
+- HTTP/2: requests multiplexed over a few connections.
+- websockets: one authenticated Postgres session per concurrent request,
+  running simple queries.
+
+Requests are issued either closed-loop (`concurrency` requests back to back)
+or open-loop at a fixed `rate`, in which case latency is measured from when
+a request was due, so that a stalled proxy doesn't hide its own latency.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import ssl
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from enum import StrEnum
+from typing import TYPE_CHECKING
+
+import httpx
+import websockets
+
+from fixtures.benchmark_fixture import HISTOGRAM_PERCENTILES, Histogram, MetricReport
+from fixtures.log_helper import log
+from fixtures.metrics import parse_metrics
+
+if TYPE_CHECKING:
+    from collections.abc import AsyncIterator, Awaitable, Callable
+    from typing import Any
+
+    from fixtures.benchmark_fixture import NeonBenchmarker
+    from fixtures.metrics import Metrics
+    from fixtures.neon_fixtures import NeonProxy
+
+
+# Latencies are recorded in microseconds
+LATENCY_SCALE = 1e6
+
+
+class ProxyProtocol(StrEnum):
+    HTTP1 = "http1"
+    HTTP2 = "http2"
+    WEBSOCKET = "ws"
+
+
+@dataclass
+class ProxyLoadResult:
+    protocol: ProxyProtocol
+    requests: int = 0
+    errors: int = 0
+    elapsed: float = 0.0
+    latency: Histogram = field(default_factory=Histogram)
+    # Time to set up the connections the load ran over
+    connect: Histogram = field(default_factory=Histogram)
+
+    @property
+    def throughput(self) -> float:
+        return self.requests / self.elapsed if self.elapsed > 0 else 0.0
+
+    def record(self, zenbenchmark: NeonBenchmarker, prefix: str):
+        zenbenchmark.record(f"{prefix}.requests", self.requests, "", MetricReport.HIGHER_IS_BETTER)
+        zenbenchmark.record(f"{prefix}.errors", self.errors, "", MetricReport.LOWER_IS_BETTER)
+        zenbenchmark.record(
+            f"{prefix}.throughput", self.throughput, "req/s", MetricReport.HIGHER_IS_BETTER
+        )
+        for name, hist in [("latency", self.latency), ("connect", self.connect)]:
+            if hist.count == 0:
+                continue
+            for q, suffix in HISTOGRAM_PERCENTILES:
+                zenbenchmark.record(
+                    f"{prefix}.{name}.{suffix}",
+                    hist.percentile(q),
+                    "us",
+                    MetricReport.LOWER_IS_BETTER,
+                )
+            zenbenchmark.record(
+                f"{prefix}.{name}.max", hist.max, "us", MetricReport.LOWER_IS_BETTER
+            )
+
+
+@dataclass
+class ProxyPoolStats:
+    """How connections to compute were obtained, from the proxy's metrics"""
+
+    # Compute connections served from the proxy's HTTP connection pool
+    pool_hits: int
+    compute_connects: int
+    opened_db_connections: int
+
+    @property
+    def pool_hit_rate(self) -> float | None:
+        if self.compute_connects == 0:
+            return None
+        return self.pool_hits / self.compute_connects
+
+    @classmethod
+    def from_metrics(cls, metrics: Metrics) -> ProxyPoolStats:
+        # Each connection is counted once per latency exclusion, only look at one
+        connects = metrics.query_all(
+            "proxy_compute_connection_latency_seconds_count", {"excluded": "client"}
+        )
+        return cls(
+            pool_hits=int(
+                sum(s.value for s in connects if s.labels.get("cold_start_info") == "http_pool_hit")
+            ),
+            compute_connects=int(sum(s.value for s in connects)),
+            opened_db_connections=int(
+                sum(s.value for s in metrics.query_all("proxy_opened_db_connections_total"))
+            ),
+        )
+
+    def record(self, zenbenchmark: NeonBenchmarker, prefix: str):
+        zenbenchmark.record(
+            f"{prefix}.compute_connects", self.compute_connects, "", MetricReport.LOWER_IS_BETTER
+        )
+        zenbenchmark.record(
+            f"{prefix}.opened_db_connections",
+            self.opened_db_connections,
+            "",
+            MetricReport.LOWER_IS_BETTER,
+        )
+        if self.pool_hit_rate is not None:
+            zenbenchmark.record(
+                f"{prefix}.pool_hit_rate", self.pool_hit_rate, "", MetricReport.HIGHER_IS_BETTER
+            )
+
+
+def _pg_message(tag: bytes, body: bytes) -> bytes:
+    return tag + (4 + len(body)).to_bytes(4, "big") + body
+
+
+class _PgWebsocketSession:
+    """A Postgres session over the proxy's websocket endpoint, for simple queries"""
+
+    def __init__(self, ws: Any):
+        self.ws = ws
+        self.buf = bytearray()
+
+    async def _message(self) -> tuple[bytes, bytes]:
+        while True:
+            if len(self.buf) >= 5:
+                length = int.from_bytes(self.buf[1:5], "big")
+                if len(self.buf) >= 1 + length:
+                    tag, body = bytes(self.buf[:1]), bytes(self.buf[5 : 1 + length])
+                    del self.buf[: 1 + length]
+                    return tag, body
+            data = await self.ws.recv()
+            assert isinstance(data, bytes), f"unexpected text frame: {data}"
+            self.buf += data
+
+    async def _until_ready(self) -> str | None:
+        """Read messages until ReadyForQuery, returns the error message if there was one"""
+        error = None
+        while True:
+            tag, body = await self._message()
+            if tag == b"E":
+                error = body.decode(errors="replace")
+            elif tag == b"Z":
+                return error
+
+    async def startup(self, user: str, password: str, dbname: str):
+        params = b"".join(
+            k.encode() + b"\0" + v.encode() + b"\0"
+            for k, v in {"user": user, "database": dbname, "client_encoding": "UTF8"}.items()
+        )
+        startup = b"\x00\x03\x00\x00" + params + b"\0"
+        await self.ws.send((4 + len(startup)).to_bytes(4, "big") + startup)
+        tag, body = await self._message()
+        assert tag == b"R" and body == b"\x00\x00\x00\x03", f"expected cleartext auth: {tag!r}"
+        await self.ws.send(_pg_message(b"p", password.encode() + b"\0"))
+        error = await self._until_ready()
+        assert error is None, f"authentication failed: {error}"
+
+    async def query(self, sql: str) -> bool:
+        await self.ws.send(_pg_message(b"Q", sql.encode() + b"\0"))
+        return await self._until_ready() is None
+
+    async def close(self):
+        await self.ws.send(_pg_message(b"X", b""))
+        await self.ws.close()
+
+
+class ProxyLoadGenerator:
+    """
+    Drives SQL-over-HTTP or websocket queries through a proxy, as a given Postgres
+    user (which needs a password, e.g. created with `create user ... password ...`).
+    """
+
+    def __init__(self, proxy: NeonProxy, user: str, password: str, dbname: str = "postgres"):
+        self.proxy = proxy
+        self.user = user
+        self.password = password
+        self.dbname = dbname
+        self.sql_url = f"https://{proxy.domain}:{proxy.external_http_port}/sql"
+        self.ws_url = f"wss://{proxy.domain}:{proxy.external_http_port}/sql"
+        self.ssl_context = ssl.create_default_context(
+            cafile=str(proxy.test_output_dir / "proxy.crt")
+        )
+        self.headers = {
+            "Content-Type": "application/sql",
+            "Neon-Connection-String": f"postgresql://{user}:{password}@{proxy.domain}:{proxy.proxy_port}/{dbname}",
+            "Neon-Pool-Opt-In": "true",
+        }
+
+    def metrics(self) -> Metrics:
+        return parse_metrics(
+            self.proxy.get_metrics(),
+            "proxy",
+            prefixes=["proxy_compute_connection_latency_seconds", "proxy_opened_db_connections"],
+        )
+
+    async def measure_connect_overhead(self, tcp: Histogram, tls: Histogram, samples: int = 20):
+        """
+        Open `samples` fresh connections to the SQL-over-HTTP port, and record the TCP
+        connect and TLS handshake times into `tcp` and `tls`, in microseconds.
+        """
+        for _ in range(samples):
+            started_at = time.perf_counter()
+            _, writer = await asyncio.open_connection(
+                self.proxy.domain, self.proxy.external_http_port
+            )
+            connected_at = time.perf_counter()
+            await writer.start_tls(self.ssl_context, server_hostname=self.proxy.domain)
+            tcp.record((connected_at - started_at) * LATENCY_SCALE)
+            tls.record((time.perf_counter() - connected_at) * LATENCY_SCALE)
+            writer.close()
+            await writer.wait_closed()
+
+    @asynccontextmanager
+    async def _http_sender(
+        self, http2: bool, concurrency: int, connections: int, query: str, params: list[Any]
+    ) -> AsyncIterator[Callable[[], Awaitable[bool]]]:
+        limits = httpx.Limits(
+            max_connections=connections if http2 else concurrency,
+            max_keepalive_connections=connections if http2 else concurrency,
+        )
+        body = {"query": query, "params": params}
+        async with httpx.AsyncClient(
+            http2=http2, http1=not http2, verify=self.ssl_context, limits=limits, timeout=60
+        ) as client:
+
+            async def send() -> bool:
+                response = await client.post(self.sql_url, json=body, headers=self.headers)
+                if http2:
+                    assert response.http_version == "HTTP/2"
+                if response.status_code != 200:
+                    log.warning(f"query failed with {response.status_code}: {response.text}")
+                    return False
+                return True
+
+            yield send
+
+    @asynccontextmanager
+    async def _ws_sender(
+        self, concurrency: int, query: str, connect: Histogram
+    ) -> AsyncIterator[Callable[[], Awaitable[bool]]]:
+        async def open_session() -> _PgWebsocketSession:
+            started_at = time.perf_counter()
+            ws = await websockets.connect(self.ws_url, ssl=self.ssl_context)
+            session = _PgWebsocketSession(ws)
+            await session.startup(self.user, self.password, self.dbname)
+            connect.record((time.perf_counter() - started_at) * LATENCY_SCALE)
+            return session
+
+        sessions = await asyncio.gather(*[open_session() for _ in range(concurrency)])
+        idle: asyncio.Queue[_PgWebsocketSession] = asyncio.Queue()
+        for s in sessions:
+            idle.put_nowait(s)
+
+        async def send() -> bool:
+            session = await idle.get()
+            try:
+                return await session.query(query)
+            finally:
+                idle.put_nowait(session)
+
+        try:
+            yield send
+        finally:
+            await asyncio.gather(*[s.close() for s in sessions], return_exceptions=True)
+
+    async def run(
+        self,
+        protocol: ProxyProtocol,
+        query: str,
+        duration: float,
+        concurrency: int = 16,
+        rate: float | None = None,
+        params: list[Any] | None = None,
+        http2_connections: int = 1,
+    ) -> ProxyLoadResult:
+        """
+        Run `query` for `duration` seconds with up to `concurrency` requests in flight.
+        Without a `rate`, each of the `concurrency` workers sends its next request as soon
+        as the previous one completes. With a `rate`, requests are started at that many
+        per second regardless of how fast they complete.
+        """
+        result = ProxyLoadResult(protocol)
+        if protocol == ProxyProtocol.WEBSOCKET:
+            sender = self._ws_sender(concurrency, query, result.connect)
+        else:
+            sender = self._http_sender(
+                protocol == ProxyProtocol.HTTP2,
+                concurrency,
+                http2_connections,
+                query,
+                params or [],
+            )
+
+        async with sender as send:
+
+            async def one(due: float):
+                try:
+                    ok = await send()
+                except Exception as e:
+                    log.warning(f"{protocol} request failed: {e}")
+                    ok = False
+                result.latency.record((time.perf_counter() - due) * LATENCY_SCALE)
+                result.requests += 1
+                result.errors += not ok
+
+            started_at = time.perf_counter()
+            deadline = started_at + duration
+            if rate is None:
+
+                async def worker():
+                    while time.perf_counter() < deadline:
+                        await one(time.perf_counter())
+
+                await asyncio.gather(*[worker() for _ in range(concurrency)])
+            else:
+                in_flight = asyncio.Semaphore(concurrency)
+
+                async def scheduled(due: float):
+                    async with in_flight:
+                        await one(due)
+
+                tasks = []
+                i = 0
+                while (due := started_at + i / rate) < deadline:
+                    delay = due - time.perf_counter()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    tasks.append(asyncio.create_task(scheduled(due)))
+                    i += 1
+                await asyncio.gather(*tasks)
+            result.elapsed = time.perf_counter() - started_at
+
+        log.info(
+            f"{protocol}: {result.requests} requests, {result.errors} errors in "
+            f"{result.elapsed:.1f}s, {result.throughput:.0f} req/s, "
+            f"p50 {result.latency.percentile(50):.0f}us, p99 {result.latency.percentile(99):.0f}us"
+            if result.requests > 0
+            else f"{protocol}: no requests completed"
+        )
+        return result
@@ -1,34 +1,49 @@
 from __future__ import annotations
 
+import bisect
 import enum
 import hashlib
 import json
 import os
 import re
-from dataclasses import dataclass
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from enum import StrEnum
 from typing import TYPE_CHECKING
 
 import boto3
 import toml
+from botocore.exceptions import ClientError
 from moto.server import ThreadedMotoServer
 from typing_extensions import override
 
 from fixtures.log_helper import log
-from fixtures.pageserver.common_types import IndexPartDump
+from fixtures.pageserver.remote_index_cache import RemoteIndexCache, local_file_version
 
 if TYPE_CHECKING:
+    from collections.abc import Iterable
+    from concurrent.futures import Future
     from pathlib import Path
     from typing import Any
 
     from mypy_boto3_s3 import S3Client
+    from mypy_boto3_s3.type_defs import ObjectTypeDef
 
     from fixtures.common_types import TenantId, TenantShardId, TimelineId
+    from fixtures.pageserver.common_types import IndexPartDump
+    from fixtures.pageserver.remote_index_cache import CacheEntry
 
 
 TIMELINE_INDEX_PART_FILE_NAME = "index_part.json"
 TENANT_HEATMAP_FILE_NAME = "heatmap-v1.json"
 
+# S3's limit on the number of keys in a DeleteObjects request
+S3_DELETE_BATCH_SIZE = 1000
+
+# How many requests the S3Storage helpers that fan out have in flight at once
+S3_REQUEST_CONCURRENCY = 8
+
 
 @enum.unique
 class RemoteStorageUser(StrEnum):
@@ -82,6 +97,9 @@ class MockS3Server:
 @dataclass
 class LocalFsStorage:
     root: Path
+    index_cache: RemoteIndexCache = field(
+        default_factory=RemoteIndexCache, repr=False, compare=False
+    )
 
     def tenant_path(self, tenant_id: TenantId | TenantShardId) -> Path:
         return self.root / "tenants" / str(tenant_id)
@@ -92,7 +110,16 @@ class LocalFsStorage:
     def timeline_latest_generation(
         self, tenant_id: TenantId | TenantShardId, timeline_id: TimelineId
     ) -> int | None:
-        timeline_files = os.listdir(self.timeline_path(tenant_id, timeline_id))
+        timeline_path = self.timeline_path(tenant_id, timeline_id)
+        return self.index_cache.latest_generation(
+            timeline_path,
+            lambda: self._scan_latest_generation(tenant_id, timeline_id, timeline_path),
+        )
+
+    def _scan_latest_generation(
+        self, tenant_id: TenantId | TenantShardId, timeline_id: TimelineId, timeline_path: Path
+    ) -> int | None:
+        timeline_files = os.listdir(timeline_path)
         index_parts = [f for f in timeline_files if f.startswith("index_part")]
 
         def parse_gen(filename: str) -> int | None:
@@ -133,15 +160,29 @@ class LocalFsStorage:
         return self.timeline_path(tenant_id, timeline_id) / filename
 
     def index_content(self, tenant_id: TenantId | TenantShardId, timeline_id: TimelineId) -> Any:
-        with self.index_path(tenant_id, timeline_id).open("r") as f:
-            return json.load(f)
+        """The parsed index_part.json. It may be shared with other callers: don't modify it."""
+        path = self.index_path(tenant_id, timeline_id)
+        return self.index_cache.get_json(str(path), local_file_version(path), path.read_bytes)
+
+    def index_part(
+        self, tenant_id: TenantId | TenantShardId, timeline_id: TimelineId
+    ) -> IndexPartDump:
+        path = self.index_path(tenant_id, timeline_id)
+        return self.index_cache.index_part(str(path), local_file_version(path), path.read_bytes)
+
+    def index_parts(
+        self, timelines: Iterable[tuple[TenantId | TenantShardId, TimelineId]]
+    ) -> dict[tuple[TenantId | TenantShardId, TimelineId], IndexPartDump]:
+        """`index_part` of many timelines"""
+        return {(t, tl): self.index_part(t, tl) for t, tl in timelines}
 
     def heatmap_path(self, tenant_id: TenantId) -> Path:
         return self.tenant_path(tenant_id) / TENANT_HEATMAP_FILE_NAME
 
     def heatmap_content(self, tenant_id: TenantId) -> Any:
-        with self.heatmap_path(tenant_id).open("r") as f:
-            return json.load(f)
+        """The parsed heatmap. It may be shared with other callers: don't modify it."""
+        path = self.heatmap_path(tenant_id)
+        return self.index_cache.get_json(str(path), local_file_version(path), path.read_bytes)
 
     def to_toml_dict(self) -> dict[str, Any]:
         return {
@@ -176,6 +217,9 @@ class S3Storage:
     endpoint: str | None = None
     """formatting deserialized with humantime crate, for example "1s"."""
     custom_timeout: str | None = None
+    index_cache: RemoteIndexCache = field(
+        default_factory=RemoteIndexCache, repr=False, compare=False
+    )
 
     def access_env_vars(self) -> dict[str, str]:
         if self.aws_profile is not None:
@@ -241,39 +285,77 @@ class S3Storage:
             self.bucket_name,
             self.prefix_in_bucket,
         )
+        deleted = self.delete_keys(self.iter_keys(self.prefix_in_bucket))
+        log.info(f"deleted {deleted} objects from remote storage")
+
+    def iter_keys(self, prefix: str) -> Iterable[str]:
+        """All keys starting with `prefix` (a full key prefix, including prefix_in_bucket)"""
         paginator = self.client.get_paginator("list_objects_v2")
-        pages = paginator.paginate(
-            Bucket=self.bucket_name,
-            Prefix=self.prefix_in_bucket,
-        )
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix):
+            for obj in page.get("Contents", []):
+                yield obj["Key"]
 
-        # Using Any because DeleteTypeDef (from boto3-stubs) doesn't fit our case
-        objects_to_delete: Any = {"Objects": []}
-        cnt = 0
-        for item in pages.search("Contents"):
-            # weirdly when nothing is found it returns [None]
-            if item is None:
-                break
-
-            objects_to_delete["Objects"].append({"Key": item["Key"]})
-
-            # flush once aws limit reached
-            if len(objects_to_delete["Objects"]) >= 1000:
-                self.client.delete_objects(
-                    Bucket=self.bucket_name,
-                    Delete=objects_to_delete,
-                )
-                objects_to_delete = {"Objects": []}
-                cnt += 1
-
-        # flush rest
-        if len(objects_to_delete["Objects"]):
-            self.client.delete_objects(
-                Bucket=self.bucket_name,
-                Delete=objects_to_delete,
-            )
+    def list_objects(self, prefix: str, delimiter: str | None = None) -> Any:
+        """
+        ListObjectsV2 of a full key prefix (including prefix_in_bucket), with all the
+        pages merged into a single response: `KeyCount`, `Contents` and `CommonPrefixes`.
+        """
+        paginator = self.client.get_paginator("list_objects_v2")
+        pages = (
+            paginator.paginate(Bucket=self.bucket_name, Prefix=prefix, Delimiter=delimiter)
+            if delimiter
+            else paginator.paginate(Bucket=self.bucket_name, Prefix=prefix)
+        )
+        merged: Any = {"KeyCount": 0, "Contents": [], "CommonPrefixes": []}
+        for page in pages:
+            merged["KeyCount"] += page.get("KeyCount", 0)
+            merged["Contents"] += page.get("Contents", [])
+            merged["CommonPrefixes"] += page.get("CommonPrefixes", [])
+        return merged
+
+    def list_objects_concurrently(
+        self, prefixes: Iterable[str], delimiter: str | None = None
+    ) -> dict[str, Any]:
+        """`list_objects` of many prefixes (e.g. one per tenant or timeline) in parallel"""
+        prefixes = list(prefixes)
+        with ThreadPoolExecutor(max_workers=S3_REQUEST_CONCURRENCY) as executor:
+            futs = {p: executor.submit(self.list_objects, p, delimiter) for p in prefixes}
+            return {p: fut.result() for p, fut in futs.items()}
+
+    def delete_keys(self, keys: Iterable[str]) -> int:
+        """
+        Delete the given full keys, in DeleteObjects batches that run concurrently.
+        Returns the number of objects deleted.
+        """
 
-        log.info(f"deleted {cnt} objects from remote storage")
+        def delete_batch(batch: list[str]) -> int:
+            # Using Any because DeleteTypeDef (from boto3-stubs) doesn't fit our case
+            objects_to_delete: Any = {"Objects": [{"Key": k} for k in batch], "Quiet": True}
+            response = self.client.delete_objects(Bucket=self.bucket_name, Delete=objects_to_delete)
+            errors = response.get("Errors", [])
+            for e in errors:
+                log.warning(f"failed to delete {e.get('Key')}: {e.get('Code')} {e.get('Message')}")
+            return len(batch) - len(errors)
+
+        with ThreadPoolExecutor(max_workers=S3_REQUEST_CONCURRENCY) as executor:
+            futs: list[Future[int]] = []
+            batch: list[str] = []
+            for key in keys:
+                batch.append(key)
+                if len(batch) >= S3_DELETE_BATCH_SIZE:
+                    futs.append(executor.submit(delete_batch, batch))
+                    batch = []
+            if batch:
+                futs.append(executor.submit(delete_batch, batch))
+            return sum(fut.result() for fut in futs)
+
+    def listing_snapshot(self, prefixes: Iterable[str] | None = None) -> S3ListingSnapshot:
+        """
+        List everything under `prefixes` (full key prefixes, e.g. one per tenant;
+        default: the whole prefix_in_bucket) once, for a check that needs to look
+        at many listings or small objects. See `S3ListingSnapshot`.
+        """
+        return S3ListingSnapshot(self, prefixes)
 
     def tenants_path(self) -> str:
         return f"{self.prefix_in_bucket}/tenants"
@@ -325,24 +407,84 @@ class S3Storage:
         key = self.get_latest_generation_key(prefix="index_part.json-", suffix="", keys=index_keys)
         return key
 
-    def download_index_part(self, index_key: str) -> IndexPartDump:
+    def get_json_cached(self, key: str, etag: str | None = None) -> Any:
+        """
+        The parsed JSON object at `key`, cached by ETag. If the ETag is known,
+        e.g. from a listing, a cached object is returned without a request.
+        Otherwise the object is downloaded unless it matches the cached ETag.
+        The result may be shared with other callers: don't modify it.
+        """
+        return self._cached_entry(key, etag).content
+
+    def _cached_entry(self, key: str, etag: str | None) -> CacheEntry:
+        entry = self.index_cache.lookup(key, etag)
+        if entry is not None:
+            return entry
+
+        cached_etag = self.index_cache.cached_version(key)
+        try:
+            if cached_etag is not None:
+                response = self.client.get_object(
+                    Bucket=self.bucket_name, Key=key, IfNoneMatch=str(cached_etag)
+                )
+            else:
+                response = self.client.get_object(Bucket=self.bucket_name, Key=key)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") != "304":
+                raise
+            entry = self.index_cache.lookup(key, cached_etag)
+            if entry is None:
+                # Evicted in the meantime
+                return self._cached_entry(key, None)
+            return entry
+
+        body = response["Body"].read()
+        log.debug(f"downloaded {key}: {len(body)} bytes")
+        return self.index_cache.store(key, response["ETag"], json.loads(body))
+
+    def download_index_part(self, index_key: str, etag: str | None = None) -> IndexPartDump:
         """
-        Downloads the index content from remote storage.
+        Downloads the index content from remote storage, unless it's cached.
 
         @param index_key: index key in remote storage.
+        @param etag: the index's ETag, if known from a listing.
         """
-        response = self.client.get_object(Bucket=self.bucket_name, Key=index_key)
-        body = response["Body"].read().decode("utf-8")
-        log.info(f"index_part.json: {body}")
-        return IndexPartDump.from_json(json.loads(body))
+        return self.index_cache.index_part_of(self._cached_entry(index_key, etag))
+
+    def index_part(
+        self, tenant_id: TenantId | TenantShardId, timeline_id: TimelineId
+    ) -> IndexPartDump:
+        """The latest generation's index_part of a timeline"""
+        prefix = f"{self.timeline_path(tenant_id, timeline_id)}/{TIMELINE_INDEX_PART_FILE_NAME}"
+        return self._latest_index_part(prefix, self.list_objects(prefix))
+
+    def index_parts(
+        self, timelines: Iterable[tuple[TenantId | TenantShardId, TimelineId]]
+    ) -> dict[tuple[TenantId | TenantShardId, TimelineId], IndexPartDump]:
+        """`index_part` of many timelines, with the listings and downloads done concurrently"""
+        prefixes = {
+            (t, tl): f"{self.timeline_path(t, tl)}/{TIMELINE_INDEX_PART_FILE_NAME}"
+            for t, tl in timelines
+        }
+        listings = self.list_objects_concurrently(prefixes.values())
+        with ThreadPoolExecutor(max_workers=S3_REQUEST_CONCURRENCY) as executor:
+            futs = {
+                timeline: executor.submit(self._latest_index_part, prefix, listings[prefix])
+                for timeline, prefix in prefixes.items()
+            }
+            return {timeline: fut.result() for timeline, fut in futs.items()}
+
+    def _latest_index_part(self, prefix: str, listing: Any) -> IndexPartDump:
+        etags = {obj["Key"]: obj["ETag"] for obj in listing["Contents"]}
+        if len(etags) == 0:
+            raise RuntimeError(f"No index_part found under {prefix}")
+        key = self.get_latest_index_key(list(etags))
+        return self.download_index_part(key, etags[key])
 
     def download_tenant_manifest(self, tenant_id: TenantId) -> dict[str, Any] | None:
         tenant_prefix = self.tenant_path(tenant_id)
 
-        objects = self.client.list_objects_v2(Bucket=self.bucket_name, Prefix=f"{tenant_prefix}/")[
-            "Contents"
-        ]
-        keys = [obj["Key"] for obj in objects if obj["Key"].find("tenant-manifest") != -1]
+        keys = [k for k in self.iter_keys(f"{tenant_prefix}/") if k.find("tenant-manifest") != -1]
         try:
             manifest_key = self.get_latest_generation_key("tenant-manifest-", ".json", keys)
         except IndexError:
@@ -363,13 +505,83 @@ class S3Storage:
         return f"{self.tenant_path(tenant_id)}/{TENANT_HEATMAP_FILE_NAME}"
 
     def heatmap_content(self, tenant_id: TenantId) -> Any:
-        r = self.client.get_object(Bucket=self.bucket_name, Key=self.heatmap_key(tenant_id))
-        return json.loads(r["Body"].read().decode("utf-8"))
+        """The parsed heatmap. It may be shared with other callers: don't modify it."""
+        return self.get_json_cached(self.heatmap_key(tenant_id))
 
     def mock_remote_tenant_path(self, tenant_id: TenantId):
         assert self.real is False
 
 
+class S3ListingSnapshot:
+    """
+    The keys under some prefixes of an S3Storage, listed once, and the JSON
+    objects downloaded through it. The listings and objects are those at the time
+    of the snapshot (or of the first download), so a snapshot is meant to be shared
+    by the assertions of one check, not kept across changes.
+    """
+
+    def __init__(self, storage: S3Storage, prefixes: Iterable[str] | None = None):
+        self.storage = storage
+        self.prefixes = [storage.prefix_in_bucket] if prefixes is None else sorted(set(prefixes))
+        listings = storage.list_objects_concurrently(self.prefixes)
+        objects: dict[str, ObjectTypeDef] = {}
+        for listing in listings.values():
+            for obj in listing["Contents"]:
+                objects[obj["Key"]] = obj
+        self.keys = sorted(objects)
+        self.objects = [objects[k] for k in self.keys]
+        self._json: dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def _range(self, prefix: str) -> range:
+        assert any(prefix.startswith(p) for p in self.prefixes), (
+            f"{prefix} is not covered by the snapshot of {self.prefixes}"
+        )
+        start = bisect.bisect_left(self.keys, prefix)
+        # All keys starting with `prefix` sort before `prefix` followed by the highest code point
+        end = bisect.bisect_left(self.keys, prefix + "\U0010ffff", lo=start)
+        return range(start, end)
+
+    def iter_keys(self, prefix: str) -> Iterable[str]:
+        for i in self._range(prefix):
+            yield self.keys[i]
+
+    def list_objects(self, prefix: str, delimiter: str | None = None) -> Any:
+        """Like `S3Storage.list_objects`, from the snapshot"""
+        contents = []
+        common_prefixes: dict[str, None] = {}
+        for i in self._range(prefix):
+            key = self.keys[i]
+            if delimiter:
+                pos = key.find(delimiter, len(prefix))
+                if pos != -1:
+                    common_prefixes[key[: pos + len(delimiter)]] = None
+                    continue
+            contents.append(self.objects[i])
+        return {
+            "KeyCount": len(contents) + len(common_prefixes),
+            "Contents": contents,
+            "CommonPrefixes": [{"Prefix": p} for p in common_prefixes],
+        }
+
+    def get_json(self, key: str) -> Any:
+        with self._lock:
+            if key in self._json:
+                return self._json[key]
+        r = self.storage.client.get_object(Bucket=self.storage.bucket_name, Key=key)
+        content = json.loads(r["Body"].read().decode("utf-8"))
+        with self._lock:
+            return self._json.setdefault(key, content)
+
+    def index_content(self, tenant_id: TenantId | TenantShardId, timeline_id: TimelineId) -> Any:
+        """The latest generation's index_part.json of a timeline in the snapshot"""
+        index_prefix = f"{self.storage.timeline_path(tenant_id, timeline_id)}/index_part.json"
+        return self.get_json(self.storage.get_latest_index_key(list(self.iter_keys(index_prefix))))
+
+    def heatmap_content(self, tenant_id: TenantId) -> Any:
+        return self.get_json(self.storage.heatmap_key(tenant_id))
+
+
 RemoteStorage = LocalFsStorage | S3Storage
 
 
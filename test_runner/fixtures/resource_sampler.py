@@ -0,0 +1,287 @@
+"""
+Sampling of the resource usage of the processes neon_local started.
+
+`ResourceSampler` finds the processes through the pid files in the repo dir,
+and polls their `/proc/<pid>/{stat,status,io,fd}` on a background thread. The
+samples are kept in ring buffers, and summarized per component (e.g.
+`pageserver_1`, `storage_broker`, `endpoints.ep-1.postgres`) when recorded.
+Descendant processes, e.g. the backends of a postgres or the walredo processes
+of a pageserver, are counted towards the process that started them.
+"""
+
+from __future__ import annotations
+
+import math
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
+
+from fixtures.benchmark_fixture import MetricReport
+from fixtures.log_helper import log
+
+if TYPE_CHECKING:
+    from pathlib import Path
+    from types import TracebackType
+
+    from fixtures.benchmark_fixture import NeonBenchmarker
+
+
+# Where neon_local keeps the pid files, relative to the repo dir. Deliberately
+# not a recursive glob: pageserver directories can contain many thousands of files.
+PID_FILE_GLOBS = [
+    "*.pid",
+    "*/*.pid",
+    "safekeepers/*/*.pid",
+    "endpoints/*/*.pid",
+    "endpoints/*/pgdata/postmaster.pid",
+]
+
+# How many samples to keep per component and metric
+SAMPLER_RING_SIZE = 3600
+
+# How often to look for new pid files, in seconds
+PID_RESCAN_INTERVAL = 5.0
+
+_CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+@dataclass
+class ProcessSample:
+    # utime + stime, plus cutime + cstime of the children that have exited, in seconds
+    cpu_seconds: float = 0.0
+    rss_bytes: int = 0
+    read_bytes: int = 0
+    write_bytes: int = 0
+    fds: int = 0
+
+
+def _read_proc(pid: int) -> ProcessSample | None:
+    """Read the resource usage of a single process, or None if it's gone"""
+    sample = ProcessSample()
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # The command name may contain spaces; the fields after it don't
+            fields = f.read().rsplit(")", 1)[1].split()
+        # utime, stime, cutime and cstime are fields 14 to 17 of the whole line
+        sample.cpu_seconds = sum(int(f) for f in fields[11:15]) / _CLOCK_TICKS
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    sample.rss_bytes = int(line.split()[1]) * 1024
+                    break
+        try:
+            with open(f"/proc/{pid}/io") as f:
+                for line in f:
+                    key, value = line.split(":")
+                    if key == "read_bytes":
+                        sample.read_bytes = int(value)
+                    elif key == "write_bytes":
+                        sample.write_bytes = int(value)
+        except PermissionError:
+            pass
+        sample.fds = len(os.listdir(f"/proc/{pid}/fd"))
+    except (FileNotFoundError, ProcessLookupError):
+        return None
+    return sample
+
+
+def _children(pid: int) -> list[int]:
+    """The children of every thread of `pid`, not only those of its main thread"""
+    children: list[int] = []
+    try:
+        tids = os.listdir(f"/proc/{pid}/task")
+    except (FileNotFoundError, ProcessLookupError):
+        return []
+    for tid in tids:
+        try:
+            with open(f"/proc/{pid}/task/{tid}/children") as f:
+                children.extend(int(c) for c in f.read().split())
+        except (FileNotFoundError, ProcessLookupError):
+            # The thread has exited
+            continue
+    return children
+
+
+def _descendants(pid: int) -> list[int]:
+    """
+    All live descendants of `pid`, e.g. the walredo processes that a pageserver
+    spawns from its tokio worker threads
+    """
+    descendants: list[int] = []
+    seen = {pid}
+    stack = [pid]
+    while stack:
+        for child in _children(stack.pop()):
+            if child not in seen:
+                seen.add(child)
+                descendants.append(child)
+                stack.append(child)
+    return descendants
+
+
+def _read_pid_file(path: Path) -> int | None:
+    try:
+        first_line = path.read_text().split("\n", 1)[0].strip()
+    except FileNotFoundError:
+        return None
+    return int(first_line) if first_line.isdigit() else None
+
+
+@dataclass
+class ComponentSeries:
+    """Ring buffers of one component's samples"""
+
+    cpu_percent: deque[float] = field(default_factory=lambda: deque(maxlen=SAMPLER_RING_SIZE))
+    rss_bytes: deque[float] = field(default_factory=lambda: deque(maxlen=SAMPLER_RING_SIZE))
+    read_bytes_per_sec: deque[float] = field(
+        default_factory=lambda: deque(maxlen=SAMPLER_RING_SIZE)
+    )
+    write_bytes_per_sec: deque[float] = field(
+        default_factory=lambda: deque(maxlen=SAMPLER_RING_SIZE)
+    )
+    fds: deque[float] = field(default_factory=lambda: deque(maxlen=SAMPLER_RING_SIZE))
+    # Cumulative CPU time used while being sampled, in seconds
+    cpu_seconds: float = 0.0
+    # Previous sample and when it was taken, to compute rates
+    prev: ProcessSample | None = None
+    prev_time: float = 0.0
+
+
+def _summarize(values: deque[float]) -> tuple[float, float, float]:
+    """(mean, p99, max)"""
+    ordered = sorted(values)
+    p99 = ordered[max(0, math.ceil(0.99 * len(ordered)) - 1)]
+    return sum(ordered) / len(ordered), p99, ordered[-1]
+
+
+class ResourceSampler:
+    """
+    Polls the resource usage of neon_local's processes every `interval` seconds
+    until stopped. Use as a context manager, then `record()` the results.
+    """
+
+    def __init__(self, repo_dir: Path, interval: float = 1.0):
+        self.repo_dir = repo_dir
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._series: dict[str, ComponentSeries] = {}
+        self._pids: dict[str, int] = {}
+        self._last_rescan = -math.inf
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def _component_name(self, pid_file: Path) -> str:
+        rel = pid_file.relative_to(self.repo_dir)
+        stem = "postgres" if pid_file.name == "postmaster.pid" else pid_file.stem
+        parts = [p for p in rel.parent.parts if p != "pgdata"]
+        # e.g. pageserver_1/pageserver.pid is just "pageserver_1"
+        if not parts or not parts[-1].startswith(stem):
+            parts.append(stem)
+        return ".".join(parts)
+
+    def _rescan(self):
+        pids = {}
+        for pattern in PID_FILE_GLOBS:
+            for pid_file in self.repo_dir.glob(pattern):
+                pid = _read_pid_file(pid_file)
+                if pid is not None:
+                    pids[self._component_name(pid_file)] = pid
+        self._pids = pids
+
+    def sample(self):
+        """Take one sample of every component"""
+        now = time.monotonic()
+        if now - self._last_rescan >= PID_RESCAN_INTERVAL:
+            self._rescan()
+            self._last_rescan = now
+
+        for component, pid in self._pids.items():
+            total: ProcessSample | None = None
+            for p in [pid, *_descendants(pid)]:
+                s = _read_proc(p)
+                if s is None:
+                    continue
+                if total is None:
+                    total = s
+                else:
+                    total.cpu_seconds += s.cpu_seconds
+                    total.rss_bytes += s.rss_bytes
+                    total.read_bytes += s.read_bytes
+                    total.write_bytes += s.write_bytes
+                    total.fds += s.fds
+            if total is None:
+                continue
+
+            with self._lock:
+                series = self._series.setdefault(component, ComponentSeries())
+                prev = series.prev
+                elapsed = now - series.prev_time
+                # CPU time going backwards means the process was restarted. The
+                # I/O counters of children are lost when they exit, though.
+                if prev is not None and elapsed > 0 and total.cpu_seconds >= prev.cpu_seconds:
+                    cpu = total.cpu_seconds - prev.cpu_seconds
+                    series.cpu_seconds += cpu
+                    series.cpu_percent.append(100 * cpu / elapsed)
+                    series.read_bytes_per_sec.append(
+                        max(0, total.read_bytes - prev.read_bytes) / elapsed
+                    )
+                    series.write_bytes_per_sec.append(
+                        max(0, total.write_bytes - prev.write_bytes) / elapsed
+                    )
+                series.rss_bytes.append(total.rss_bytes)
+                series.fds.append(total.fds)
+                series.prev = total
+                series.prev_time = now
+
+    def _run(self):
+        while True:
+            try:
+                self.sample()
+            except Exception as e:
+                log.warning(f"resource sampling failed: {e}")
+            if self._stop.wait(self.interval):
+                return
+
+    def __enter__(self) -> ResourceSampler:
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        tb: TracebackType | None,
+    ):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def record(self, zenbenchmark: NeonBenchmarker, prefix: str = "resources"):
+        """
+        Record the mean, p99 and max of each metric of each component, and the
+        total CPU time used by each component.
+        """
+        with self._lock:
+            for component, series in sorted(self._series.items()):
+                name = f"{prefix}.{component}"
+                zenbenchmark.record(
+                    f"{name}.cpu_seconds", series.cpu_seconds, "s", MetricReport.LOWER_IS_BETTER
+                )
+                for metric, values, unit in [
+                    ("cpu", series.cpu_percent, "%"),
+                    ("rss", series.rss_bytes, "byte"),
+                    ("read", series.read_bytes_per_sec, "byte/s"),
+                    ("write", series.write_bytes_per_sec, "byte/s"),
+                    ("fds", series.fds, ""),
+                ]:
+                    if not values:
+                        continue
+                    mean, p99, max_ = _summarize(values)
+                    for stat, value in [("mean", mean), ("p99", p99), ("max", max_)]:
+                        zenbenchmark.record(
+                            f"{name}.{metric}_{stat}", value, unit, MetricReport.LOWER_IS_BETTER
+                        )
@@ -6,13 +6,16 @@ from typing import TYPE_CHECKING
 
 import pytest
 import requests
+from requests.adapters import HTTPAdapter
 
 from fixtures.common_types import Lsn, TenantId, TenantTimelineId, TimelineId
+from fixtures.http_client_cache import HTTP_POOL_MAXSIZE
 from fixtures.log_helper import log
 from fixtures.metrics import Metrics, MetricsGetter, parse_metrics
 from fixtures.utils import EnhancedJSONEncoder, wait_until
 
 if TYPE_CHECKING:
+    from collections.abc import Sequence
     from typing import Any
 
 
@@ -44,6 +47,7 @@ class SafekeeperMetrics(Metrics):
     # As a consequence, values may differ from real original int64s.
 
     def __init__(self, m: Metrics):
+        super().__init__(m.name)
         self.metrics = m.metrics
 
     def flush_lsn_inexact(self, tenant_id: TenantId, timeline_id: TimelineId):
@@ -129,6 +133,8 @@ class SafekeeperHttpClient(requests.Session, MetricsGetter):
         self.auth_token = auth_token
         self.is_testing_enabled = is_testing_enabled
 
+        self.mount("http://", HTTPAdapter(pool_maxsize=HTTP_POOL_MAXSIZE))
+
         if auth_token is not None:
             self.headers["Authorization"] = f"Bearer {auth_token}"
 
@@ -141,9 +147,9 @@ class SafekeeperHttpClient(requests.Session, MetricsGetter):
         request_result.raise_for_status()
         return request_result.text
 
-    def get_metrics(self) -> SafekeeperMetrics:
+    def get_metrics(self, prefixes: Sequence[str] | None = None) -> SafekeeperMetrics:
         res = self.get_metrics_str()
-        return SafekeeperMetrics(parse_metrics(res))
+        return SafekeeperMetrics(parse_metrics(res, prefixes=prefixes))
 
     def is_testing_enabled_or_skip(self):
         if not self.is_testing_enabled:
@@ -3,10 +3,12 @@ from __future__ import annotations
 from typing import TYPE_CHECKING
 
 from fixtures.log_helper import log
+from fixtures.safekeeper.wal_compare import compare_wal_segments
 from fixtures.utils import wait_until
 
 if TYPE_CHECKING:
     from fixtures.common_types import TenantId, TimelineId
+    from fixtures.neon_fixtures import Safekeeper
     from fixtures.safekeeper.http import SafekeeperHttpClient
 
 
@@ -24,3 +26,36 @@ def wait_walreceivers_absent(
         assert len(status.walreceivers) == 0
 
     wait_until(walreceivers_absent)
+
+
+def cmp_sk_wal(sks: list[Safekeeper], tenant_id: TenantId, timeline_id: TimelineId):
+    """
+    Assert that WAL on given safekeepers is identical. No compute must be running
+    for this to be reliable.
+    """
+    assert len(sks) >= 2, "cmp_sk_wal makes sense with >= 2 safekeepers passed"
+    sk_http_clis = [sk.http_client() for sk in sks]
+
+    # First check that term / flush_lsn are the same: it is easier to
+    # report/understand if WALs are different due to that.
+    statuses = [sk_http_cli.timeline_status(tenant_id, timeline_id) for sk_http_cli in sk_http_clis]
+    term_flush_lsns = [(s.last_log_term, s.flush_lsn) for s in statuses]
+    for tfl, sk in zip(term_flush_lsns[1:], sks[1:], strict=False):
+        assert term_flush_lsns[0] == tfl, (
+            f"(last_log_term, flush_lsn) are not equal on sks {sks[0].id} and {sk.id}: {term_flush_lsns[0]} != {tfl}"
+        )
+
+    # check that WALs are identic.
+    segs = [sk.list_segments(tenant_id, timeline_id) for sk in sks]
+    for cmp_segs, sk in zip(segs[1:], sks[1:], strict=False):
+        assert segs[0] == cmp_segs, (
+            f"lists of segments on sks {sks[0].id} and {sk.id} are not identic: {segs[0]} and {cmp_segs}"
+        )
+    log.info(f"comparing segs {segs[0]}")
+
+    mismatches = compare_wal_segments(
+        [(f"sk {sk.id}", sk.timeline_dir(tenant_id, timeline_id)) for sk in sks], segs[0]
+    )
+    for m in mismatches:
+        log.error(str(m))
+    assert mismatches == [], f"WAL differs on safekeepers: {mismatches[0]}"
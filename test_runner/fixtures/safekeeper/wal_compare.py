@@ -0,0 +1,290 @@
+"""
+Comparison of WAL segment files across safekeepers.
+
+Every copy of a segment is hashed in a thread pool, reading it through mmap in
+chunks (hashlib releases the GIL on large buffers). Only when the digests
+differ are the copies compared byte by byte, and the first differing byte is
+then located in the WAL: the XLOG page headers and record headers of the
+reference copy are walked from the start of the segment to find the record
+it belongs to. That, rather than a diff of hex dumps of whole segments, is
+what gets reported.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import mmap
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+from fixtures.common_types import DEFAULT_WAL_SEG_SIZE, Lsn
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator, Sequence
+    from pathlib import Path
+
+
+XLOG_BLCKSZ = 8192
+
+# Segments are hashed and compared in chunks of this size
+HASH_CHUNK_SIZE = 1 << 20
+
+# XLogPageHeaderData: xlp_magic, xlp_info, xlp_tli, xlp_pageaddr, xlp_rem_len, MAXALIGNed.
+# The first page of a segment has XLogLongPageHeaderData, which adds xlp_sysid,
+# xlp_seg_size and xlp_xlog_blcksz.
+XLOG_PAGE_HEADER = struct.Struct("<HHIQI")
+SIZE_OF_XLOG_SHORT_PHD = 24
+SIZE_OF_XLOG_LONG_PHD = 40
+XLP_FIRST_IS_CONTRECORD = 0x0001
+
+# XLogRecord: xl_tot_len, xl_xid, xl_prev, xl_info, xl_rmid, 2 bytes padding, xl_crc
+XLOG_RECORD_HEADER = struct.Struct("<IIQBBxxI")
+
+# Resource manager ids, from src/include/access/rmgrlist.h, plus Neon's custom one
+RMGR_NAMES = [
+    "XLOG",
+    "Transaction",
+    "Storage",
+    "CLOG",
+    "Database",
+    "Tablespace",
+    "MultiXact",
+    "RelMap",
+    "Standby",
+    "Heap2",
+    "Heap",
+    "Btree",
+    "Hash",
+    "Gin",
+    "Gist",
+    "Sequence",
+    "SPGist",
+    "BRIN",
+    "CommitTs",
+    "ReplicationOrigin",
+    "Generic",
+    "LogicalMessage",
+]
+RM_NEON_ID = 134
+
+
+def rmgr_name(rmid: int) -> str:
+    if rmid < len(RMGR_NAMES):
+        return RMGR_NAMES[rmid]
+    if rmid == RM_NEON_ID:
+        return "neon"
+    return f"rmgr {rmid}"
+
+
+def _maxalign(n: int) -> int:
+    return (n + 7) & ~7
+
+
+def segment_start_lsn(segment_name: str, seg_size: int = DEFAULT_WAL_SEG_SIZE) -> Lsn:
+    """The LSN at which a segment starts, from its file name (which may have a .partial suffix)"""
+    log_id = int(segment_name[8:16], 16)
+    seg_id = int(segment_name[16:24], 16)
+    return Lsn((log_id * (0x1_0000_0000 // seg_size) + seg_id) * seg_size)
+
+
+@dataclass
+class WalRecordInfo:
+    lsn: Lsn
+    tot_len: int
+    xid: int
+    prev: Lsn
+    info: int
+    rmid: int
+
+    def __str__(self) -> str:
+        return (
+            f"record at {self.lsn}: {rmgr_name(self.rmid)} info={self.info:#04x} "
+            f"len={self.tot_len} xid={self.xid} prev={self.prev}"
+        )
+
+
+class _SegmentReader:
+    """Reads the record data of a segment, skipping the page headers"""
+
+    def __init__(self, buf: bytes | mmap.mmap, start_lsn: Lsn):
+        self.buf = buf
+        self.start_lsn = start_lsn
+
+    def page_header_size(self, page_off: int) -> int:
+        return SIZE_OF_XLOG_LONG_PHD if page_off == 0 else SIZE_OF_XLOG_SHORT_PHD
+
+    def skip_page_header(self, pos: int) -> int:
+        if pos % XLOG_BLCKSZ == 0:
+            return pos + self.page_header_size(pos)
+        return pos
+
+    def read(self, pos: int, n: int) -> tuple[bytes, int]:
+        """Read `n` bytes of record data starting at offset `pos`, returns them and the end offset"""
+        out = bytearray()
+        while n > 0:
+            pos = self.skip_page_header(pos)
+            if pos >= len(self.buf):
+                break
+            take = min(n, XLOG_BLCKSZ - pos % XLOG_BLCKSZ)
+            out += self.buf[pos : pos + take]
+            pos += take
+            n -= take
+        return bytes(out), pos
+
+    def records(self) -> Iterator[tuple[int, int, WalRecordInfo | None]]:
+        """
+        Yields (start offset, end offset, record header) of the records that start in the
+        segment, until the end of the WAL. The first item has no record header if the
+        segment starts with the continuation of a record from the previous one.
+        """
+        if len(self.buf) < SIZE_OF_XLOG_LONG_PHD:
+            return
+        _, xlp_info, _, _, xlp_rem_len = XLOG_PAGE_HEADER.unpack_from(self.buf, 0)
+        pos = SIZE_OF_XLOG_LONG_PHD
+        if xlp_info & XLP_FIRST_IS_CONTRECORD:
+            _, end = self.read(pos, xlp_rem_len)
+            yield 0, end, None
+            pos = _maxalign(end)
+
+        while pos < len(self.buf):
+            pos = self.skip_page_header(pos)
+            header, _ = self.read(pos, XLOG_RECORD_HEADER.size)
+            if len(header) < XLOG_RECORD_HEADER.size:
+                return
+            tot_len, xid, prev, info, rmid, _crc = XLOG_RECORD_HEADER.unpack(header)
+            if tot_len < XLOG_RECORD_HEADER.size:
+                # Zeroed space past the end of the WAL
+                return
+            record = WalRecordInfo(
+                lsn=Lsn(self.start_lsn.as_int() + pos),
+                tot_len=tot_len,
+                xid=xid,
+                prev=Lsn(prev),
+                info=info,
+                rmid=rmid,
+            )
+            _, end = self.read(pos, tot_len)
+            yield pos, end, record
+            pos = _maxalign(end)
+
+    def describe(self, offset: int) -> str:
+        """Describe where in the WAL the byte at `offset` of the segment is"""
+        page_off = offset - offset % XLOG_BLCKSZ
+        if offset - page_off < self.page_header_size(page_off):
+            return f"in the header of the page at {Lsn(self.start_lsn.as_int() + page_off)}"
+        last_end = 0
+        for start, end, record in self.records():
+            if offset < start:
+                break
+            if offset < end:
+                if record is None:
+                    return "in the continuation of a record from the previous segment"
+                return f"in {record}"
+            last_end = end
+        else:
+            return f"past the end of the WAL at {Lsn(self.start_lsn.as_int() + last_end)}"
+        return f"in the padding after {Lsn(self.start_lsn.as_int() + last_end)}"
+
+
+@dataclass
+class SegmentMismatch:
+    segment: str
+    reference: str
+    other: str
+    # Offset of the first differing byte in the segment, None if only the sizes differ
+    offset: int | None
+    reference_size: int
+    other_size: int
+    location: str
+
+    def __str__(self) -> str:
+        if self.offset is None:
+            what = f"sizes differ: {self.reference_size} != {self.other_size}"
+        else:
+            lsn = segment_start_lsn(self.segment).as_int() + self.offset
+            what = f"first difference at offset {self.offset} (LSN {Lsn(lsn)}), {self.location}"
+        return f"segment {self.segment} differs between {self.reference} and {self.other}: {what}"
+
+
+def segment_digest(path: Path) -> tuple[int, bytes]:
+    """The size and digest of a file"""
+    with open(path, "rb") as f:
+        size = f.seek(0, 2)
+        h = hashlib.blake2b(digest_size=32)
+        if size > 0:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                view = memoryview(m)
+                try:
+                    for off in range(0, size, HASH_CHUNK_SIZE):
+                        h.update(view[off : off + HASH_CHUNK_SIZE])
+                finally:
+                    view.release()
+    return size, h.digest()
+
+
+def first_difference(a: Path, b: Path) -> int | None:
+    """Offset of the first byte that differs between two files, None if one is a prefix of the other"""
+    with open(a, "rb") as fa, open(b, "rb") as fb:
+        off = 0
+        while True:
+            ca = fa.read(HASH_CHUNK_SIZE)
+            cb = fb.read(HASH_CHUNK_SIZE)
+            n = min(len(ca), len(cb))
+            if ca[:n] != cb[:n]:
+                # Narrow down the chunk by halves rather than byte by byte
+                lo, hi = 0, n
+                while hi - lo > 1:
+                    mid = (lo + hi) // 2
+                    if ca[lo:mid] != cb[lo:mid]:
+                        hi = mid
+                    else:
+                        lo = mid
+                return off + lo
+            if n == 0 or len(ca) != len(cb):
+                return None
+            off += n
+
+
+def describe_offset(path: Path, segment: str, offset: int) -> str:
+    with open(path, "rb") as f:
+        if f.seek(0, 2) == 0:
+            return "in an empty file"
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            return _SegmentReader(m, segment_start_lsn(segment)).describe(offset)
+
+
+def compare_wal_segments(
+    dirs: Sequence[tuple[str, Path]], segments: Sequence[str], concurrency: int = 8
+) -> list[SegmentMismatch]:
+    """
+    Compare the given segments in each of `dirs`, a list of (label, directory). Returns the
+    copies that differ from the one in the first directory.
+    """
+    paths = [(segment, label, d / segment) for segment in segments for label, d in dirs]
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        digests = dict(
+            zip(
+                [(segment, label) for segment, label, _ in paths],
+                executor.map(segment_digest, [p for _, _, p in paths]),
+                strict=True,
+            )
+        )
+
+    mismatches = []
+    ref_label, ref_dir = dirs[0]
+    for segment in segments:
+        ref_size, ref_digest = digests[(segment, ref_label)]
+        for label, d in dirs[1:]:
+            size, digest = digests[(segment, label)]
+            if (size, digest) == (ref_size, ref_digest):
+                continue
+            offset = first_difference(ref_dir / segment, d / segment)
+            location = (
+                describe_offset(ref_dir / segment, segment, offset) if offset is not None else ""
+            )
+            mismatches.append(
+                SegmentMismatch(segment, ref_label, label, offset, ref_size, size, location)
+            )
+    return mismatches
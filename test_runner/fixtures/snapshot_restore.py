@@ -0,0 +1,210 @@
+"""
+Materialization of repo dir snapshots.
+
+`NeonEnvBuilder.from_repo_dir` restores a snapshot into a fresh repo dir. Without
+overlayfs, that used to be a `shutil.copytree` of everything, which for the
+large pagebench snapshots means copying hundreds of gigabytes of layer files
+before every benchmark. `SnapshotMaterializer` avoids copying file contents
+where it can:
+
+- If the filesystem supports reflinks (FICLONE: btrfs, XFS, ...), every file
+  is cloned. A clone shares the data blocks but is otherwise an independent
+  copy, so this is always safe.
+- Otherwise, layer files are hardlinked. Layer files are never modified after
+  they are written: their names are derived from the key and LSN range they
+  cover, so anything that changes the content gets a new file.
+- Everything else (index_part.json, heatmaps, configs, safekeeper WAL, ...) is
+  copied.
+"""
+
+from __future__ import annotations
+
+import errno
+import fcntl
+import os
+import re
+import shutil
+import threading
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+from fixtures.log_helper import log
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+    from pathlib import Path
+
+
+# From linux/fs.h: _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+# Layer file names, both in a pageserver's local tenants dir (optionally with a
+# `-v1-<generation>` suffix) and in remote storage (with a `-<generation>` suffix).
+LAYER_FILE_NAME = re.compile(
+    r"^[A-F0-9]{36}-[A-F0-9]{36}__[A-F0-9]{16}(-[A-F0-9]{16})?(-v1)?(-[a-f0-9]{8})?$"
+)
+
+# errnos with which FICLONE reports that the filesystem can't clone the file
+_REFLINK_UNSUPPORTED = {errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS}
+
+
+def is_layer_file_name(name: str) -> bool:
+    return LAYER_FILE_NAME.match(name) is not None
+
+
+@dataclass
+class SnapshotRestoreStats:
+    files_reflinked: int = 0
+    files_hardlinked: int = 0
+    files_copied: int = 0
+    bytes_reflinked: int = 0
+    bytes_hardlinked: int = 0
+    bytes_copied: int = 0
+    # Wall clock time spent in `SnapshotMaterializer.copytree()`
+    duration: float = 0.0
+
+    @property
+    def bytes_linked(self) -> int:
+        """Bytes that were restored without copying them"""
+        return self.bytes_reflinked + self.bytes_hardlinked
+
+
+def _ficlone(src: str, dst: str):
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            os.unlink(dst)
+            raise
+
+
+def clone_file(src: str, dst: str) -> bool:
+    """
+    Copy the contents of `src` to a new file `dst`: with a reflink if the
+    filesystem supports it, otherwise with copy_file_range(2), which keeps the
+    data in the kernel and lets some filesystems share or offload the copy.
+    Returns whether a reflink was made. Metadata is not copied.
+    """
+    try:
+        _ficlone(src, dst)
+        return True
+    except OSError as e:
+        if e.errno not in _REFLINK_UNSUPPORTED:
+            raise
+
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        remaining = os.fstat(fsrc.fileno()).st_size
+        try:
+            while remaining > 0:
+                n = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                if n == 0:
+                    break
+                remaining -= n
+        except OSError as e:
+            if e.errno not in _REFLINK_UNSUPPORTED:
+                raise
+            fsrc.seek(0)
+            fdst.seek(0)
+            fdst.truncate()
+            shutil.copyfileobj(fsrc, fdst)
+    return False
+
+
+class SnapshotMaterializer:
+    """
+    Restores directory trees of a snapshot, using the cheapest method that is
+    safe for each file. Reflink support is probed with the first file and
+    remembered; hardlinking falls back to copying if the snapshot is on a
+    different filesystem.
+    """
+
+    def __init__(self):
+        self.stats = SnapshotRestoreStats()
+        self._lock = threading.Lock()
+        # None until probed
+        self._reflink_supported: bool | None = None
+        self._hardlink_supported = True
+
+    def _count(self, method: str, size: int):
+        with self._lock:
+            setattr(self.stats, f"files_{method}", getattr(self.stats, f"files_{method}") + 1)
+            setattr(self.stats, f"bytes_{method}", getattr(self.stats, f"bytes_{method}") + size)
+
+    def _try_reflink(self, src: str, dst: str) -> bool:
+        if self._reflink_supported is False:
+            return False
+        try:
+            _ficlone(src, dst)
+            shutil.copystat(src, dst)
+        except OSError as e:
+            if e.errno not in _REFLINK_UNSUPPORTED:
+                raise
+            if self._reflink_supported is None:
+                log.info(f"reflinks are not supported for {dst}: {e}")
+            self._reflink_supported = False
+            return False
+        self._reflink_supported = True
+        return True
+
+    def _try_hardlink(self, src: str, dst: str) -> bool:
+        if not self._hardlink_supported:
+            return False
+        try:
+            os.link(src, dst)
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+            log.info(f"hardlinks are not supported for {dst}: {e}")
+            self._hardlink_supported = False
+            return False
+        return True
+
+    def copy_file(self, src: str, dst: str, allow_hardlink: bool) -> str:
+        """
+        A `shutil.copytree` copy function. Hardlinks are only used if
+        `allow_hardlink` is set and `src` is a layer file.
+        """
+        size = os.stat(src).st_size
+        if self._try_reflink(src, dst):
+            self._count("reflinked", size)
+        elif (
+            allow_hardlink
+            and is_layer_file_name(os.path.basename(src))
+            and self._try_hardlink(src, dst)
+        ):
+            self._count("hardlinked", size)
+        else:
+            shutil.copy2(src, dst)
+            self._count("copied", size)
+        return dst
+
+    def copytree(
+        self,
+        src: Path,
+        dst: Path,
+        ignore: Callable[[str, list[str]], set[str]] | None = None,
+        allow_hardlinks: bool = True,
+    ):
+        """
+        Like `shutil.copytree(src, dst, ignore=ignore)`. Pass `allow_hardlinks=False`
+        for trees whose files may be modified in place even if they look like layers.
+        """
+        started_at = time.monotonic()
+        shutil.copytree(
+            src,
+            dst,
+            ignore=ignore,
+            copy_function=lambda s, d: self.copy_file(s, d, allow_hardlinks),
+        )
+        self.stats.duration += time.monotonic() - started_at
+
+    def log_summary(self):
+        s = self.stats
+        log.info(
+            f"restored snapshot in {s.duration:.3f}s: "
+            f"{s.files_reflinked} files ({s.bytes_reflinked} bytes) reflinked, "
+            f"{s.files_hardlinked} files ({s.bytes_hardlinked} bytes) hardlinked, "
+            f"{s.files_copied} files ({s.bytes_copied} bytes) copied"
+        )
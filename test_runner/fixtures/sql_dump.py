@@ -0,0 +1,279 @@
+"""
+Structural comparison of plain-text SQL dumps, as made by pg_dump and pg_dumpall.
+
+pg_dump precedes every object with a comment naming it:
+
+    --
+    -- Name: t; Type: TABLE; Schema: public; Owner: cloud_admin
+    --
+
+(`-- Data for Name: ...; Type: TABLE DATA; ...` for COPY data), and pg_dumpall
+separates databases with `\\connect` lines. A dump is split into one section
+per (database, type, schema, name), and two dumps are compared object by object:
+
+- DDL is compared as text, ignoring comments and blank lines, like
+  `diff --ignore-matching-lines=^-- --ignore-blank-lines` did.
+- Table data is compared by a digest of the COPY statement and its rows, in
+  dump order. Tables are hashed in a thread pool, reading the dump through mmap
+  (hashlib releases the GIL on large buffers).
+
+Only the objects that differ are reported, with a unified diff of their DDL but
+never of table data.
+"""
+
+from __future__ import annotations
+
+import bisect
+import difflib
+import hashlib
+import mmap
+import re
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from fnmatch import fnmatchcase
+from typing import TYPE_CHECKING
+
+from fixtures.log_helper import log
+
+if TYPE_CHECKING:
+    from collections.abc import Sequence
+    from pathlib import Path
+
+
+# Dumps are hashed in chunks of this size
+HASH_CHUNK_SIZE = 1 << 20
+
+# Table data smaller than this is hashed on the spot rather than in the thread pool
+PARALLEL_HASH_THRESHOLD = 1 << 20
+
+OBJECT_HEADER = re.compile(
+    rb"^-- (?:Data for )?Name: (?P<name>.*?); Type: (?P<type>.*?); Schema: (?P<schema>.*?); Owner: .*$",
+    re.MULTILINE,
+)
+CONNECT = re.compile(rb"^\\connect (?P<database>.*)$", re.MULTILINE)
+COPY_START = re.compile(rb"^COPY ", re.MULTILINE)
+COPY_END = re.compile(rb"^\\\.$", re.MULTILINE)
+
+TABLE_DATA = "TABLE DATA"
+# The commands before the first object of a dump or of a database (roles, SETs, ...)
+PREAMBLE = "PREAMBLE"
+
+
+@dataclass(frozen=True)
+class DumpObjectKey:
+    database: str
+    type: str
+    schema: str
+    name: str
+
+    def __str__(self) -> str:
+        if self.type == PREAMBLE:
+            return f"{PREAMBLE} of {self.database or 'the dump'}"
+        return f"{self.type} {self.schema}.{self.name} in {self.database}"
+
+
+@dataclass
+class DumpSection:
+    key: DumpObjectKey
+    # DDL without comments and blank lines; empty for table data
+    text: str = ""
+    # Digest of the COPY statement and rows, and the number of rows; table data only
+    digest: bytes = b""
+    rows: int = 0
+
+    def same_as(self, other: DumpSection) -> bool:
+        return (self.text, self.digest) == (other.text, other.digest)
+
+
+@dataclass(frozen=True)
+class AllowedDiff:
+    """
+    A difference between dumps that is expected, e.g. because a newer Postgres version
+    dumps an object differently. The object is matched by fnmatch-style patterns on its
+    key. With `expected` set, the object must be dumped as that text (comments and blank
+    lines aside) in the second dump; otherwise any difference in it is allowed, including
+    it being added or missing.
+    """
+
+    type: str
+    name: str
+    schema: str = "*"
+    database: str = "*"
+    expected: str | None = None
+
+    def matches(self, key: DumpObjectKey) -> bool:
+        return (
+            fnmatchcase(key.type, self.type)
+            and fnmatchcase(key.name, self.name)
+            and fnmatchcase(key.schema, self.schema)
+            and fnmatchcase(key.database, self.database)
+        )
+
+    def allows(self, key: DumpObjectKey, second: DumpSection | None) -> bool:
+        if not self.matches(key):
+            return False
+        if self.expected is None:
+            return True
+        return second is not None and second.text == _normalize_ddl(self.expected.encode())
+
+
+@dataclass
+class DumpDifference:
+    key: DumpObjectKey
+    first: DumpSection | None
+    second: DumpSection | None
+
+    def __str__(self) -> str:
+        if self.first is None:
+            return f"{self.key}: only in the second dump"
+        if self.second is None:
+            return f"{self.key}: only in the first dump"
+        if self.key.type == TABLE_DATA:
+            return f"{self.key}: data differs ({self.first.rows} rows vs {self.second.rows} rows)"
+        return f"{self.key}: definition differs"
+
+    def diff(self) -> str:
+        """A unified diff of the DDL, empty for table data"""
+        if self.key.type == TABLE_DATA:
+            return ""
+        first = self.first.text.splitlines() if self.first else []
+        second = self.second.text.splitlines() if self.second else []
+        return "\n".join(difflib.unified_diff(first, second, "first", "second", n=3, lineterm=""))
+
+
+def _normalize_ddl(data: bytes) -> str:
+    lines = data.decode(errors="replace").splitlines()
+    return "\n".join(line for line in lines if line.strip() and not line.startswith("--"))
+
+
+def _hash_range(m: mmap.mmap, start: int, end: int) -> tuple[bytes, int]:
+    """The digest and number of lines of a range of a dump"""
+    h = hashlib.blake2b(digest_size=32)
+    lines = 0
+    for off in range(start, end, HASH_CHUNK_SIZE):
+        chunk = m[off : min(off + HASH_CHUNK_SIZE, end)]
+        h.update(chunk)
+        lines += chunk.count(b"\n")
+    return h.digest(), lines
+
+
+class SqlDump:
+    """The sections of a plain-text SQL dump, by object"""
+
+    def __init__(self, path: Path, concurrency: int = 8):
+        if not path.exists():
+            raise FileNotFoundError(f"{path} doesn't exist")
+        self.path = path
+        self.sections: dict[DumpObjectKey, DumpSection] = {}
+        with open(path, "rb") as f:
+            if f.seek(0, 2) == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                self._parse(m, concurrency)
+
+    def _add(self, section: DumpSection):
+        # Keep objects that are dumped under the same name apart
+        key = section.key
+        n = 1
+        while key in self.sections:
+            n += 1
+            key = DumpObjectKey(key.database, key.type, key.schema, f"{section.key.name} #{n}")
+        section.key = key
+        self.sections[key] = section
+
+    def _parse(self, m: mmap.mmap, concurrency: int):
+        connects = [(c.start(), c.group("database").decode()) for c in CONNECT.finditer(m)]
+        connect_offsets = [off for off, _ in connects]
+        headers = list(OBJECT_HEADER.finditer(m))
+        # A section ends where the next object or database starts
+        boundaries = sorted({0, len(m), *connect_offsets, *(h.start() for h in headers)})
+
+        def database_at(offset: int) -> str:
+            i = bisect.bisect_right(connect_offsets, offset) - 1
+            return connects[i][1] if i >= 0 else ""
+
+        def section_end(start: int) -> int:
+            return boundaries[bisect.bisect_right(boundaries, start)]
+
+        for start in [0, *connect_offsets]:
+            end = section_end(start)
+            if end > start:
+                key = DumpObjectKey(database_at(start), PREAMBLE, "", "")
+                self._add(DumpSection(key, text=_normalize_ddl(m[start:end])))
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            pending = []
+            for h in headers:
+                start, end = h.end(), section_end(h.start())
+                key = DumpObjectKey(
+                    database_at(start),
+                    h.group("type").decode(),
+                    h.group("schema").decode(),
+                    h.group("name").decode(),
+                )
+                section = DumpSection(key)
+                self._add(section)
+                if key.type != TABLE_DATA:
+                    section.text = _normalize_ddl(m[start:end])
+                    continue
+                # From the COPY statement to the end-of-data marker
+                copy_start = COPY_START.search(m, start, end)
+                data_start = copy_start.start() if copy_start else start
+                copy_end = COPY_END.search(m, data_start, end)
+                data_end = min(copy_end.end() + 1, end) if copy_end else end
+                if data_end - data_start >= PARALLEL_HASH_THRESHOLD:
+                    pending.append((section, executor.submit(_hash_range, m, data_start, data_end)))
+                else:
+                    section.digest, section.rows = _hash_range(m, data_start, data_end)
+
+            for section, fut in pending:
+                section.digest, section.rows = fut.result()
+
+        # The COPY statement and the end-of-data marker aren't rows
+        for section in self.sections.values():
+            if section.key.type == TABLE_DATA:
+                section.rows = max(section.rows - 2, 0)
+
+
+def compare_dumps(
+    first: SqlDump, second: SqlDump, allowed_diffs: Sequence[AllowedDiff] = ()
+) -> list[DumpDifference]:
+    """The objects that differ between two dumps, in the order of the first dump"""
+    differences = []
+    for key in [*first.sections, *(k for k in second.sections if k not in first.sections)]:
+        a = first.sections.get(key)
+        b = second.sections.get(key)
+        if a is not None and b is not None and a.same_as(b):
+            continue
+        if any(allowed.allows(key, b) for allowed in allowed_diffs):
+            log.info(f"Allowed difference in {key}")
+            continue
+        differences.append(DumpDifference(key, a, b))
+    return differences
+
+
+def dump_differs(
+    first: Path, second: Path, output: Path, allowed_diffs: Sequence[AllowedDiff] | None = None
+) -> bool:
+    """
+    Compares two SQL dumps object by object and writes the objects that differ to the given
+    output file. Differences that match one of `allowed_diffs` are not considered.
+
+    Returns True if the dumps differ, False otherwise (in most cases we want it to return False).
+    """
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        first_dump, second_dump = executor.map(SqlDump, [first, second])
+
+    differences = compare_dumps(first_dump, second_dump, allowed_diffs or ())
+
+    with output.open("w") as f:
+        f.write(f"--- {first}\n+++ {second}\n")
+        for difference in differences:
+            f.write(f"\n{difference}\n")
+            diff = difference.diff()
+            if diff:
+                f.write(f"{diff}\n")
+
+    if differences:
+        log.info(f"{len(differences)} objects differ between {first} and {second}, see {output}")
+    return len(differences) > 0
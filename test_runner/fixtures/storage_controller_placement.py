@@ -0,0 +1,168 @@
+"""
+An indexed view of the storage controller's tenant shard placements.
+
+The storage controller's debug dump lists every tenant shard with its intended
+and observed locations. Tests at scale (thousands of shards) used to fetch and
+walk the whole dump every time they needed to know where something was.
+`TenantPlacementIndex` parses it once into per-shard records plus per-node and
+per-tenant indexes, and `refresh()` skips the parse when the dump hasn't
+changed since the last one.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from typing import Any
+
+    from fixtures.neon_fixtures import NeonStorageController
+
+
+# Location modes in which the pageserver serves the shard as attached
+ATTACHED_MODES = frozenset(["AttachedSingle", "AttachedMulti", "AttachedStale"])
+
+
+@dataclass
+class ShardPlacement:
+    tenant_shard_id: str
+    intent_attached: int | None = None
+    intent_secondary: list[int] = field(default_factory=list)
+    observed_attached: int | None = None
+    observed_secondary: list[int] = field(default_factory=list)
+
+    @property
+    def tenant_id(self) -> str:
+        # Unsharded tenants' shard ids are just the tenant id, sharded ones have a -NNCC suffix
+        return self.tenant_shard_id.split("-", 1)[0]
+
+    @property
+    def attachment_matches(self) -> bool:
+        return self.intent_attached == self.observed_attached
+
+    @property
+    def secondaries_match(self) -> bool:
+        return sorted(self.intent_secondary) == sorted(self.observed_secondary)
+
+    def as_dict(self) -> dict[str, Any]:
+        """The format of `NeonStorageController.get_tenants_placement()`"""
+        return {
+            "observed": {
+                "attached": self.observed_attached,
+                "secondary": list(self.observed_secondary),
+            },
+            "intent": {
+                "attached": self.intent_attached,
+                "secondary": list(self.intent_secondary),
+            },
+        }
+
+    @classmethod
+    def from_dump(cls, shard: dict[str, Any]) -> ShardPlacement:
+        placement = cls(shard["tenant_shard_id"])
+        for node_id, loc_state in shard["observed"]["locations"].items():
+            conf = loc_state.get("conf") if loc_state is not None else None
+            if conf is None:
+                continue
+            mode = conf["mode"]
+            if mode in ATTACHED_MODES:
+                placement.observed_attached = int(node_id)
+            elif mode == "Secondary":
+                placement.observed_secondary.append(int(node_id))
+
+        intent = shard["intent"]
+        placement.intent_attached = intent.get("attached")
+        placement.intent_secondary = list(intent.get("secondary", []))
+        return placement
+
+
+class TenantPlacementIndex:
+    """
+    Placements of all tenant shards, as of the last `refresh()`:
+
+    - `shards`: tenant shard id -> placement
+    - `by_tenant`: tenant id -> placements of its shards
+    - `attached_by_node`, `secondary_by_node`: node id -> tenant shard ids observed there
+    - `intent_attached_by_node`: node id -> tenant shard ids meant to be attached there
+    - `attachment_mismatches`, `secondary_mismatches`: tenant shard ids whose observed
+      attached/secondary locations differ from the intent
+    """
+
+    def __init__(self, controller: NeonStorageController):
+        self.controller = controller
+        self.shards: dict[str, ShardPlacement] = {}
+        self.by_tenant: dict[str, list[ShardPlacement]] = {}
+        self.attached_by_node: dict[int, set[str]] = {}
+        self.secondary_by_node: dict[int, set[str]] = {}
+        self.intent_attached_by_node: dict[int, set[str]] = {}
+        self.attachment_mismatches: set[str] = set()
+        self.secondary_mismatches: set[str] = set()
+        self._digest: bytes | None = None
+
+    def refresh(self) -> bool:
+        """
+        Fetch the storage controller's tenant dump and rebuild the index if it changed.
+        Returns whether anything changed.
+        """
+        return self.update(self.controller.tenant_shard_dump_raw())
+
+    def update(self, dump: bytes) -> bool:
+        """
+        Rebuild the index from the raw body of the storage controller's tenant dump,
+        unless it is the same as last time. Returns whether anything changed.
+        """
+        digest = hashlib.blake2b(dump, digest_size=16).digest()
+        if digest == self._digest:
+            return False
+        self._build(json.loads(dump))
+        self._digest = digest
+        return True
+
+    def _build(self, dump: list[dict[str, Any]]):
+        shards = {}
+        by_tenant: defaultdict[str, list[ShardPlacement]] = defaultdict(list)
+        attached_by_node: defaultdict[int, set[str]] = defaultdict(set)
+        secondary_by_node: defaultdict[int, set[str]] = defaultdict(set)
+        intent_attached_by_node: defaultdict[int, set[str]] = defaultdict(set)
+        attachment_mismatches = set()
+        secondary_mismatches = set()
+
+        for shard in dump:
+            placement = ShardPlacement.from_dump(shard)
+            tsid = placement.tenant_shard_id
+            shards[tsid] = placement
+            by_tenant[placement.tenant_id].append(placement)
+            if placement.observed_attached is not None:
+                attached_by_node[placement.observed_attached].add(tsid)
+            for node_id in placement.observed_secondary:
+                secondary_by_node[node_id].add(tsid)
+            if placement.intent_attached is not None:
+                intent_attached_by_node[placement.intent_attached].add(tsid)
+            if not placement.attachment_matches:
+                attachment_mismatches.add(tsid)
+            if not placement.secondaries_match:
+                secondary_mismatches.add(tsid)
+
+        self.shards = shards
+        self.by_tenant = dict(by_tenant)
+        self.attached_by_node = dict(attached_by_node)
+        self.secondary_by_node = dict(secondary_by_node)
+        self.intent_attached_by_node = dict(intent_attached_by_node)
+        self.attachment_mismatches = attachment_mismatches
+        self.secondary_mismatches = secondary_mismatches
+
+    def consistent_attached_counts(self) -> dict[int, int]:
+        """
+        Number of shards attached to each node, counting only the shards whose observed
+        attachment matches the intent. Nodes without such shards are omitted.
+        """
+        counts = {}
+        for node_id, tsids in self.attached_by_node.items():
+            count = len(tsids - self.attachment_mismatches)
+            if count > 0:
+                counts[node_id] = count
+        return counts
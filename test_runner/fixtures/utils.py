@@ -12,25 +12,23 @@ import time
 from collections.abc import Callable, Iterable
 from datetime import datetime, timedelta
 from hashlib import sha256
-from pathlib import Path
 from typing import TYPE_CHECKING, Any, TypeVar
 from urllib.parse import urlencode
 
 import allure
 import pytest
-import zstandard
 from typing_extensions import override
 
+from fixtures.artifacts import ArtifactPacker
 from fixtures.common_types import Id, Lsn
 from fixtures.log_helper import log
-from fixtures.pageserver.common_types import (
-    parse_delta_layer,
-    parse_image_layer,
-)
+from fixtures.pageserver.allowed_errors import scan_log_file_for_errors
+from fixtures.pageserver.common_types import is_layer_file_name
 from fixtures.pg_version import PgVersion
 
 if TYPE_CHECKING:
     from collections.abc import Iterable
+    from pathlib import Path
     from typing import IO
 
     from psycopg2.extensions import cursor
@@ -78,13 +76,15 @@ def subprocess_capture(
     capture_stdout: bool = False,
     timeout: float | None = None,
     with_command_header: bool = True,
+    stderr_line_handler: Callable[[str], None] | None = None,
     **popen_kwargs: Any,
 ) -> tuple[str, str | None, int]:
     """Run a process and bifurcate its output to files and the `log` logger
 
     stderr and stdout are always captured in files.  They are also optionally
     echoed to the log (echo_stderr, echo_stdout), and/or captured and returned
-    (capture_stdout).
+    (capture_stdout). `stderr_line_handler` is called with every line of stderr
+    as it arrives, e.g. to follow the progress of a long-running command.
 
     File output will go to files named "cmd_NNN.stdout" and "cmd_NNN.stderr"
     where "cmd" is the name of the program and NNN is an incrementing
@@ -106,12 +106,20 @@ def subprocess_capture(
 
     # Since we will stream stdout and stderr concurrently, need to do it in a thread.
     class OutputHandler(threading.Thread):
-        def __init__(self, in_file, out_file, echo: bool, capture: bool):
+        def __init__(
+            self,
+            in_file,
+            out_file,
+            echo: bool,
+            capture: bool,
+            line_handler: Callable[[str], None] | None = None,
+        ):
             super().__init__()
             self.in_file = in_file
             self.out_file = out_file
             self.echo = echo
             self.capture = capture
+            self.line_handler = line_handler
             self.captured = ""
 
         @override
@@ -128,9 +136,12 @@ def subprocess_capture(
                     self.out_file.write((f"# {' '.join(cmd)}\n\n").encode())
 
                 # Only bother decoding if we are going to do something more than stream to a file
-                if self.echo or self.capture:
+                if self.echo or self.capture or self.line_handler is not None:
                     string = line.decode(encoding="utf-8", errors="replace")
 
+                    if self.line_handler is not None:
+                        self.line_handler(string)
+
                     if self.echo:
                         log.info(string.strip())
 
@@ -155,7 +166,13 @@ def subprocess_capture(
                     p.stdout, stdout_f, echo=echo_stdout, capture=capture_stdout
                 )
                 stdout_handler.start()
-                stderr_handler = OutputHandler(p.stderr, stderr_f, echo=echo_stderr, capture=False)
+                stderr_handler = OutputHandler(
+                    p.stderr,
+                    stderr_f,
+                    echo=echo_stderr,
+                    capture=False,
+                    line_handler=stderr_line_handler,
+                )
                 stderr_handler.start()
 
                 r = p.wait(timeout=timeout)
@@ -217,6 +234,18 @@ def query_scalar(cur: cursor, query: str) -> Any:
     return var[0]
 
 
+def write_json_atomic(path: str | Path, data: Any):
+    """
+    Write `data` as JSON to `path` through a temporary file and a rename, so that
+    concurrent readers (e.g. neon_local, which loads every endpoint's config on
+    each invocation) never see a partially written file.
+    """
+    tmp_path = f"{path}.___temp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=4)
+    os.replace(tmp_path, path)
+
+
 # Traverse directory to get total size.
 def get_dir_size(path: Path) -> int:
     """Return size in bytes."""
@@ -235,16 +264,9 @@ def get_timeline_dir_size(path: Path) -> int:
     """Get the timeline directory's total size, which only counts the layer files' size."""
     sz = 0
     for dir_entry in path.iterdir():
-        with contextlib.suppress(Exception):
-            # file is an image layer
-            _ = parse_image_layer(dir_entry.name)
-            sz += dir_entry.stat().st_size
-            continue
-
-        with contextlib.suppress(Exception):
-            # file is a delta layer
-            _ = parse_delta_layer(dir_entry.name)
-            sz += dir_entry.stat().st_size
+        if is_layer_file_name(dir_entry.name):
+            with contextlib.suppress(FileNotFoundError):
+                sz += dir_entry.stat().st_size
     return sz
 
 
@@ -263,53 +285,12 @@ ATTACHMENT_NAME_REGEX: re.Pattern[str] = re.compile(
 
 
 def allure_attach_from_dir(dir: Path, preserve_database_files: bool = False):
-    """Attach all non-empty files from `dir` that matches `ATTACHMENT_NAME_REGEX` to Allure report"""
-
-    if preserve_database_files:
-        zst_file = dir.with_suffix(".tar.zst")
-        with zst_file.open("wb") as zst:
-            cctx = zstandard.ZstdCompressor()
-            with cctx.stream_writer(zst) as compressor:
-                with tarfile.open(fileobj=compressor, mode="w") as tar:
-                    tar.add(dir, arcname="")
-        allure.attach.file(zst_file, "everything.tar.zst", "application/zstd", "tar.zst")
-
-    for attachment in Path(dir).glob("**/*"):
-        if ATTACHMENT_NAME_REGEX.fullmatch(attachment.name) and attachment.stat().st_size > 0:
-            name = str(attachment.relative_to(dir))
-
-            # compress files that are larger than 1Mb, they're hardly readable in a browser
-            if attachment.stat().st_size > 1024**2:
-                compressed = attachment.with_suffix(".zst")
-
-                cctx = zstandard.ZstdCompressor()
-                with attachment.open("rb") as fin, compressed.open("wb") as fout:
-                    cctx.copy_stream(fin, fout)
-
-                name = f"{name}.zst"
-                attachment = compressed
-
-            source = str(attachment)
-            if source.endswith(".gz"):
-                attachment_type = "application/gzip"
-                extension = "gz"
-            elif source.endswith(".zst"):
-                attachment_type = "application/zstd"
-                extension = "zst"
-            elif source.endswith(".svg"):
-                attachment_type = "image/svg+xml"
-                extension = "svg"
-            elif source.endswith(".html"):
-                attachment_type = "text/html"
-                extension = "html"
-            elif source.endswith(".walredo"):
-                attachment_type = "application/octet-stream"
-                extension = "walredo"
-            else:
-                attachment_type = "text/plain"
-                extension = attachment.suffix.removeprefix(".")
-
-            allure.attach.file(source, name, attachment_type, extension)
+    """
+    Attach all non-empty files from `dir` that matches `ATTACHMENT_NAME_REGEX` to Allure report,
+    and with `preserve_database_files` a tarball of the whole of `dir`. See `fixtures.artifacts`
+    for details.
+    """
+    ArtifactPacker().attach_dir(dir, ATTACHMENT_NAME_REGEX, preserve_database_files)
 
 
 GRAFANA_URL = "https://neonprod.grafana.net"
@@ -473,42 +454,12 @@ def humantime_to_ms(humantime: str) -> float:
     return round(total_ms, 3)
 
 
-def scan_log_for_errors(input: Iterable[str], allowed_errors: list[str]) -> list[tuple[int, str]]:
-    # FIXME: this duplicates test_runner/fixtures/pageserver/allowed_errors.py
-    error_or_warn = re.compile(r"\s(ERROR|WARN)")
-    errors: list[tuple[int, str]] = []
-    for lineno, line in enumerate(input, start=1):
-        if len(line) == 0:
-            continue
-
-        if error_or_warn.search(line):
-            # Is this a torn log line?  This happens when force-killing a process and restarting
-            # Example: "2023-10-25T09:38:31.752314Z  WARN deletion executo2023-10-25T09:38:31.875947Z  INFO version: git-env:0f9452f76e8ccdfc88291bccb3f53e3016f40192"
-            if re.match("\\d{4}-\\d{2}-\\d{2}T.+\\d{4}-\\d{2}-\\d{2}T.+INFO version.+", line):
-                continue
-
-            # It's an ERROR or WARN. Is it in the allow-list?
-            for a in allowed_errors:
-                try:
-                    if re.match(a, line):
-                        break
-                # We can switch `re.error` with `re.PatternError` after 3.13
-                # https://docs.python.org/3/library/re.html#re.PatternError
-                except re.error:
-                    log.error(f"Invalid regex: '{a}'")
-                    raise
-            else:
-                errors.append((lineno, line))
-    return errors
-
-
 def assert_no_errors(log_file: Path, service: str, allowed_errors: list[str]):
     if not log_file.exists():
         log.warning(f"Skipping {service} log check: {log_file} does not exist")
         return
 
-    with log_file.open("r") as f:
-        errors = scan_log_for_errors(f, allowed_errors)
+    errors = scan_log_file_for_errors(log_file, allowed_errors)
 
     for _lineno, error in errors:
         log.info(f"not allowed {service} error: {error.strip()}")
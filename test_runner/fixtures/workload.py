@@ -7,20 +7,30 @@ from fixtures.log_helper import log
 from fixtures.neon_fixtures import (
     Endpoint,
     NeonEnv,
-    last_flush_lsn_upload,
-    tenant_get_shards,
-    wait_for_last_flush_lsn,
+    wait_for_ingest_and_upload,
 )
-from fixtures.pageserver.utils import wait_for_last_record_lsn
 
 if TYPE_CHECKING:
     from typing import Any
 
-    from fixtures.common_types import TenantId, TimelineId
+    from fixtures.common_types import Lsn, TenantId, TimelineId
 
-# neon_local doesn't handle creating/modifying endpoints concurrently, so we use a mutex
-# to ensure we don't do that: this enables running lots of Workloads in parallel safely.
-ENDPOINT_LOCK = threading.Lock()
+# neon_local serializes its own invocations with a flock on the repo dir, so its config
+# writes are safe, but a create/start/reconfigure sequence on one endpoint is not atomic.
+# `endpoint reconfigure` only takes the flock shared, so reconfigures run concurrently.
+# Each endpoint gets its own mutex, so that Workloads for different tenants can run in
+# parallel, while two Workloads on the same timeline (which share an endpoint id) can't
+# interleave their operations on it.
+_ENDPOINT_LOCKS: dict[str, threading.Lock] = {}
+_ENDPOINT_LOCKS_LOCK = threading.Lock()
+
+
+def endpoint_lock(endpoint_id: str) -> threading.Lock:
+    with _ENDPOINT_LOCKS_LOCK:
+        lock = _ENDPOINT_LOCKS.get(endpoint_id)
+        if lock is None:
+            lock = _ENDPOINT_LOCKS[endpoint_id] = threading.Lock()
+        return lock
 
 
 class Workload:
@@ -77,21 +87,23 @@ class Workload:
         Request the endpoint to reconfigure based on location reported by storage controller
         """
         if self._endpoint is not None:
-            with ENDPOINT_LOCK:
+            with endpoint_lock(self.endpoint_id):
                 self._endpoint.reconfigure()
 
-    def endpoint(self, pageserver_id: int | None = None) -> Endpoint:
+    @property
+    def endpoint_id(self) -> str:
         # We may be running alongside other Workloads for different tenants.  Full TTID is
         # obnoxiously long for use here, but a cut-down version is still unique enough for tests.
-        endpoint_id = f"ep-workload-{str(self.tenant_id)[0:4]}-{str(self.timeline_id)[0:4]}"
+        return f"ep-workload-{str(self.tenant_id)[0:4]}-{str(self.timeline_id)[0:4]}"
 
-        with ENDPOINT_LOCK:
+    def endpoint(self, pageserver_id: int | None = None) -> Endpoint:
+        with endpoint_lock(self.endpoint_id):
             if self._endpoint is None:
                 self._endpoint = self.env.endpoints.create(
                     self.branch_name,
                     tenant_id=self.tenant_id,
                     pageserver_id=pageserver_id,
-                    endpoint_id=endpoint_id,
+                    endpoint_id=self.endpoint_id,
                     **self._endpoint_opts,
                 )
                 self._endpoint.start(pageserver_id=pageserver_id)
@@ -123,9 +135,7 @@ class Workload:
             endpoint.safe_psql(f"DROP TABLE IF EXISTS {self.table};")
         endpoint.safe_psql(f"CREATE TABLE {self.table} (id INTEGER PRIMARY KEY, val text);")
         endpoint.safe_psql("CREATE EXTENSION IF NOT EXISTS neon_test_utils;")
-        last_flush_lsn_upload(
-            self.env, endpoint, self.tenant_id, self.timeline_id, pageserver_id=pageserver_id
-        )
+        self.wait_for_ingest(pageserver_id)
 
     def write_rows(self, n: int, pageserver_id: int | None = None, upload: bool = True):
         endpoint = self.endpoint(pageserver_id)
@@ -143,9 +153,7 @@ class Workload:
         )
 
         if upload:
-            return last_flush_lsn_upload(
-                self.env, endpoint, self.tenant_id, self.timeline_id, pageserver_id=pageserver_id
-            )
+            return self.wait_for_ingest(pageserver_id)
         else:
             return False
 
@@ -190,30 +198,28 @@ class Workload:
             )
 
         if ingest:
-            # Wait for written data to be ingested by the pageserver
-            for tenant_shard_id, pageserver in tenant_get_shards(
-                self.env, self.tenant_id, pageserver_id
-            ):
-                last_flush_lsn = wait_for_last_flush_lsn(
-                    self.env,
-                    endpoint,
-                    self.tenant_id,
-                    self.timeline_id,
-                    pageserver_id=pageserver_id,
-                )
-                ps_http = pageserver.http_client()
-                wait_for_last_record_lsn(ps_http, tenant_shard_id, self.timeline_id, last_flush_lsn)
-
-                if upload:
-                    # Wait for written data to be uploaded to S3 (force a checkpoint to trigger upload)
-                    ps_http.timeline_checkpoint(
-                        tenant_shard_id,
-                        self.timeline_id,
-                        wait_until_uploaded=True,
-                    )
-                    log.info(f"Churn: waiting for remote LSN {last_flush_lsn}")
-                else:
-                    log.info(f"Churn: not waiting for upload, disk LSN {last_flush_lsn}")
+            # Wait for written data to be ingested by the pageserver, and if `upload`,
+            # to be uploaded to S3 (force a checkpoint to trigger upload)
+            last_flush_lsn = self.wait_for_ingest(pageserver_id, upload=upload)
+            if upload:
+                log.info(f"Churn: waited for remote LSN {last_flush_lsn}")
+            else:
+                log.info(f"Churn: not waiting for upload, disk LSN {last_flush_lsn}")
+
+    def wait_for_ingest(self, pageserver_id: int | None = None, upload: bool = True) -> Lsn:
+        """
+        Wait for all shards to ingest everything the endpoint has written so far and, if
+        `upload`, to checkpoint it and upload it to remote storage.
+        """
+        endpoint = self._endpoint or self.endpoint(pageserver_id)
+        return wait_for_ingest_and_upload(
+            self.env,
+            endpoint,
+            self.tenant_id,
+            self.timeline_id,
+            pageserver_id=pageserver_id,
+            checkpoint=upload,
+        )
 
     def validate(self, pageserver_id: int | None = None):
         endpoint = self.endpoint(pageserver_id)
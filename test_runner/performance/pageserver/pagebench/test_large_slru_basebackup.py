@@ -71,6 +71,7 @@ def test_basebackup_with_high_slru_count(
         f"large_slru_count-{n_tenants}-{n_txns}",
         n_tenants,
         lambda env: setup_tenant_template(env, n_txns),
+        record=record,
     )
     run_benchmark(env, pg_bin, record, duration)
 
@@ -142,6 +142,7 @@ def setup_and_run_pagebench_benchmark(
         lambda env: setup_tenant_template(env, pg_bin, pgbench_scale),
         # https://github.com/neondatabase/neon/issues/8070
         timeout_in_seconds=60,
+        record=record,
     )
 
     env.pageserver.allowed_errors.append(
@@ -7,6 +7,7 @@ from __future__ import annotations
 from typing import TYPE_CHECKING
 
 import fixtures.pageserver.many_tenants as many_tenants
+from fixtures.benchmark_fixture import MetricReport
 from fixtures.log_helper import log
 from fixtures.pageserver.utils import wait_until_all_tenants_state
 
@@ -51,15 +52,39 @@ def setup_pageserver_with_tenants(
     n_tenants: int,
     setup: Callable[[NeonEnv], tuple[TenantId, TimelineId, dict[str, Any]]],
     timeout_in_seconds: int | None = None,
+    record: Callable[..., None] | None = None,
 ) -> NeonEnv:
     """
     Utility function to set up a pageserver with a given number of identical tenants.
+
+    If `record` is given, it is called like `NeonBenchmarker.record` (minus the
+    metric name prefix) to report how long restoring the snapshot took.
     """
 
     def doit(neon_env_builder: NeonEnvBuilder) -> NeonEnv:
         return many_tenants.single_timeline(neon_env_builder, setup, n_tenants)
 
     env = neon_env_builder.build_and_use_snapshot(name, doit)
+    stats = neon_env_builder.snapshot_restore_stats
+    if record is not None and stats is not None:
+        record(
+            "snapshot_restore.duration",
+            metric_value=stats.duration,
+            unit="s",
+            report=MetricReport.LOWER_IS_BETTER,
+        )
+        record(
+            "snapshot_restore.bytes_copied",
+            metric_value=stats.bytes_copied,
+            unit="byte",
+            report=MetricReport.LOWER_IS_BETTER,
+        )
+        record(
+            "snapshot_restore.bytes_linked",
+            metric_value=stats.bytes_linked,
+            unit="byte",
+            report=MetricReport.TEST_PARAM,
+        )
     env.start(timeout_in_seconds=timeout_in_seconds)
     ensure_pageserver_ready_for_benchmarking(env, n_tenants)
     return env
@@ -1,74 +1,261 @@
 from __future__ import annotations
 
-import sys
+import argparse
+import io
+import os
+import struct
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 
 import numpy as np  # type: ignore [import]
-import pandas as pd  # type: ignore [import]
 import psycopg2
-from pgvector.psycopg2 import register_vector  # type: ignore [import]
-from psycopg2.extras import execute_values
+import pyarrow.parquet as pq  # type: ignore [import]
 
+"""
+Loads the dbpedia-entities-openai3-text-embedding-3-large-1536-1M parquet files
+(see README.md) into the `documents` table.
 
-def print_usage():
-    print("Usage: loaddata.py <CONNSTR> <DATADIR>")
+The parquet files are streamed in record batches with pyarrow and encoded
+straight into `COPY ... FROM STDIN (FORMAT binary)` data: the embeddings of a
+whole batch are converted to big-endian float4 in one numpy operation, and
+each row's vector field is a slice of that buffer. Row groups are loaded in
+parallel over `--jobs` connections, one per worker process.
 
+Optionally builds the indexes of one of the benchmarks afterwards.
+"""
 
-def main(conn_str, directory_path):
-    # Connection to PostgreSQL
+ID_COLUMN = "_id"
+TITLE_COLUMN = "title"
+TEXT_COLUMN = "text"
+EMBEDDING_COLUMN = "text-embedding-3-large-1536-embedding"
+DIMENSIONS = 1536
+
+COPY_SQL = "COPY documents (_id, title, text, embeddings) FROM STDIN (FORMAT binary)"
+
+# Binary COPY framing, see https://www.postgresql.org/docs/current/sql-copy.html
+COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+COPY_TRAILER = struct.pack(">h", -1)
+TUPLE_HEADER = struct.pack(">h", 4)
+NULL_FIELD = struct.pack(">i", -1)
+
+# pgvector's binary format (vector_send): int16 dimensions, int16 unused, float4[dimensions]
+VECTOR_FIELD_HEADER = struct.pack(">ihh", 4 + 4 * DIMENSIONS, DIMENSIONS, 0)
+
+# Rows per record batch read from parquet
+DEFAULT_BATCH_SIZE = 2000
+
+# Chunk size in which psycopg2 sends COPY data
+COPY_CHUNK_SIZE = 1 << 20
+
+INDEX_BUILD_SCRIPTS = {
+    "hnsw": "HNSW_build.sql",
+    "ivfflat": "IVFFLAT_build.sql",
+    "halfvec": "halfvec_build.sql",
+}
+
+
+def encode_vectors(embeddings) -> memoryview:
+    """
+    Encode the list<double> embeddings column of a record batch as pgvector
+    binary COPY fields, including the field length. Returns one buffer with a
+    fixed-size field per row.
+    """
+    assert embeddings.null_count == 0
+    n = len(embeddings)
+    flat = embeddings.flatten().to_numpy(zero_copy_only=False)
+    assert len(flat) == n * DIMENSIONS, "embeddings must all have the same dimensions"
+
+    fields = np.empty((n, len(VECTOR_FIELD_HEADER) + 4 * DIMENSIONS), dtype=np.uint8)
+    fields[:, : len(VECTOR_FIELD_HEADER)] = np.frombuffer(VECTOR_FIELD_HEADER, dtype=np.uint8)
+    fields[:, len(VECTOR_FIELD_HEADER) :] = (
+        flat.astype(">f4", copy=False).reshape(n, DIMENSIONS).view(np.uint8)
+    )
+    return memoryview(fields.reshape(-1))
+
+
+def encode_text(values: list[str | None]) -> list[bytes]:
+    """Encode a text column as binary COPY fields, including the field length"""
+    fields = []
+    for v in values:
+        if v is None:
+            fields.append(NULL_FIELD)
+        else:
+            b = v.encode()
+            fields.append(struct.pack(">i", len(b)) + b)
+    return fields
+
+
+def encode_batch(batch) -> bytes:
+    """Encode a record batch as binary COPY tuples"""
+    ids = encode_text(batch.column(ID_COLUMN).to_pylist())
+    titles = encode_text(batch.column(TITLE_COLUMN).to_pylist())
+    texts = encode_text(batch.column(TEXT_COLUMN).to_pylist())
+    vectors = encode_vectors(batch.column(EMBEDDING_COLUMN))
+    width = len(vectors) // max(batch.num_rows, 1)
+
+    parts: list[bytes | memoryview] = []
+    for i in range(batch.num_rows):
+        parts += (TUPLE_HEADER, ids[i], titles[i], texts[i], vectors[i * width : (i + 1) * width])
+    return b"".join(parts)
+
+
+class CopyStream(io.RawIOBase):
+    """A file-like object that psycopg2's copy_expert() reads encoded record batches from"""
+
+    def __init__(self, path: Path, row_group: int, batch_size: int):
+        self.batches = pq.ParquetFile(path).iter_batches(
+            batch_size=batch_size,
+            row_groups=[row_group],
+            columns=[ID_COLUMN, TITLE_COLUMN, TEXT_COLUMN, EMBEDDING_COLUMN],
+        )
+        self.buf = memoryview(COPY_HEADER)
+        self.done = False
+        self.rows = 0
+        self.bytes = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        while len(self.buf) == 0 and not self.done:
+            batch = next(self.batches, None)
+            if batch is None:
+                self.buf = memoryview(COPY_TRAILER)
+                self.done = True
+            else:
+                self.buf = memoryview(encode_batch(batch))
+                self.rows += batch.num_rows
+        if size < 0:
+            size = len(self.buf)
+        chunk = self.buf[:size].tobytes()
+        self.buf = self.buf[size:]
+        self.bytes += len(chunk)
+        return chunk
+
+
+# The connection of a worker process
+_conn = None
+
+
+def init_worker(conn_str: str):
+    global _conn
+    _conn = psycopg2.connect(conn_str)
+
+
+def load_row_group(path: Path, row_group: int, batch_size: int) -> tuple[int, int]:
+    """COPY one row group of a parquet file, returns (rows, bytes) loaded"""
+    assert _conn is not None
+    stream = CopyStream(path, row_group, batch_size)
+    with _conn.cursor() as cur:
+        cur.copy_expert(COPY_SQL, stream, size=COPY_CHUNK_SIZE)
+    _conn.commit()
+    return stream.rows, stream.bytes
+
+
+def create_table(conn_str: str):
     with psycopg2.connect(conn_str) as conn:
         with conn.cursor() as cursor:
-            # Run SQL statements
             cursor.execute("CREATE EXTENSION IF NOT EXISTS vector;")
-            register_vector(conn)
             cursor.execute("DROP TABLE IF EXISTS documents;")
+            # The primary key is added after loading, which is faster than
+            # maintaining the index during the load.
             cursor.execute(
                 """
                 CREATE TABLE documents (
-                    _id TEXT PRIMARY KEY,
+                    _id TEXT NOT NULL,
                     title TEXT,
                     text TEXT,
                     embeddings vector(1536) -- text-embedding-3-large-1536-embedding (OpenAI)
                 );
             """
             )
-            conn.commit()
-
-            # List and sort Parquet files
-            parquet_files = sorted(Path(directory_path).glob("*.parquet"))
-
-            for file in parquet_files:
-                print(f"Loading {file} into PostgreSQL")
-                df = pd.read_parquet(file)
-
-                print(df.head())
-
-                data_list = [
-                    (
-                        row["_id"],
-                        row["title"],
-                        row["text"],
-                        np.array(row["text-embedding-3-large-1536-embedding"]),
-                    )
-                    for index, row in df.iterrows()
-                ]
-                # Use execute_values to perform batch insertion
-                execute_values(
-                    cursor,
-                    "INSERT INTO documents (_id, title, text, embeddings) VALUES %s",
-                    data_list,
-                )
-                # Commit after we insert all embeddings
-                conn.commit()
-
-                print(f"Loaded {file} into PostgreSQL")
+
+
+def add_primary_key(conn_str: str):
+    with psycopg2.connect(conn_str) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("ALTER TABLE documents ADD PRIMARY KEY (_id);")
+
+
+def build_index(conn_str: str, kind: str):
+    script = Path(__file__).parent / INDEX_BUILD_SCRIPTS[kind]
+    print(f"Building {kind} indexes with {script}")
+    started_at = time.monotonic()
+    subprocess.run(["psql", conn_str, "-v", "ON_ERROR_STOP=1", "-f", str(script)], check=True)
+    print(f"Built {kind} indexes in {time.monotonic() - started_at:.1f}s")
+
+
+def main(conn_str: str, directory_path: str, jobs: int, batch_size: int, index: str | None):
+    create_table(conn_str)
+
+    # List and sort Parquet files
+    parquet_files = sorted(Path(directory_path).glob("*.parquet"))
+    work = [
+        (file, row_group)
+        for file in parquet_files
+        for row_group in range(pq.ParquetFile(file).num_row_groups)
+    ]
+    print(f"Loading {len(work)} row groups of {len(parquet_files)} files over {jobs} connections")
+
+    total_rows = 0
+    total_bytes = 0
+    started_at = time.monotonic()
+    with ProcessPoolExecutor(
+        max_workers=jobs, initializer=init_worker, initargs=(conn_str,)
+    ) as executor:
+        futures = {
+            executor.submit(load_row_group, file, row_group, batch_size): (file, row_group)
+            for file, row_group in work
+        }
+        for fut in as_completed(futures):
+            file, row_group = futures[fut]
+            rows, nbytes = fut.result()
+            total_rows += rows
+            total_bytes += nbytes
+            elapsed = time.monotonic() - started_at
+            print(
+                f"Loaded row group {row_group} of {file.name}: {rows} rows; "
+                f"total {total_rows} rows, {total_rows / elapsed:.0f} rows/s, "
+                f"{total_bytes / elapsed / 1e6:.1f} MB/s"
+            )
+
+    elapsed = time.monotonic() - started_at
+    print(
+        f"Loaded {total_rows} rows ({total_bytes / 1e6:.1f} MB) in {elapsed:.1f}s: "
+        f"{total_rows / elapsed:.0f} rows/s, {total_bytes / elapsed / 1e6:.1f} MB/s"
+    )
+
+    started_at = time.monotonic()
+    add_primary_key(conn_str)
+    print(f"Added primary key in {time.monotonic() - started_at:.1f}s")
+
+    if index is not None:
+        build_index(conn_str, index)
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print_usage()
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Load the pgvector dataset into PostgreSQL")
+    parser.add_argument("conn_str", metavar="CONNSTR")
+    parser.add_argument("directory_path", metavar="DATADIR")
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=min(os.cpu_count() or 1, 8),
+        help="number of parallel connections",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help="rows per parquet record batch",
+    )
+    parser.add_argument(
+        "--build-index",
+        choices=sorted(INDEX_BUILD_SCRIPTS),
+        help="build the indexes of a benchmark after loading",
+    )
+    args = parser.parse_args()
 
-    conn_str = sys.argv[1]
-    directory_path = sys.argv[2]
-    main(conn_str, directory_path)
+    main(args.conn_str, args.directory_path, args.jobs, args.batch_size, args.build_index)
@@ -3,6 +3,7 @@ from __future__ import annotations
 import calendar
 import enum
 import os
+import time
 import timeit
 from datetime import datetime
 from pathlib import Path
@@ -10,12 +11,17 @@ from typing import TYPE_CHECKING
 
 import pytest
 from fixtures.benchmark_fixture import MetricReport, PgBenchInitResult, PgBenchRunResult
+from fixtures.pgbench_series import PgBenchSeriesCollector
 from fixtures.utils import get_scale_for_db
 
 if TYPE_CHECKING:
     from fixtures.compare_fixtures import PgCompare
 
 
+# Fraction of transactions that pgbench writes to its per-transaction log
+PGBENCH_LOG_SAMPLING_RATE = 0.01
+
+
 @enum.unique
 class PgBenchLoadType(enum.Enum):
     INIT = "init"
@@ -62,11 +68,27 @@ def run_pgbench(env: PgCompare, prefix: str, cmdline, password: None):
     if password is not None:
         environ["PGPASSWORD"] = password
 
+    # Follow the progress reports, and a sample of the per-transaction log, to
+    # see how stable throughput and latency were during the run.
+    log_prefix = f"pgbench_{prefix}_{utc_now_timestamp()}"
+    cmdline = [
+        cmdline[0],
+        "--log",
+        f"--log-prefix={env.pg_bin.log_dir / log_prefix}",
+        f"--sampling-rate={PGBENCH_LOG_SAMPLING_RATE}",
+        *cmdline[1:],
+    ]
+
     with env.record_pageserver_writes(f"{prefix}.pageserver_writes"):
         run_start_timestamp = utc_now_timestamp()
-        t0 = timeit.default_timer()
-        out = env.pg_bin.run_capture(cmdline, env=environ)
-        run_duration = timeit.default_timer() - t0
+        with PgBenchSeriesCollector(
+            time.time(), env.pg_bin.log_dir, log_prefix
+        ) as series_collector:
+            t0 = timeit.default_timer()
+            out = env.pg_bin.run_capture(
+                cmdline, env=environ, stderr_line_handler=series_collector.feed_progress_line
+            )
+            run_duration = timeit.default_timer() - t0
         run_end_timestamp = utc_now_timestamp()
         env.flush()
 
@@ -79,6 +101,7 @@ def run_pgbench(env: PgCompare, prefix: str, cmdline, password: None):
         run_end_timestamp=run_end_timestamp,
     )
     env.zenbenchmark.record_pg_bench_result(prefix, res)
+    env.zenbenchmark.record_pg_bench_series(prefix, series_collector.series)
 
 
 #
@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+import asyncio
+from typing import TYPE_CHECKING
+
+import pytest
+from fixtures.proxy_load import ProxyLoadGenerator, ProxyPoolStats, ProxyProtocol
+
+if TYPE_CHECKING:
+    from fixtures.benchmark_fixture import NeonBenchmarker
+    from fixtures.neon_fixtures import NeonProxy
+
+
+# Measure the throughput and latency of simple queries through the proxy's SQL-over-HTTP
+# and websocket endpoints, over persistent connections. rate=None runs closed-loop with
+# `concurrency` requests in flight, otherwise requests are started at `rate` per second.
+@pytest.mark.parametrize("protocol", list(ProxyProtocol))
+@pytest.mark.parametrize("concurrency", [1, 16])
+@pytest.mark.parametrize("rate", [None, 200])
+def test_proxy_load(
+    static_proxy: NeonProxy,
+    zenbenchmark: NeonBenchmarker,
+    protocol: ProxyProtocol,
+    concurrency: int,
+    rate: int | None,
+):
+    static_proxy.safe_psql("create user load_test with password 'load_test' superuser")
+    generator = ProxyLoadGenerator(static_proxy, "load_test", "load_test")
+
+    asyncio.run(
+        generator.measure_connect_overhead(
+            tcp=zenbenchmark.histogram("proxy_load.tcp_connect", unit="us"),
+            tls=zenbenchmark.histogram("proxy_load.tls_handshake", unit="us"),
+        )
+    )
+
+    # Warm up the proxy's caches and connection pool
+    asyncio.run(generator.run(protocol, "select 1", duration=2, concurrency=concurrency))
+
+    before = generator.metrics()
+    result = asyncio.run(
+        generator.run(protocol, "select 1", duration=20, concurrency=concurrency, rate=rate)
+    )
+    after = generator.metrics()
+
+    assert result.requests > 0
+    result.record(zenbenchmark, "proxy_load")
+    ProxyPoolStats.from_metrics(after.diff(before)).record(zenbenchmark, "proxy_load")
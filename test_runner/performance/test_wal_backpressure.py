@@ -268,6 +268,7 @@ def record_read_latency(
     env: PgCompare, run_cond: Callable[[], bool], read_query: str, read_interval: float = 1.0
 ):
     read_latencies = []
+    read_latency_hist = env.zenbenchmark.histogram("read_latency", unit="s")
 
     with env.pg.connect().cursor() as cur:
         while run_cond():
@@ -280,6 +281,7 @@ def record_read_latency(
                     f"Executed read query {read_query}, got {cur.fetchall()}, read time {t2 - t1:.2f}s"
                 )
                 read_latencies.append(t2 - t1)
+                read_latency_hist.record(t2 - t1)
             except Exception as err:
                 log.error(f"Got error when executing the read query: {err}")
 
@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import pytest
+from fixtures.common_types import KEY_MAX, KEY_MIN, Key, Lsn
+from fixtures.pageserver.common_types import (
+    DeltaLayerName,
+    ImageLayerName,
+    InvalidFileName,
+    LayerCollection,
+    is_layer_file_name,
+    local_layer_file_name,
+    parse_layer_file_name,
+)
+from fixtures.utils import run_only_on_default_postgres, skip_in_debug_build
+
+IMAGE = (
+    "000000000000000000000000000000000000-000000067F00004005000060F30003800000__0000000001696070"
+)
+DELTA = "000000000000000000000000000000000000-FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF__000000000169607A-0000000001A57A61"
+
+
+@run_only_on_default_postgres(reason="does not use postgres")
+@skip_in_debug_build("unit test for test support, either build works")
+def test_parse_layer_file_name_roundtrip():
+    image = parse_layer_file_name(IMAGE)
+    assert image == ImageLayerName(
+        lsn=Lsn(0x1696070),
+        key_start=KEY_MIN,
+        key_end=Key(0x000000067F00004005000060F30003800000),
+    )
+    assert image.to_str() == IMAGE
+
+    delta = parse_layer_file_name(DELTA)
+    assert delta == DeltaLayerName(
+        lsn_start=Lsn(0x169607A), lsn_end=Lsn(0x1A57A61), key_start=KEY_MIN, key_end=KEY_MAX
+    )
+    assert isinstance(delta, DeltaLayerName) and delta.is_l0()
+    assert delta.to_str() == DELTA
+
+    for name in [IMAGE, DELTA]:
+        # Local layer files of a generation have a "-v1-{generation:08x}" suffix
+        local = f"{name}-v1-00000002"
+        assert is_layer_file_name(local)
+        assert parse_layer_file_name(local).to_str() == name
+
+
+@run_only_on_default_postgres(reason="does not use postgres")
+@skip_in_debug_build("unit test for test support, either build works")
+def test_local_layer_file_name():
+    for name in [IMAGE, DELTA]:
+        # Layers in remote storage have a "-{generation:08x}" suffix
+        assert local_layer_file_name(f"{name}-00000002") == name
+        assert local_layer_file_name(name) == name
+        assert local_layer_file_name(f"{name}-v1-00000002") == name
+        # Remote names aren't local layer file names
+        assert not is_layer_file_name(f"{name}-00000002")
+
+    for not_a_layer in ["index_part.json-00000002", f"{IMAGE}-0000002", f"{IMAGE}.___temp"]:
+        with pytest.raises(InvalidFileName):
+            local_layer_file_name(not_a_layer)
+        with pytest.raises(InvalidFileName):
+            parse_layer_file_name(not_a_layer)
+
+
+@run_only_on_default_postgres(reason="does not use postgres")
+@skip_in_debug_build("unit test for test support, either build works")
+def test_layer_collection():
+    key_mid = Key(0x000000067F00004005000060F30003800000)
+    image_low = ImageLayerName(lsn=Lsn(0x20), key_start=KEY_MIN, key_end=key_mid)
+    image_high = ImageLayerName(lsn=Lsn(0x20), key_start=key_mid, key_end=KEY_MAX)
+    l0 = DeltaLayerName(lsn_start=Lsn(0x10), lsn_end=Lsn(0x20), key_start=KEY_MIN, key_end=KEY_MAX)
+    delta = DeltaLayerName(
+        lsn_start=Lsn(0x20), lsn_end=Lsn(0x30), key_start=KEY_MIN, key_end=key_mid
+    )
+
+    layers = LayerCollection([image_high.to_str(), delta, l0, image_low])
+    assert len(layers) == 4
+    assert set(layers.images()) == {image_low, image_high}
+    assert set(layers.deltas()) == {l0, delta}
+    assert layers.l0() == [l0]
+
+    # An image at LSN X covers X..X+1, delta LSN ranges are exclusive at the end
+    assert set(layers.at_lsn(Lsn(0x1F))) == {l0}
+    assert set(layers.at_lsn(Lsn(0x20))) == {image_low, image_high, delta}
+    assert set(layers.at_lsn(Lsn(0x21))) == {delta}
+
+    assert layers.covered_key_ranges(Lsn(0x20), images_only=True) == [(KEY_MIN, KEY_MAX)]
+    assert layers.covers(KEY_MIN, KEY_MAX, Lsn(0x20), images_only=True)
+    assert not layers.covers(KEY_MIN, KEY_MAX, Lsn(0x21))
+    assert layers.covers(KEY_MIN, key_mid, Lsn(0x21))
+
+    assert set(layers.overlapping(key_mid, KEY_MAX, Lsn(0x0), Lsn(0x20))) == {l0}
+    assert set(layers.overlapping(KEY_MIN, key_mid, Lsn(0x20), Lsn(0x21))) == {
+        image_low,
+        delta,
+    }
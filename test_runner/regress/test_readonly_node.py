@@ -8,7 +8,6 @@ from fixtures.common_types import Lsn, TenantId, TenantShardId, TimelineId
 from fixtures.log_helper import log
 from fixtures.neon_fixtures import (
     Endpoint,
-    LogCursor,
     NeonEnv,
     NeonEnvBuilder,
     last_flush_lsn_upload,
@@ -18,6 +17,7 @@ from fixtures.pageserver.utils import wait_for_last_record_lsn
 from fixtures.utils import query_scalar, wait_until
 
 if TYPE_CHECKING:
+    from fixtures.log_tail import LogCursor
     from fixtures.pageserver.http import PageserverHttpClient
 
 
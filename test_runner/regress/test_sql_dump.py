@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+from fixtures.sql_dump import (
+    PREAMBLE,
+    TABLE_DATA,
+    AllowedDiff,
+    DumpObjectKey,
+    SqlDump,
+    compare_dumps,
+    dump_differs,
+)
+from fixtures.utils import run_only_on_default_postgres, skip_in_debug_build
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+
+def _database(name: str, rows: list[str], function_body: str = "SELECT 1") -> str:
+    data = "".join(f"{row}\n" for row in rows)
+    return f"""\\connect {name}
+
+SET statement_timeout = 0;
+SET client_encoding = 'UTF8';
+
+--
+-- Name: f(); Type: FUNCTION; Schema: public; Owner: cloud_admin
+--
+
+CREATE FUNCTION public.f() RETURNS integer
+    LANGUAGE sql
+    AS $${function_body}$$;
+
+
+--
+-- Name: t; Type: TABLE; Schema: public; Owner: cloud_admin
+--
+
+CREATE TABLE public.t (
+    id integer,
+    val text
+);
+
+
+--
+-- Data for Name: t; Type: TABLE DATA; Schema: public; Owner: cloud_admin
+--
+
+COPY public.t (id, val) FROM stdin;
+{data}\\.
+
+
+"""
+
+
+def _dumpall(*databases: str) -> str:
+    return (
+        """--
+-- PostgreSQL database cluster dump
+--
+
+SET default_transaction_read_only = off;
+
+CREATE ROLE cloud_admin;
+
+"""
+        + "".join(databases)
+        + """--
+-- PostgreSQL database cluster dump complete
+--
+
+"""
+    )
+
+
+def _write(path: Path, text: str) -> Path:
+    path.write_text(text)
+    return path
+
+
+@run_only_on_default_postgres(reason="does not use postgres")
+@skip_in_debug_build("unit test for test support, either build works")
+def test_sql_dump_sections(test_output_dir: Path):
+    dump = SqlDump(
+        _write(
+            test_output_dir / "dump.sql",
+            _dumpall(
+                _database("postgres", ["1\ta", "2\tb"]),
+                _database("db1", ["1\ta"]),
+            ),
+        )
+    )
+
+    for database in ["postgres", "db1"]:
+        for type in ["FUNCTION", "TABLE", TABLE_DATA]:
+            name = "f()" if type == "FUNCTION" else "t"
+            assert DumpObjectKey(database, type, "public", name) in dump.sections
+        # The SETs after each \connect
+        preamble = dump.sections[DumpObjectKey(database, PREAMBLE, "", "")]
+        assert preamble.text.startswith(f"\\connect {database}\nSET statement_timeout = 0;")
+
+    # The roles before the first database
+    assert "CREATE ROLE cloud_admin;" in dump.sections[DumpObjectKey("", PREAMBLE, "", "")].text
+    assert len(dump.sections) == 9
+
+    table = dump.sections[DumpObjectKey("postgres", "TABLE", "public", "t")]
+    assert table.text == "CREATE TABLE public.t (\n    id integer,\n    val text\n);"
+    assert dump.sections[DumpObjectKey("postgres", TABLE_DATA, "public", "t")].rows == 2
+    assert dump.sections[DumpObjectKey("db1", TABLE_DATA, "public", "t")].rows == 1
+
+
+@run_only_on_default_postgres(reason="does not use postgres")
+@skip_in_debug_build("unit test for test support, either build works")
+def test_sql_dump_compare(test_output_dir: Path):
+    first = _write(
+        test_output_dir / "first.sql",
+        _dumpall(_database("postgres", ["1\ta"]), _database("db1", ["1\ta", "2\tb"])),
+    )
+    # The same objects in the same databases, with different comments and blank lines
+    same = _write(
+        test_output_dir / "same.sql",
+        _dumpall(_database("postgres", ["1\ta"]), _database("db1", ["1\ta", "2\tb"]))
+        .replace("Owner: cloud_admin\n--\n\n", "Owner: cloud_admin\n-- comment\n\n\n")
+        .replace("cluster dump complete", "cluster dump finished"),
+    )
+    # In db1, the function body and a row differ, in postgres nothing does
+    second = _write(
+        test_output_dir / "second.sql",
+        _dumpall(_database("postgres", ["1\ta"]), _database("db1", ["1\ta", "2\tc"], "SELECT 2")),
+    )
+
+    assert compare_dumps(SqlDump(first), SqlDump(same)) == []
+    assert not dump_differs(first, same, test_output_dir / "same.diff")
+
+    differences = compare_dumps(SqlDump(first), SqlDump(second))
+    assert [d.key for d in differences] == [
+        DumpObjectKey("db1", "FUNCTION", "public", "f()"),
+        DumpObjectKey("db1", TABLE_DATA, "public", "t"),
+    ]
+    assert str(differences[1]) == "TABLE DATA public.t in db1: data differs (2 rows vs 2 rows)"
+    assert "-    AS $$SELECT 1$$;\n+    AS $$SELECT 2$$;" in differences[0].diff()
+    # Table data is never diffed
+    assert differences[1].diff() == ""
+
+    output = test_output_dir / "second.diff"
+    assert dump_differs(first, second, output)
+    assert "FUNCTION public.f() in db1: definition differs" in output.read_text()
+
+    allowed = [
+        AllowedDiff(
+            type="FUNCTION",
+            name="f*",
+            expected="CREATE FUNCTION public.f() RETURNS integer\n    LANGUAGE sql\n    AS $$SELECT 2$$;",
+        ),
+        AllowedDiff(type=TABLE_DATA, name="t", database="db1"),
+    ]
+    assert compare_dumps(SqlDump(first), SqlDump(second), allowed) == []
+    # The expected text has to match
+    allowed[0] = AllowedDiff(type="FUNCTION", name="f*", expected="SELECT 3")
+    assert len(compare_dumps(SqlDump(first), SqlDump(second), allowed)) == 1
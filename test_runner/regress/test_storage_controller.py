@@ -16,7 +16,6 @@ from fixtures.common_types import TenantId, TenantShardId, TimelineId
 from fixtures.log_helper import log
 from fixtures.neon_fixtures import (
     DEFAULT_AZ_ID,
-    LogCursor,
     NeonEnv,
     NeonEnvBuilder,
     NeonPageserver,
@@ -39,7 +38,7 @@ from fixtures.pageserver.utils import (
     timeline_delete_wait_completed,
 )
 from fixtures.pg_version import PgVersion
-from fixtures.remote_storage import RemoteStorageKind, s3_storage
+from fixtures.remote_storage import RemoteStorageKind, S3Storage, s3_storage
 from fixtures.utils import (
     run_only_on_default_postgres,
     run_pg_bench_small,
@@ -55,6 +54,7 @@ if TYPE_CHECKING:
 
     from fixtures.compute_reconfigure import ComputeReconfigure
     from fixtures.httpserver import ListenAddress
+    from fixtures.log_tail import LogCursor
     from fixtures.port_distributor import PortDistributor
     from fixtures.storage_controller_proxy import StorageControllerProxy
     from mypy_boto3_s3.type_defs import (
@@ -1436,10 +1436,14 @@ def test_storage_controller_tenant_deletion(
         assert pageserver is not None
         assert pageserver.tenant_dir(shard_id).exists()
 
-    # Assert all shards have some content in remote storage
+    # Assert all shards have some content in remote storage. The shards' prefixes are
+    # all under the tenant's, so one listing serves every shard.
+    remote_storage = neon_env_builder.pageserver_remote_storage
+    assert isinstance(remote_storage, S3Storage)
+    listing = remote_storage.listing_snapshot([remote_storage.tenant_path(tenant_id)])
     for shard_id in shard_ids:
         assert_prefix_not_empty(
-            neon_env_builder.pageserver_remote_storage,
+            listing,
             prefix="/".join(
                 (
                     "tenants",
@@ -1463,9 +1467,10 @@ def test_storage_controller_tenant_deletion(
         for shard_id in shard_ids:
             assert not pageserver.tenant_dir(shard_id).exists()
 
+    listing = remote_storage.listing_snapshot([remote_storage.tenant_path(tenant_id)])
     for shard_id in shard_ids:
         assert_prefix_empty(
-            neon_env_builder.pageserver_remote_storage,
+            listing,
             prefix="/".join(
                 (
                     "tenants",
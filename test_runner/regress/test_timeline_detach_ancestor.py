@@ -8,12 +8,12 @@ from concurrent.futures import ThreadPoolExecutor
 from enum import StrEnum
 from queue import Empty, Queue
 from threading import Barrier
+from typing import TYPE_CHECKING
 
 import pytest
 from fixtures.common_types import Lsn, TimelineArchivalState, TimelineId
 from fixtures.log_helper import log
 from fixtures.neon_fixtures import (
-    LogCursor,
     NeonEnvBuilder,
     PgBin,
     flush_ep_to_pageserver,
@@ -27,6 +27,9 @@ from fixtures.utils import assert_pageserver_backups_equal, skip_in_debug_build,
 from fixtures.workload import Workload
 from requests import ReadTimeout
 
+if TYPE_CHECKING:
+    from fixtures.log_tail import LogCursor
+
 
 def by_end_lsn(info: HistoricLayerInfo) -> Lsn:
     assert info.lsn_end is not None
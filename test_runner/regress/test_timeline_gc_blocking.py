@@ -10,8 +10,8 @@ from fixtures.log_helper import log
 from fixtures.pageserver.utils import wait_timeline_detail_404
 
 if TYPE_CHECKING:
+    from fixtures.log_tail import LogCursor
     from fixtures.neon_fixtures import (
-        LogCursor,
         NeonEnvBuilder,
         NeonPageserver,
     )
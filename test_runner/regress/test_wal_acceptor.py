@@ -1,12 +1,10 @@
 from __future__ import annotations
 
-import filecmp
 import logging
 import os
 import random
 import shutil
 import signal
-import subprocess
 import sys
 import threading
 import time
@@ -50,7 +48,7 @@ from fixtures.safekeeper.http import (
     SafekeeperId,
     TimelineCreateRequest,
 )
-from fixtures.safekeeper.utils import wait_walreceivers_absent
+from fixtures.safekeeper.utils import cmp_sk_wal, wait_walreceivers_absent
 from fixtures.safekeeper_utils import (
     is_flush_lsn_caught_up,
     is_segment_offloaded,
@@ -69,6 +67,7 @@ from fixtures.utils import (
 )
 
 if TYPE_CHECKING:
+    import subprocess
     from typing import Any, Self
 
     from fixtures.port_distributor import PortDistributor
@@ -1106,59 +1105,6 @@ def is_flush_lsn_aligned(sk_http_clis, tenant_id, timeline_id):
     return all([flush_lsns[0] == flsn for flsn in flush_lsns])
 
 
-# Assert by xxd that WAL on given safekeepers is identical. No compute must be
-# running for this to be reliable.
-def cmp_sk_wal(sks: list[Safekeeper], tenant_id: TenantId, timeline_id: TimelineId):
-    assert len(sks) >= 2, "cmp_sk_wal makes sense with >= 2 safekeepers passed"
-    sk_http_clis = [sk.http_client() for sk in sks]
-
-    # First check that term / flush_lsn are the same: it is easier to
-    # report/understand if WALs are different due to that.
-    statuses = [sk_http_cli.timeline_status(tenant_id, timeline_id) for sk_http_cli in sk_http_clis]
-    term_flush_lsns = [(s.last_log_term, s.flush_lsn) for s in statuses]
-    for tfl, sk in zip(term_flush_lsns[1:], sks[1:], strict=False):
-        assert term_flush_lsns[0] == tfl, (
-            f"(last_log_term, flush_lsn) are not equal on sks {sks[0].id} and {sk.id}: {term_flush_lsns[0]} != {tfl}"
-        )
-
-    # check that WALs are identic.
-    segs = [sk.list_segments(tenant_id, timeline_id) for sk in sks]
-    for cmp_segs, sk in zip(segs[1:], sks[1:], strict=False):
-        assert segs[0] == cmp_segs, (
-            f"lists of segments on sks {sks[0].id} and {sk.id} are not identic: {segs[0]} and {cmp_segs}"
-        )
-    log.info(f"comparing segs {segs[0]}")
-
-    sk0 = sks[0]
-    for sk in sks[1:]:
-        (_, mismatch, not_regular) = filecmp.cmpfiles(
-            sk0.timeline_dir(tenant_id, timeline_id),
-            sk.timeline_dir(tenant_id, timeline_id),
-            segs[0],
-            shallow=False,
-        )
-        log.info(
-            f"filecmp result mismatch and not regular files:\n\t mismatch={mismatch}\n\t not_regular={not_regular}"
-        )
-
-        for f in mismatch:
-            f1 = sk0.timeline_dir(tenant_id, timeline_id) / f
-            f2 = sk.timeline_dir(tenant_id, timeline_id) / f
-            stdout_filename = f"{f2}.filediff"
-
-            with open(stdout_filename, "w") as stdout_f:
-                subprocess.run(f"xxd {f1} > {f1}.hex ", shell=True)
-                subprocess.run(f"xxd {f2} > {f2}.hex ", shell=True)
-
-                cmd = f"diff {f1}.hex {f2}.hex"
-                subprocess.run([cmd], stdout=stdout_f, shell=True)
-
-            assert (mismatch, not_regular) == (
-                [],
-                [],
-            ), f"WAL segs {f1} and {f2} on sks {sks[0].id} and {sk.id} are not identic"
-
-
 # Wait until flush_lsn on given sks becomes equal, assuming endpoint ep is
 # running. ep is stopped by this function. This is used in tests which check
 # binary equality of WAL segments on safekeepers; which is inherently racy as
@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+from fixtures.common_types import Lsn
+from fixtures.safekeeper.wal_compare import (
+    SIZE_OF_XLOG_LONG_PHD,
+    SIZE_OF_XLOG_SHORT_PHD,
+    XLOG_BLCKSZ,
+    XLOG_PAGE_HEADER,
+    XLOG_RECORD_HEADER,
+    XLP_FIRST_IS_CONTRECORD,
+    _SegmentReader,
+    compare_wal_segments,
+    segment_start_lsn,
+)
+from fixtures.utils import run_only_on_default_postgres, skip_in_debug_build
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+SEGMENT = "000000010000000000000002"
+SEGMENT_LSN = 0x2000000
+XLOG_PAGE_MAGIC = 0xD116
+RM_HEAP_ID = 10
+
+
+def _write(buf: bytearray, pos: int, data: bytes) -> int:
+    """Write record data at `pos`, skipping the page headers like the WAL does"""
+    while data:
+        if pos % XLOG_BLCKSZ == 0:
+            pos += SIZE_OF_XLOG_LONG_PHD if pos == 0 else SIZE_OF_XLOG_SHORT_PHD
+        take = min(len(data), XLOG_BLCKSZ - pos % XLOG_BLCKSZ)
+        buf[pos : pos + take] = data[:take]
+        pos += take
+        data = data[take:]
+    return pos
+
+
+def _page_header(buf: bytearray, page: int, info: int = 0, rem_len: int = 0):
+    header = XLOG_PAGE_HEADER.pack(
+        XLOG_PAGE_MAGIC, info, 1, SEGMENT_LSN + page * XLOG_BLCKSZ, rem_len
+    )
+    buf[page * XLOG_BLCKSZ : page * XLOG_BLCKSZ + len(header)] = header
+
+
+def _record(tot_len: int, xid: int) -> bytes:
+    header = XLOG_RECORD_HEADER.pack(tot_len, xid, 0, 0, RM_HEAP_ID, 0)
+    return header + bytes([xid]) * (tot_len - len(header))
+
+
+def _segment() -> bytearray:
+    """
+    Two pages of WAL: a record, then one that continues on the second page, then
+    a record after that one, then zeroes
+    """
+    buf = bytearray(2 * XLOG_BLCKSZ)
+    _page_header(buf, 0)
+    assert _write(buf, 40, _record(100, 1)) == 140
+    # 8048 bytes on the first page, 52 on the second, after its header
+    assert _write(buf, 144, _record(8100, 2)) == 8268
+    _page_header(buf, 1, XLP_FIRST_IS_CONTRECORD, rem_len=52)
+    assert _write(buf, 8272, _record(50, 3)) == 8322
+    return buf
+
+
+@run_only_on_default_postgres(reason="does not use postgres")
+@skip_in_debug_build("unit test for test support, either build works")
+def test_segment_records():
+    assert segment_start_lsn(SEGMENT) == Lsn(SEGMENT_LSN)
+    assert segment_start_lsn(f"{SEGMENT}.partial") == Lsn(SEGMENT_LSN)
+
+    reader = _SegmentReader(bytes(_segment()), Lsn(SEGMENT_LSN))
+    records = list(reader.records())
+    assert [(start, end) for start, end, _ in records] == [(40, 140), (144, 8268), (8272, 8322)]
+    assert [(r.lsn, r.tot_len, r.xid) for _, _, r in records if r is not None] == [
+        (Lsn(SEGMENT_LSN + 40), 100, 1),
+        (Lsn(SEGMENT_LSN + 144), 8100, 2),
+        (Lsn(SEGMENT_LSN + 8272), 50, 3),
+    ]
+
+    # The record split across pages is read back without the page header in between
+    data, end = reader.read(144, 8100)
+    assert end == 8268
+    assert data == _record(8100, 2)
+
+
+@run_only_on_default_postgres(reason="does not use postgres")
+@skip_in_debug_build("unit test for test support, either build works")
+def test_segment_starting_with_continuation():
+    buf = bytearray(XLOG_BLCKSZ)
+    _page_header(buf, 0, XLP_FIRST_IS_CONTRECORD, rem_len=30)
+    _write(buf, 72, _record(60, 4))
+
+    reader = _SegmentReader(bytes(buf), Lsn(SEGMENT_LSN))
+    records = list(reader.records())
+    assert [(start, end, r is None) for start, end, r in records] == [
+        (0, 70, True),
+        (72, 132, False),
+    ]
+    assert reader.describe(50) == "in the continuation of a record from the previous segment"
+
+
+@run_only_on_default_postgres(reason="does not use postgres")
+@skip_in_debug_build("unit test for test support, either build works")
+def test_segment_describe():
+    reader = _SegmentReader(bytes(_segment()), Lsn(SEGMENT_LSN))
+
+    assert reader.describe(10) == f"in the header of the page at {Lsn(SEGMENT_LSN)}"
+    assert reader.describe(8200) == f"in the header of the page at {Lsn(SEGMENT_LSN + 8192)}"
+    assert reader.describe(142) == f"in the padding after {Lsn(SEGMENT_LSN + 140)}"
+    assert reader.describe(9000) == f"past the end of the WAL at {Lsn(SEGMENT_LSN + 8322)}"
+    # Both parts of the record split across pages
+    for offset in [200, 8220]:
+        assert reader.describe(offset).startswith(f"in record at {Lsn(SEGMENT_LSN + 144)}: Heap ")
+
+
+@run_only_on_default_postgres(reason="does not use postgres")
+@skip_in_debug_build("unit test for test support, either build works")
+def test_compare_wal_segments(test_output_dir: Path):
+    dirs = []
+    for label in ["sk1", "sk2", "sk3"]:
+        d = test_output_dir / label
+        d.mkdir()
+        (d / SEGMENT).write_bytes(_segment())
+        dirs.append((label, d))
+
+    assert compare_wal_segments(dirs, [SEGMENT]) == []
+
+    broken = _segment()
+    broken[8220] ^= 0xFF
+    (test_output_dir / "sk3" / SEGMENT).write_bytes(broken)
+    (mismatch,) = compare_wal_segments(dirs, [SEGMENT])
+    assert (mismatch.reference, mismatch.other, mismatch.offset) == ("sk1", "sk3", 8220)
+    assert mismatch.location.startswith(f"in record at {Lsn(SEGMENT_LSN + 144)}")
@@ -33,6 +33,9 @@ from ssl import Purpose
 import websockets
 from fixtures.log_helper import log
 
+# How much to read from the TCP connection at a time; each read becomes one websocket frame
+TCP_READ_SIZE = 64 * 1024
+
 
 # Enable verbose logging of all the traffic
 def enable_verbose_logging():
@@ -51,7 +54,7 @@ async def start_server(tcp_listen_host, tcp_listen_port, ws_url, ctx):
 async def handle_tcp_to_websocket(tcp_reader, ws):
     try:
         while not tcp_reader.at_eof():
-            data = await tcp_reader.read(1024)
+            data = await tcp_reader.read(TCP_READ_SIZE)
 
             await ws.send(data)
     except websockets.exceptions.ConnectionClosedError as e: